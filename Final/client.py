@@ -2,19 +2,22 @@ import socket
 import threading
 import json
 
+import framing
+from presence import PresenceView, SYNC_REQUEST
+
 HOST = '127.0.0.1'
 PORT = 65432
 
 def receive_messages(sock):
+    decoder = framing.FrameDecoder()
+    presence = PresenceView()
     while True:
         try:
-            data = sock.recv(4096)
-            if not data:
+            if not decoder.recv_from(sock):
                 print("Server disconnected.")
                 break
-            # server gửi JSON; parse rồi in
-            try:
-                msg = json.loads(data.decode())
+            # server gửi các frame JSON; một lần recv có thể chứa nhiều frame hoặc một phần frame
+            for msg in decoder.frames():
                 mtype = msg.get('type')
                 if mtype == 'system':
                     print(f"[SYSTEM] {msg.get('msg')}")
@@ -22,12 +25,20 @@ def receive_messages(sock):
                     print(f"{msg.get('from')}: {msg.get('msg')}")
                 elif mtype == 'private':
                     print(f"[PRIVATE] {msg.get('from')}: {msg.get('msg')}")
-                elif mtype == 'user_list':
-                    print("Online:", ", ".join(msg.get('users', [])))
+                elif mtype in ('user_list', 'presence_add', 'presence_remove'):
+                    change = presence.apply(msg)
+                    if change is None:
+                        continue
+                    if change[0] == 'gap':
+                        framing.send(sock, SYNC_REQUEST)
+                    elif change[0] == 'snapshot':
+                        print("Online:", ", ".join(change[1]))
+                    elif change[0] == 'add':
+                        print(f"+ {change[1]} online")
+                    else:
+                        print(f"- {change[1]} offline")
                 else:
-                    print(data.decode())
-            except Exception:
-                print(data.decode())
+                    print(json.dumps(msg))
         except:
             print("Connection closed.")
             break
@@ -41,7 +52,7 @@ def main():
 
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
         s.connect((HOST, PORT))
-        s.sendall(json.dumps({"username": username}).encode())
+        framing.send(s, {"username": username})
         threading.Thread(target=receive_messages, args=(s,), daemon=True).start()
 
         print("Connected to chat! Type messages. Use /w <user> <msg> for private message. Type exit to quit.")
@@ -62,7 +73,7 @@ def main():
                 payload = {"type": "chat_all", "msg": msg}
 
             try:
-                s.sendall(json.dumps(payload).encode())
+                framing.send(s, payload)
             except Exception:
                 print("Failed to send message.")
                 break
@@ -1,11 +1,18 @@
+import queue
 import socket
 import threading
 import tkinter as tk
 from tkinter import messagebox, simpledialog, scrolledtext
-import json
+
+import framing
+from conversations import ALL, Conversation, conversation_path
+from message_view import MessageView
+from presence import PresenceView, SYNC_REQUEST
 
 HOST = '127.0.0.1'
 PORT = 65432
+POLL_MS = 30      # chu kỳ Tk lấy frame từ hàng đợi (ms)
+MAX_BATCH = 500   # số frame tối đa xử lý mỗi lượt, để Tk còn thời gian vẽ và nhận phím/chuột
 
 class ChatClient:
     def __init__(self, root):
@@ -16,7 +23,12 @@ class ChatClient:
 
         self.sock = None
         self.username = None
-        self.current_target = "all"
+        self.current_target = ALL
+        self.presence = PresenceView()
+        # luồng nhận chỉ đẩy frame vào đây; mọi thao tác Tk nằm ở main thread (poll_inbox)
+        self.inbox = queue.SimpleQueue()
+        self.pending_lines = {}   # cuộc trò chuyện -> dòng chờ thêm ở lượt poll kế tiếp
+        self.conversations = {}   # "all" hoặc tên người chat riêng -> Conversation
 
         self.build_ui()
         self.connect_to_server()
@@ -50,6 +62,7 @@ class ChatClient:
         self.text_area.tag_config('me', foreground='#0b93f6', justify='right')
         self.text_area.tag_config('other', foreground='#222222', justify='left')
         self.text_area.tag_config('system', foreground='#888888', justify='center')
+        self.view = MessageView(self.text_area)
 
         # Input area
         bottom = tk.Frame(right, bg="#f5f6fa")
@@ -71,8 +84,10 @@ class ChatClient:
         try:
             self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.sock.connect((HOST, PORT))
-            self.sock.sendall(json.dumps({"username": self.username}).encode())
+            framing.send(self.sock, {"username": self.username})
+            self.view.show(self.conversation(ALL))
             threading.Thread(target=self.receive_messages, daemon=True).start()
+            self.root.after(POLL_MS, self.poll_inbox)
             # Không tự add message ở đây — server sẽ gửi lại chat để đồng bộ
             self.display_message(f"[SYSTEM] Connected as {self.username}", tag='system')
         except Exception as e:
@@ -80,17 +95,37 @@ class ChatClient:
             self.root.destroy()
 
     def receive_messages(self):
+        # chạy ở luồng riêng: không được đụng vào Tk, chỉ đẩy frame vào self.inbox
+        decoder = framing.FrameDecoder()
         while True:
             try:
-                data = self.sock.recv(4096)
-                if not data:
-                    self.display_message("[SYSTEM] Disconnected from server.", tag='system')
+                if not decoder.recv_from(self.sock):
+                    self.inbox.put({"type": "system", "msg": "Disconnected from server."})
                     break
-                # Có thể nhận nhiều lần, nhưng server gửi JSON từng tin
-                msg = json.loads(data.decode())
-                self.handle_message(msg)
-            except Exception:
+                # Một lần recv có thể chứa nhiều frame hoặc chỉ một phần frame
+                for msg in decoder.frames():
+                    self.inbox.put(msg)
+            except framing.FrameError as e:
+                self.inbox.put({"type": "system", "msg": f"Disconnected: {e}"})
+                break
+            except OSError:
+                self.inbox.put({"type": "system", "msg": "Disconnected from server."})
+                break
+
+    def poll_inbox(self):
+        """Main thread: xử lý tối đa MAX_BATCH frame rồi vẽ tất cả trong một lần.
+        1000 tin đến dồn dập = vài lần vẽ, không phải 1000 lần."""
+        for _ in range(MAX_BATCH):
+            try:
+                msg = self.inbox.get_nowait()
+            except queue.Empty:
                 break
+            self.handle_message(msg)
+        for key, lines in self.pending_lines.items():
+            self.view.append(lines, self.conversation(key))
+        self.pending_lines.clear()
+        # còn tồn thì quay lại ngay sau khi Tk xử lý xong sự kiện đang chờ
+        self.root.after(1 if not self.inbox.empty() else POLL_MS, self.poll_inbox)
 
     def handle_message(self, msg):
         mtype = msg.get("type")
@@ -100,59 +135,91 @@ class ChatClient:
             sender = msg.get('from')
             text = msg.get('msg')
             tag = 'me' if sender == self.username else 'other'
-            self.display_message(f"{sender}: {text}", tag=tag)
+            self.display_message(f"{sender}: {text}", tag=tag, key=ALL)
         elif mtype == "private":
             sender = msg.get('from')
             text = msg.get('msg')
-            tag = 'me' if sender == self.username else 'other'
-            self.display_message(f"[PRIVATE] {sender}: {text}", tag=tag)
-        elif mtype == "user_list":
-            self.update_user_list(msg.get('users', []))
+            if sender == self.username:
+                tag = 'me'
+                # tin mình gửi được server gửi lại kèm "to"
+                peer = msg.get('to', self.current_target)
+            else:
+                tag = 'other'
+                peer = sender
+            self.display_message(f"[PRIVATE] {sender}: {text}", tag=tag, key=peer)
+        elif mtype in ("user_list", "presence_add", "presence_remove"):
+            change = self.presence.apply(msg)
+            if change is None:
+                return
+            kind, value = change
+            if kind == "gap":
+                # mất delta: xin snapshot mới, các delta đến trước nó sẽ bị bỏ qua
+                framing.send(self.sock, SYNC_REQUEST)
+            elif kind == "snapshot":
+                self.update_user_list(value)
+            elif value != self.username:
+                if kind == "add":
+                    self.list_users.insert(tk.END, value)
+                else:
+                    self.remove_user(value)
 
     def update_user_list(self, users):
+        """Dựng lại cả Listbox; chỉ dùng cho snapshot (lúc vào và khi resync)."""
         self.list_users.delete(0, tk.END)
         self.list_users.insert(tk.END, "All")
         for u in users:
             if u != self.username:
                 self.list_users.insert(tk.END, u)
 
+    def remove_user(self, user):
+        """Xóa đúng một dòng, giữ nguyên phần còn lại (và dòng đang chọn)."""
+        rows = self.list_users.get(1, tk.END)
+        if user in rows:
+            self.list_users.delete(rows.index(user) + 1)
+            if self.current_target == user:
+                self.open_conversation(ALL)
+
     def select_user(self, event):
         selected = self.list_users.curselection()
         if selected:
             val = self.list_users.get(selected[0])
-            if val == "All":
-                self.current_target = "all"
-                self.lbl_chat_with.config(text="Chat (All)")
-            else:
-                self.current_target = val
-                self.lbl_chat_with.config(text=f"Chat with {val}")
+            self.open_conversation(ALL if val == "All" else val)
         else:
-            self.current_target = "all"
-            self.lbl_chat_with.config(text="Chat (All)")
+            self.open_conversation(ALL)
+
+    def conversation(self, key):
+        conv = self.conversations.get(key)
+        if conv is None:
+            conv = self.conversations[key] = Conversation(conversation_path(self.username, key))
+        return conv
+
+    def open_conversation(self, key):
+        """Đổi cuộc trò chuyện đang xem: chỉ vẽ lại một trang, dài bao nhiêu cũng vậy."""
+        self.current_target = key
+        self.lbl_chat_with.config(text="Chat (All)" if key == ALL else f"Chat with {key}")
+        self.view.show(self.conversation(key))
 
     def send_message(self, event=None):
         text = self.entry_message.get().strip()
         if not text:
             return
 
-        if self.current_target == "all":
+        if self.current_target == ALL:
             payload = {"type": "chat_all", "msg": text}
         else:
             payload = {"type": "chat_private", "to": self.current_target, "msg": text}
 
         try:
-            self.sock.sendall(json.dumps(payload).encode())
+            framing.send(self.sock, payload)
             self.entry_message.delete(0, tk.END)
             # Không gọi display_message tại đây để tránh duplicate — server sẽ echo lại
         except Exception:
             self.display_message("[SYSTEM] Cannot send message. Connection lost.", tag='system')
 
-    def display_message(self, msg, tag='other'):
-        self.text_area.config(state='normal')
-        # mỗi message trên 1 dòng, thêm tag để style
-        self.text_area.insert(tk.END, msg + "\n", tag)
-        self.text_area.config(state='disabled')
-        self.text_area.yview(tk.END)
+    def display_message(self, msg, tag='other', key=None):
+        # mỗi message trên 1 dòng, thêm tag để style; thêm vào cuộc trò chuyện key
+        # (mặc định cuộc đang xem) ở lượt poll_inbox kế tiếp
+        self.pending_lines.setdefault(key or self.current_target, []).append((msg, tag))
 
     def on_close(self):
         if self.sock:
@@ -160,6 +227,8 @@ class ChatClient:
                 self.sock.close()
             except:
                 pass
+        for conv in self.conversations.values():
+            conv.close()
         self.root.destroy()
 
 
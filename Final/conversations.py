@@ -0,0 +1,134 @@
+# conversations.py
+# Lịch sử từng cuộc trò chuyện của client_gui: phòng chung ("all") và mỗi
+# người chat riêng. Mỗi cuộc trò chuyện là một Buffer (message_view.py) giữ
+# RING_LINES dòng mới nhất trong bộ nhớ và ghi thêm mọi tin vào
+#   chat_history/<user>/all.jsonl        (phòng chung)
+#   chat_history/<user>/@<người kia>.jsonl (chat riêng)
+# mỗi dòng là ["nội dung", "tag"]. Phần cũ hơn bộ nhớ được đọc ngược từ cuối
+# file khi người dùng kéo lên, từng trang một: mở một cuộc trò chuyện không
+# phải đọc cả file, dài bao nhiêu cũng vậy.
+#
+# Dòng hệ thống (tag 'system') chỉ hiển thị, không ghi xuống đĩa.
+# Chỉ dùng từ luồng Tk (main thread), như message_view.
+
+import json
+import os
+from urllib.parse import quote
+
+from message_view import Buffer
+
+HISTORY_DIR = "chat_history"
+RING_LINES = 2000        # số dòng mỗi cuộc trò chuyện giữ trong bộ nhớ
+READ_BLOCK = 64 * 1024   # đọc ngược file theo từng khối này
+LOG_EXT = ".jsonl"
+ALL = "all"
+
+
+def conversation_path(username, key):
+    # quote: tên có dấu/ký tự đặc biệt vẫn ra tên file hợp lệ và không trùng nhau
+    name = "all" if key == ALL else "@" + quote(key, safe='')
+    return os.path.join(HISTORY_DIR, quote(username, safe=''), name + LOG_EXT)
+
+
+class Conversation(Buffer):
+    def __init__(self, path, history_limit=RING_LINES):
+        super().__init__(history_limit)
+        self.path = path
+        self.offsets = []   # offsets[i]: vị trí trong file nơi lines[i:] bắt đầu
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.size = self._repair_tail()
+        self.disk_pos = self.size  # phần file trước vị trí này chưa được nạp vào bộ nhớ
+        self._fh = open(path, 'ab')
+
+    def _repair_tail(self):
+        """Cắt dòng ghi dở ở cuối file (chương trình bị tắt giữa chừng); trả về kích thước file.
+        Chỉ đọc phần cuối file, không đọc cả file."""
+        try:
+            f = open(self.path, 'rb+')
+        except FileNotFoundError:
+            return 0
+        with f:
+            size = f.seek(0, os.SEEK_END)
+            end = size
+            while end > 0:
+                start = max(0, end - READ_BLOCK)
+                f.seek(start)
+                chunk = f.read(end - start)
+                if end == size and chunk.endswith(b'\n'):
+                    return size
+                cut = chunk.rfind(b'\n')
+                if cut >= 0:
+                    end = start + cut + 1
+                    break
+                end = start
+            f.truncate(end)
+            return end
+
+    # ---- Buffer ----
+    def extend(self, batch):
+        chunks = []
+        for text, tag in batch:
+            self.offsets.append(self.size)
+            if tag != 'system':
+                data = json.dumps([text, tag], ensure_ascii=False).encode('utf-8') + b'\n'
+                chunks.append(data)
+                self.size += len(data)
+        if chunks:
+            # một lần write cho cả loạt
+            self._fh.write(b''.join(chunks))
+            self._fh.flush()
+        super().extend(batch)
+
+    def has_older(self):
+        return self.disk_pos > 0
+
+    def fetch_older(self, n):
+        if n <= 0 or self.disk_pos == 0:
+            return 0
+        # đọc ngược từ disk_pos tới khi có đủ n dòng trọn vẹn
+        pos = self.disk_pos
+        chunks = []
+        newlines = 0
+        with open(self.path, 'rb') as f:
+            while pos > 0 and newlines <= n:
+                step = min(READ_BLOCK, pos)
+                pos -= step
+                f.seek(pos)
+                chunk = f.read(step)
+                newlines += chunk.count(b'\n')
+                chunks.append(chunk)
+        records = b''.join(reversed(chunks)).split(b'\n')[:-1]
+        start = pos
+        if pos > 0:
+            # dòng đầu bị cắt ngang (phần đầu của nó nằm trước pos)
+            start += len(records[0]) + 1
+            records = records[1:]
+        for record in records[:-n]:
+            start += len(record) + 1
+        records = records[-n:]
+        self.disk_pos = start
+        batch, offsets = [], []
+        for record in records:
+            try:
+                text, tag = json.loads(record)
+                batch.append((text, tag))
+                offsets.append(start)
+            except (ValueError, TypeError):
+                pass  # bỏ qua dòng hỏng
+            start += len(record) + 1
+        self.lines[0:0] = batch
+        self.offsets[0:0] = offsets
+        self.first += len(batch)
+        self.last += len(batch)
+        if self.top is not None:
+            self.top += len(batch)
+        return len(batch)
+
+    def drop_oldest(self, n):
+        # các dòng bị bỏ vẫn còn trên đĩa: lần kéo lên sau sẽ đọc lại từ đây
+        self.disk_pos = self.offsets[n] if n < len(self.offsets) else self.size
+        del self.offsets[:n]
+        super().drop_oldest(n)
+
+    def close(self):
+        self._fh.close()
@@ -0,0 +1,94 @@
+# framing.py
+# Đóng gói tin nhắn dạng length-prefixed dùng chung cho server.py, client.py, client_gui.py:
+#   [4 byte độ dài, big-endian][JSON UTF-8]
+# TCP có thể gộp hoặc cắt các lần gửi, nên bên nhận phải dùng FrameDecoder để
+# tách đúng từng frame thay vì coi mỗi recv() là một JSON.
+
+import json
+import struct
+
+HEADER = struct.Struct('!I')
+MAX_FRAME_SIZE = 1024 * 1024  # 1 MiB
+
+
+class FrameError(ValueError):
+    """Frame vượt quá max_frame_size (hoặc dữ liệu không phải frame hợp lệ)."""
+
+
+def encode(message, max_frame_size=MAX_FRAME_SIZE):
+    """Encode một message (dict) thành frame bytes."""
+    payload = json.dumps(message).encode('utf-8')
+    if len(payload) > max_frame_size:
+        raise FrameError(f"frame too large: {len(payload)} bytes")
+    return HEADER.pack(len(payload)) + payload
+
+
+class FrameDecoder:
+    """Bộ giải mã tăng dần.
+
+    Dữ liệu được nhận thẳng vào một bytearray cấp sẵn (recv_into) và chỉ đọc
+    qua memoryview, không nối chuỗi. Phần dư của frame chưa trọn được dời về
+    đầu buffer khi cần chỗ; buffer chỉ nới rộng khi gặp frame lớn hơn nó.
+    """
+
+    def __init__(self, max_frame_size=MAX_FRAME_SIZE, bufsize=64 * 1024):
+        self.max_frame_size = max_frame_size
+        self._buf = bytearray(bufsize)
+        self._start = 0  # vị trí frame chưa đọc đầu tiên
+        self._end = 0    # cuối dữ liệu đã nhận
+
+    def _make_room(self, need):
+        """Đảm bảo còn ít nhất need byte trống sau _end."""
+        if len(self._buf) - self._end >= need:
+            return
+        pending = self._end - self._start
+        if self._start:
+            self._buf[:pending] = self._buf[self._start:self._end]
+            self._start, self._end = 0, pending
+        if len(self._buf) - self._end < need:
+            self._buf.extend(bytes(need - (len(self._buf) - self._end)))
+
+    def recv_from(self, sock, size=4096):
+        """Nhận dữ liệu từ socket vào buffer. Trả về số byte (0 = đã ngắt kết nối)."""
+        self._make_room(size)
+        with memoryview(self._buf) as view:
+            n = sock.recv_into(view[self._end:])
+        self._end += n
+        return n
+
+    def feed(self, data):
+        """Thêm dữ liệu đã nhận theo cách khác (vd. từ test)."""
+        self._make_room(len(data))
+        self._buf[self._end:self._end + len(data)] = data
+        self._end += len(data)
+
+    def frames(self):
+        """Trả về list các message đã nhận trọn. Frame có JSON hỏng bị bỏ qua;
+        frame vượt max_frame_size gây FrameError."""
+        out = []
+        buf = self._buf
+        start, end = self._start, self._end
+        while end - start >= HEADER.size:
+            (length,) = HEADER.unpack_from(buf, start)
+            if length > self.max_frame_size:
+                raise FrameError(f"frame too large: {length} bytes")
+            if end - start - HEADER.size < length:
+                # chưa đủ dữ liệu; dành sẵn chỗ cho phần còn lại của frame
+                self._start = start
+                self._make_room(length + HEADER.size - (end - start))
+                return out
+            body = start + HEADER.size
+            try:
+                out.append(json.loads(buf[body:body + length]))
+            except ValueError:
+                pass
+            start = body + length
+        if start == end:
+            start = end = 0
+        self._start, self._end = start, end
+        return out
+
+
+def send(sock, message):
+    """Gửi một message đã đóng khung (chặn cho đến khi gửi xong)."""
+    sock.sendall(encode(message))
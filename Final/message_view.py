@@ -0,0 +1,199 @@
+# message_view.py
+# Khung tin nhắn cho client_gui. Mỗi cuộc trò chuyện có một Buffer riêng (lịch
+# sử trong bộ nhớ + vị trí đang xem); MessageView hiển thị một buffer tại một
+# thời điểm và ScrolledText chỉ chứa một "cửa sổ" tối đa WINDOW dòng của nó.
+# Kéo lên tới đầu thì nạp thêm PAGE dòng cũ hơn (hết trong bộ nhớ thì buffer
+# đọc tiếp từ đĩa, xem conversations.py), kéo xuống tới cuối thì nạp các dòng
+# mới hơn; phần thừa ở đầu kia bị xóa khỏi widget (vẫn còn trong buffer).
+#
+# Tin mới chỉ được vẽ ngay khi buffer đang hiển thị và người dùng đang ở cuối;
+# còn lại chỉ lưu vào buffer, mở ra hoặc kéo xuống cuối sẽ thấy. Đổi buffer
+# (show) chỉ vẽ lại tối đa PAGE dòng, không phụ thuộc độ dài cuộc trò chuyện.
+#
+# Chỉ gọi từ luồng Tk (main thread).
+
+import tkinter as tk
+
+WINDOW = 1000           # số dòng tối đa trong widget
+PAGE = 200              # số dòng nạp thêm mỗi lần chạm đầu/cuối
+HISTORY_LIMIT = 20000   # số dòng mỗi buffer giữ trong bộ nhớ; cũ hơn thì bỏ
+
+
+class Buffer:
+    """Lịch sử một cuộc trò chuyện trong bộ nhớ, không đụng tới Tk.
+
+    Giữ tối đa khoảng history_limit dòng mới nhất: dòng cũ bị bỏ theo từng đợt
+    10% (như một vòng đệm, nhưng vẫn cắt lát được). Lớp con nạp lại dòng cũ
+    từ nơi khác qua fetch_older()."""
+
+    def __init__(self, history_limit=HISTORY_LIMIT):
+        self.history_limit = history_limit
+        self.lines = []     # (nội dung, tag)
+        self.first = 0      # lines[first:last] đang nằm trong widget (khi được hiển thị)
+        self.last = 0
+        self.top = None     # dòng ở mép trên lúc bị ẩn đi; None = đang xem tin mới nhất
+
+    def extend(self, batch):
+        self.lines.extend(batch)
+
+    def has_older(self):
+        """Còn dòng cũ hơn lines[0] để nạp không."""
+        return False
+
+    def fetch_older(self, n):
+        """Thêm tối đa n dòng cũ hơn vào đầu lines; trả về số dòng đã thêm."""
+        return 0
+
+    def drop_oldest(self, n):
+        del self.lines[:n]
+        self.first -= n
+        self.last -= n
+        if self.top is not None:
+            self.top = max(0, self.top - n)
+
+    def trim(self, keep_from=None):
+        """Bỏ bớt dòng cũ khi vượt history_limit; không bỏ từ keep_from trở đi."""
+        if len(self.lines) <= self.history_limit + self.history_limit // 10:
+            return 0
+        drop = len(self.lines) - self.history_limit
+        if keep_from is not None:
+            drop = min(drop, keep_from)
+        if drop > 0:
+            self.drop_oldest(drop)
+        return drop
+
+
+class MessageView:
+    def __init__(self, text, window=WINDOW, page=PAGE, history_limit=HISTORY_LIMIT):
+        self.text = text
+        self.window = window
+        self.page = page
+        self.buf = Buffer(history_limit)  # buffer đang hiển thị
+        self.paging = False
+        # ScrolledText nối yscrollcommand thẳng vào thanh cuộn; chen vào giữa để
+        # biết khi nào người dùng chạm đầu/cuối
+        self.vbar_set = text.vbar.set
+        text.configure(yscrollcommand=self._on_scroll)
+
+    # ---- dữ liệu ----
+    def append(self, batch, buf=None):
+        """Thêm một loạt dòng [(nội dung, tag), ...] vào buf (mặc định buffer đang
+        hiển thị). Nếu buf đang hiển thị và đang ở cuối: một lần insert, một lần cuộn."""
+        if not batch:
+            return
+        buf = buf or self.buf
+        if buf is not self.buf:
+            buf.extend(batch)
+            buf.trim()
+            return
+        live = buf.last == len(buf.lines) and self._at_bottom()
+        buf.extend(batch)
+        if live:
+            self._edit(self._insert_end, batch)
+            overflow = (buf.last - buf.first) - self.window
+            if overflow > 0:
+                self._edit(self._delete_top, overflow)
+            self.text.yview(tk.END)
+        # không bỏ những dòng đang nằm trong widget (drop_oldest dời first/last theo)
+        buf.trim(keep_from=buf.first)
+
+    def show(self, buf):
+        """Chuyển sang hiển thị buf: nhớ vị trí của buffer cũ, vẽ tối đa PAGE dòng
+        của buffer mới (từ vị trí đã nhớ, hoặc các dòng mới nhất)."""
+        if buf is self.buf:
+            return
+        old = self.buf
+        if old.last == len(old.lines) and self._at_bottom():
+            old.top = None
+        else:
+            old.top = self._top_line()
+        old.first = old.last = 0
+        self.buf = buf
+        self.paging = False
+        if buf.top is None:
+            if len(buf.lines) < self.page and buf.has_older():
+                buf.fetch_older(self.page - len(buf.lines))
+            start = max(0, len(buf.lines) - self.page)
+        else:
+            start = min(buf.top, len(buf.lines))
+        buf.first = buf.last = start
+        self._edit(lambda: self.text.delete('1.0', tk.END))
+        self._edit(self._insert_end, buf.lines[start:start + self.page])
+        if buf.top is None:
+            self.text.yview(tk.END)
+        else:
+            self.text.yview('1.0')
+
+    # ---- phân trang ----
+    def _on_scroll(self, first, last):
+        self.vbar_set(first, last)
+        if self.paging:
+            return
+        buf = self.buf
+        if float(first) <= 0.0 and (buf.first > 0 or buf.has_older()):
+            self.paging = True
+            self.text.after_idle(self._load_older)
+        elif float(last) >= 1.0 and buf.last < len(buf.lines):
+            self.paging = True
+            self.text.after_idle(self._load_newer)
+
+    def _load_older(self):
+        buf = self.buf
+        if buf.first < self.page:
+            buf.fetch_older(self.page - buf.first)  # dời first/last theo số dòng thêm vào
+        top = self._top_line()
+        n = min(self.page, buf.first)
+        batch = buf.lines[buf.first - n:buf.first]
+        self._edit(self._insert_top, batch)
+        overflow = (buf.last - buf.first) - self.window
+        if overflow > 0:
+            self._edit(self._delete_bottom, overflow)
+        self._show(top)
+        self.paging = False
+
+    def _load_newer(self):
+        buf = self.buf
+        top = self._top_line()
+        batch = buf.lines[buf.last:buf.last + self.page]
+        self._edit(self._insert_end, batch)
+        overflow = (buf.last - buf.first) - self.window
+        if overflow > 0:
+            self._edit(self._delete_top, overflow)
+        self._show(top)
+        self.paging = False
+
+    # ---- thao tác trên widget (dòng k của widget = self.buf.lines[self.buf.first + k - 1]) ----
+    def _edit(self, fn, *args):
+        self.text.config(state='normal')
+        fn(*args)
+        self.text.config(state='disabled')
+
+    def _insert_end(self, batch):
+        if batch:
+            # một lệnh insert cho cả loạt: Tk chỉ tính lại layout một lần
+            self.text.insert(tk.END, *[x for line, tag in batch for x in (line + "\n", tag)])
+            self.buf.last += len(batch)
+
+    def _insert_top(self, batch):
+        if batch:
+            self.text.insert('1.0', *[x for line, tag in batch for x in (line + "\n", tag)])
+            self.buf.first -= len(batch)
+
+    def _delete_top(self, n):
+        self.text.delete('1.0', f'{n + 1}.0')
+        self.buf.first += n
+
+    def _delete_bottom(self, n):
+        keep = self.buf.last - self.buf.first - n
+        self.text.delete(f'{keep + 1}.0', tk.END)
+        self.buf.last -= n
+
+    def _at_bottom(self):
+        return self.text.yview()[1] >= 1.0
+
+    def _top_line(self):
+        """Chỉ số (trong self.buf.lines) của dòng đang ở mép trên."""
+        return self.buf.first + int(self.text.index('@0,0').split('.')[0]) - 1
+
+    def _show(self, index):
+        self.text.yview(f'{index - self.buf.first + 1}.0')
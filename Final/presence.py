@@ -0,0 +1,49 @@
+# presence.py
+# Danh sách người online phía client, cập nhật bằng delta có đánh số phiên bản.
+#
+# Server gửi:
+#   {"type": "user_list", "users": [...], "version": v}   - snapshot (lúc vào phòng / khi resync)
+#   {"type": "presence_add", "user": u, "seq": v}         - u vừa vào
+#   {"type": "presence_remove", "user": u, "seq": v}      - u vừa thoát
+# Mỗi thay đổi tăng version đúng 1. Nếu client thấy seq nhảy cóc (vd. tin bị bỏ
+# do hàng đợi đầy) thì gửi {"type": "presence_sync"} để xin snapshot mới.
+
+SYNC_REQUEST = {"type": "presence_sync"}
+
+
+class PresenceView:
+    def __init__(self):
+        self.users = {}       # username -> None, giữ thứ tự vào
+        self.version = None   # None = chưa có snapshot
+        self.syncing = False  # đã xin snapshot, đang chờ
+
+    def apply(self, msg):
+        """Áp dụng một frame presence. Trả về:
+            ('snapshot', users) - thay toàn bộ danh sách
+            ('add', user) / ('remove', user) - sửa một dòng
+            ('gap', None)       - mất delta; gửi SYNC_REQUEST rồi chờ snapshot
+            None                - frame cũ hoặc thừa, bỏ qua
+        """
+        mtype = msg.get("type")
+        if mtype == "user_list":
+            self.users = dict.fromkeys(msg.get("users", []))
+            self.version = msg.get("version")
+            self.syncing = False
+            return "snapshot", list(self.users)
+        seq = msg.get("seq")
+        if self.syncing or self.version is None or seq is None or seq <= self.version:
+            return None
+        if seq != self.version + 1:
+            self.syncing = True
+            return "gap", None
+        self.version = seq
+        user = msg.get("user")
+        if mtype == "presence_add":
+            if user in self.users:
+                return None
+            self.users[user] = None
+            return "add", user
+        if user not in self.users:
+            return None
+        del self.users[user]
+        return "remove", user
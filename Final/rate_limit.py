@@ -0,0 +1,17 @@
+# rate_limit.py
+# Giới hạn tốc độ gửi của client (token bucket, theo kết nối và theo IP).
+#
+# Final dùng chung cài đặt với chat-app: module này nạp chat-app/rate_limit.py
+# và đứng tên rate_limit thay cho nó, nên `import rate_limit` trong Final vẫn
+# như cũ mà chỉ có một bản để sửa. Tài liệu và API: xem file đó.
+
+import importlib.util
+import os
+import sys
+
+_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'chat-app', 'rate_limit.py')
+
+_spec = importlib.util.spec_from_file_location(__name__, _PATH)
+_module = importlib.util.module_from_spec(_spec)
+sys.modules[__name__] = _module
+_spec.loader.exec_module(_module)
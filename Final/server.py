@@ -1,99 +1,252 @@
 import socket
 import threading
-import json
+import time
+from collections import deque
+
+import framing
+import rate_limit
 
 HOST = '127.0.0.1'
 PORT = 65432
 
-clients = {}  # username -> conn
+# Hàng đợi gửi của mỗi client có giới hạn. Khi đầy (client đọc chậm):
+#   'drop_oldest' - bỏ tin cũ nhất
+#   'disconnect'  - ngắt kết nối client đó
+#   'coalesce'    - tin có key (vd. user_list) thay thế tin cùng key đang chờ,
+#                   nếu vẫn đầy thì bỏ tin cũ nhất
+SEND_QUEUE_SIZE = 256
+SLOW_CONSUMER_POLICY = 'drop_oldest'
+
+# Giới hạn tốc độ gửi của mỗi client (xem rate_limit.py); 0 = không giới hạn.
+# Mặc định tắt hết, muốn dùng thì đặt các hằng dưới đây (vd. RATE_MSGS = 20,
+# RATE_BYTES = 64 * 1024). Giới hạn theo IP nên để tắt nếu nhiều người dùng
+# chung một IP (NAT).
+RATE_MSGS = 0               # tin/giây mỗi kết nối
+RATE_BYTES = 0              # byte/giây mỗi kết nối
+RATE_IP_MSGS = 0            # tin/giây cho mọi kết nối từ một IP
+RATE_IP_BYTES = 0           # byte/giây cho mọi kết nối từ một IP
+RATE_LIMIT_POLICY = rate_limit.DELAY  # DELAY, DROP hoặc DISCONNECT
+limiter = None  # None = không giới hạn
+if RATE_MSGS or RATE_BYTES or RATE_IP_MSGS or RATE_IP_BYTES:
+    limiter = rate_limit.RateLimiter(rate_limit.Limits(RATE_MSGS, RATE_BYTES),
+                                     rate_limit.Limits(RATE_IP_MSGS, RATE_IP_BYTES), RATE_LIMIT_POLICY)
+
+clients = {}  # username -> ClientSender
 lock = threading.Lock()
+# tăng 1 mỗi lần có người vào/ra; client dùng để phát hiện mất delta (xem presence.py)
+presence_version = 0
+
+
+class ClientSender:
+    """Hàng đợi gửi + thread ghi riêng cho một client, để client chậm không chặn người khác."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.items = deque()  # [key, data]
+        self.keyed = {}
+        self.closed = False
+        self.cond = threading.Condition()
+        threading.Thread(target=self._write_loop, daemon=True).start()
+
+    def send(self, data, key=None):
+        """Đưa frame (bytes đã encode) vào hàng đợi, không bao giờ chặn."""
+        with self.cond:
+            if self.closed:
+                return
+            if key is not None and SLOW_CONSUMER_POLICY == 'coalesce' and key in self.keyed:
+                self.keyed[key][1] = data
+                return
+            if len(self.items) >= SEND_QUEUE_SIZE:
+                if SLOW_CONSUMER_POLICY == 'disconnect':
+                    self.closed = True
+                    self.items.clear()
+                    self.cond.notify()
+                    try:
+                        self.conn.shutdown(socket.SHUT_RDWR)
+                    except OSError:
+                        pass
+                    return
+                old = self.items.popleft()
+                if self.keyed.get(old[0]) is old:
+                    del self.keyed[old[0]]
+            cell = [key, data]
+            self.items.append(cell)
+            if key is not None and SLOW_CONSUMER_POLICY == 'coalesce':
+                self.keyed[key] = cell
+            self.cond.notify()
+
+    def close(self):
+        """Gửi nốt các tin đang chờ rồi đóng socket."""
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+
+    def _write_loop(self):
+        try:
+            while True:
+                with self.cond:
+                    while not self.items and not self.closed:
+                        self.cond.wait()
+                    if not self.items:
+                        break
+                    # frame có độ dài ở đầu nên có thể gửi cả lô trong một lần
+                    batch = b''.join(cell[1] for cell in self.items)
+                    self.items.clear()
+                    self.keyed.clear()
+                self.conn.sendall(batch)
+        except OSError:
+            pass
+        finally:
+            try:
+                self.conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.conn.close()
+
+
+def encode(message):
+    """Encode message (thành frame) một lần; bytes bất biến nên dùng chung cho mọi hàng đợi."""
+    return framing.encode(message)
 
 
 def broadcast(message, exclude=None):
     """Gửi message đến tất cả client. Nếu exclude != None thì sẽ bỏ user đó."""
+    data = encode(message)
     with lock:
-        for user, conn in list(clients.items()):
-            if user == exclude:
-                continue
-            try:
-                conn.sendall(json.dumps(message).encode())
-            except Exception:
-                try:
-                    conn.close()
-                except:
-                    pass
-                del clients[user]
+        senders = [sender for user, sender in clients.items() if user != exclude]
+    for sender in senders:
+        sender.send(data)
 
 
-def update_user_list():
-    """Gửi danh sách người online cho tất cả client."""
-    with lock:
-        user_list = list(clients.keys())
-    msg = {"type": "user_list", "users": user_list}
-    broadcast(msg)
+def send_snapshot(sender):
+    """Gửi toàn bộ danh sách online kèm version (lúc mới vào hoặc khi client xin resync).
+    Phải gọi khi đang giữ lock để snapshot nằm đúng thứ tự với các delta."""
+    data = encode({"type": "user_list", "users": list(clients.keys()), "version": presence_version})
+    sender.send(data, key="user_list")
 
 
-def handle_client(conn):
+def publish_presence(mtype, username, exclude=None):
+    """Gửi delta presence_add/presence_remove cho mọi client thay vì cả danh sách.
+    Phải gọi khi đang giữ lock: delta được đưa vào hàng đợi theo đúng thứ tự seq
+    (send() không bao giờ chặn nên giữ lock ở đây vẫn rẻ)."""
+    global presence_version
+    presence_version += 1
+    data = encode({"type": mtype, "user": username, "seq": presence_version})
+    for user, sender in clients.items():
+        if user != exclude:
+            sender.send(data)
+
+
+def handle_message(username, sender, msg):
+    """Xử lý một frame từ client đã đăng nhập."""
+    msg_type = msg.get("type")
+
+    if msg_type == "chat_all":
+        text = msg.get("msg", "")
+        # Gửi cho tất cả (bao gồm cả người gửi) để đảm bảo sender cũng thấy tin
+        broadcast({"type": "chat", "from": username, "msg": text}, exclude=None)
+    elif msg_type == "chat_private":
+        target = msg.get("to")
+        text = msg.get("msg", "")
+        with lock:
+            target_sender = clients.get(target)
+        if target_sender:
+            data = encode({"type": "private", "from": username, "to": target, "msg": text})
+            target_sender.send(data)
+            # gửi lại cho chính mình để hiển thị (nếu muốn duplicate không xảy ra vì server chỉ gửi 1 lần back)
+            sender.send(data)
+        else:
+            sender.send(encode({"type": "system", "msg": f"User {target} not found!"}))
+    elif msg_type == "presence_sync":
+        # client thấy seq nhảy cóc: gửi lại snapshot
+        with lock:
+            send_snapshot(sender)
+
+
+def admit(sender, bucket):
+    """Áp giới hạn tốc độ cho một frame: True = xử lý, False = bỏ. Với 'delay'
+    thì ngủ luôn ở đây: trong lúc đó không đọc socket, TCP làm client chậm lại."""
+    dropping = bucket.dropping
+    try:
+        wait = limiter.admit(bucket)
+    except rate_limit.RateLimitExceeded:
+        sender.send(encode({"type": "system", "msg": "Disconnected: sending too fast."}))
+        raise
+    if wait is None:
+        if not dropping:
+            # báo một lần cho mỗi đợt bị bỏ, không phải mỗi frame
+            sender.send(encode({"type": "system", "msg": "You are sending too fast, messages were dropped."}))
+        return False
+    if wait:
+        time.sleep(wait)
+    return True
+
+
+def handle_client(conn, addr):
     username = None
+    sender = None
+    bucket = limiter.open(addr[0]) if limiter else None
     try:
-        data = conn.recv(1024).decode()
-        info = json.loads(data)
+        decoder = framing.FrameDecoder()
+        # frame đầu tiên là {"username": ...}; các frame đến cùng lúc với nó được giữ trong pending
+        pending = []
+        while not pending:
+            n = decoder.recv_from(conn)
+            if not n:
+                return
+            if limiter:
+                limiter.received(bucket, n)
+            pending = decoder.frames()
+        info = pending.pop(0)
         username = info.get("username")
 
         if not username:
-            conn.sendall(json.dumps({"type": "system", "msg": "Invalid username."}).encode())
+            framing.send(conn, {"type": "system", "msg": "Invalid username."})
             conn.close()
             return
 
         with lock:
             if username in clients:
-                conn.sendall(json.dumps({"type": "system", "msg": "Username already taken!"}).encode())
+                framing.send(conn, {"type": "system", "msg": "Username already taken!"})
                 conn.close()
                 return
-            clients[username] = conn
+            sender = ClientSender(conn)
+            clients[username] = sender
+            # người mới nhận snapshot, những người khác chỉ nhận một delta
+            publish_presence("presence_add", username, exclude=username)
+            send_snapshot(sender)
 
         # Thông báo cho mọi người (trừ người mới) rằng có người tham gia
         broadcast({"type": "system", "msg": f"{username} has joined the chat!"}, exclude=username)
-        update_user_list()
 
         while True:
-            data = conn.recv(2048)
-            if not data:
+            for msg in pending:
+                if not limiter or admit(sender, bucket):
+                    handle_message(username, sender, msg)
+            n = decoder.recv_from(conn)
+            if not n:
                 break
-            msg = json.loads(data.decode())
-            msg_type = msg.get("type")
-
-            if msg_type == "chat_all":
-                text = msg.get("msg", "")
-                # Gửi cho tất cả (bao gồm cả người gửi) để đảm bảo sender cũng thấy tin
-                broadcast({"type": "chat", "from": username, "msg": text}, exclude=None)
-            elif msg_type == "chat_private":
-                target = msg.get("to")
-                text = msg.get("msg", "")
-                with lock:
-                    target_conn = clients.get(target)
-                if target_conn:
-                    try:
-                        target_conn.sendall(json.dumps({"type": "private", "from": username, "msg": text}).encode())
-                        # gửi lại cho chính mình để hiển thị (nếu muốn duplicate không xảy ra vì server chỉ gửi 1 lần back)
-                        conn.sendall(json.dumps({"type": "private", "from": username, "msg": text}).encode())
-                    except Exception:
-                        conn.sendall(json.dumps({"type": "system", "msg": f"Failed to deliver to {target}."}).encode())
-                else:
-                    conn.sendall(json.dumps({"type": "system", "msg": f"User {target} not found!"}).encode())
+            if limiter:
+                limiter.received(bucket, n)
+            pending = decoder.frames()
     except Exception:
         pass
     finally:
-        with lock:
-            if username and username in clients:
-                del clients[username]
-        if username:
+        if limiter:
+            limiter.close(bucket)
+        if sender:
+            with lock:
+                if clients.get(username) is sender:
+                    del clients[username]
+                    publish_presence("presence_remove", username)
             broadcast({"type": "system", "msg": f"{username} has left the chat!"})
-            update_user_list()
-        try:
-            conn.close()
-        except:
-            pass
+            # thread ghi sẽ gửi nốt tin đang chờ rồi đóng socket
+            sender.close()
+        else:
+            try:
+                conn.close()
+            except:
+                pass
 
 
 def main():
@@ -104,8 +257,8 @@ def main():
         print(f"[SERVER STARTED] Listening on {HOST}:{PORT}")
 
         while True:
-            conn, _ = s.accept()
-            threading.Thread(target=handle_client, args=(conn,), daemon=True).start()
+            conn, addr = s.accept()
+            threading.Thread(target=handle_client, args=(conn, addr), daemon=True).start()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# bench_broadcast.py
+# Micro-benchmark: CPU cost of one broadcast vs. room size, encoding the
+# frame per recipient (old behaviour) vs. once per message (server.broadcast).
+# Run: python benchmarks/bench_broadcast.py [--sizes 1,10,100,1000] [--messages 2000]
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'chat-app'))
+import server  # noqa: E402
+
+
+class NullConnection:
+    """Stands in for a client: accepts frames and throws them away."""
+
+    def send_frame(self, data, key=None):
+        pass
+
+
+def per_recipient_broadcast(obj, exclude_username=None):
+    """The pre-change broadcast loop: json.dumps + encode for every recipient."""
+    with server.clients_lock:
+        targets = [conn for user, (conn, addr) in server.clients.items() if user != exclude_username]
+    for conn in targets:
+        conn.send_frame((json.dumps(obj, ensure_ascii=False) + server.DELIM).encode('utf-8'))
+
+
+def run(fn, messages):
+    msg = {"type": "message", "from": "alice", "to": "all",
+           "msg": "Xin chào mọi người, hôm nay thế nào?", "time": server.now_str()}
+    start = time.process_time()
+    for _ in range(messages):
+        fn(msg)
+    return (time.process_time() - start) / messages * 1e6  # µs per message
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='1,10,100,1000,5000')
+    parser.add_argument('--messages', default=2000, type=int)
+    args = parser.parse_args()
+
+    print(f"{'room size':>10} {'per-recipient µs':>18} {'encode-once µs':>16} {'speedup':>8}")
+    for size in [int(x) for x in args.sizes.split(',')]:
+        server.clients.clear()
+        for i in range(size):
+            server.clients[f"user{i}"] = (NullConnection(), None)
+        messages = max(10, args.messages // max(1, size // 10))
+        before = run(per_recipient_broadcast, messages)
+        after = run(server.broadcast, messages)
+        print(f"{size:>10} {before:>18.1f} {after:>16.1f} {before / after:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# bench_codec.py
+# Serialize / parse cost per message and bytes per frame: JSON lines vs. the
+# binary message frames of wire_codec.py, for typical chat-app messages.
+# Also times the per-message timestamp (datetime.strftime vs. the per-second
+# cache in wire_codec.format_time).
+# Run: python benchmarks/bench_codec.py [--messages 20000]
+
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'chat-app'))
+import wire_codec  # noqa: E402
+from line_decoder import LineDecoder  # noqa: E402
+
+DELIM = '\n'
+
+
+def samples(now):
+    stamp = wire_codec.format_time(now)
+    return {
+        "broadcast": {"type": "message", "from": "nguyễn_văn_an", "to": "all",
+                      "msg": "Xin chào mọi người, hôm nay thế nào?", "time": stamp, "id": 123456},
+        "private": {"type": "message", "from": "trần_thị_bình", "to": "lê_văn_cường",
+                    "msg": "tối nay đi ăn phở không?", "time": stamp, "id": 123457},
+        "room": {"type": "message", "from": "phạm_minh_đức", "room": "lập-trình", "to": "lập-trình",
+                 "msg": "ai review giúp mình PR này với", "time": stamp, "id": 123458},
+        "client send": {"type": "message", "from": "nguyễn_văn_an", "to": "all", "msg": "ok nhé"},
+    }
+
+
+def per_message(fn, n):
+    start = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - start) / n * 1e6
+
+
+def json_encode(obj):
+    return (json.dumps(obj, ensure_ascii=False) + DELIM).encode('utf-8')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', default=20000, type=int)
+    args = parser.parse_args()
+    n = args.messages
+
+    names = wire_codec.NameTable()
+    print(f"{'message':<12} {'JSON B':>7} {'bin B':>6} {'JSON ser us':>11} {'bin ser us':>10} "
+          f"{'JSON parse us':>13} {'bin parse us':>12}")
+    for label, obj in samples(time.time()).items():
+        server_side = 'time' in obj
+        table = names if server_side else None  # clients send names inline
+        json_frame = json_encode(obj)
+        bin_frame, _ = wire_codec.encode_message(obj, table)
+        t_json_ser = per_message(lambda: json_encode(obj), n)
+        t_bin_ser = per_message(lambda: wire_codec.encode_message(obj, table), n)
+
+        # parse a received chunk of n frames, as a client (or the server) does
+        if server_side:
+            ids = {i: names.get(i) for i in range(1, 10)}
+            lookup = ids  # a client's learned table
+        else:
+            lookup = names
+        json_chunk, bin_chunk = json_frame * n, bin_frame * n
+        start = time.perf_counter()
+        out = LineDecoder(max_line=len(json_chunk)).feed(json_chunk)
+        t_json_parse = (time.perf_counter() - start) / n * 1e6
+        assert len(out) == n and out[0] == obj
+        decoder = wire_codec.FrameDecoder(max_line=len(bin_chunk), names=lookup, watch_ack=False)
+        start = time.perf_counter()
+        out = decoder.feed(bin_chunk)
+        t_bin_parse = (time.perf_counter() - start) / n * 1e6
+        assert len(out) == n and out[0] == obj, out[0]
+        print(f"{label:<12} {len(json_frame):>7} {len(bin_frame):>6} {t_json_ser:>11.2f} {t_bin_ser:>10.2f} "
+              f"{t_json_parse:>13.2f} {t_bin_parse:>12.2f}")
+
+    t_strftime = per_message(lambda: datetime.now().strftime('%Y-%m-%d %H:%M:%S'), n)
+    t_cached = per_message(lambda: wire_codec.format_time(time.time()), n)
+    print(f"\ntimestamp per message: strftime {t_strftime:.2f} us, cached {t_cached:.2f} us")
+
+
+if __name__ == "__main__":
+    main()
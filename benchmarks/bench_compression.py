@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# bench_compression.py
+# Bytes on the wire and CPU cost of frame compression (frame_compression.py)
+# for typical chat-app traffic: short and long Vietnamese messages, presence
+# summaries, online_list replies and a replay burst.
+#
+# For each workload and codec it reports the plain JSON size, the size
+# actually sent (frames under --min-size stay plain), the server's compress
+# time per frame (paid once per fan-out, not per recipient) and the client's
+# decode time per frame (wire_codec.FrameDecoder vs. plain LineDecoder).
+# Run: python benchmarks/bench_compression.py [--min-size 512] [--users 1000]
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'chat-app'))
+import frame_compression  # noqa: E402
+import wire_codec  # noqa: E402
+from line_decoder import LineDecoder  # noqa: E402
+
+DELIM = '\n'
+WORDS = ("xin chào mọi người hôm nay trời đẹp quá mình đi ăn phở không "
+         "được đấy hẹn gặp lúc bảy giờ nhé cảm ơn bạn nhiều lắm").split()
+
+
+def encode(obj):
+    return (json.dumps(obj, ensure_ascii=False) + DELIM).encode('utf-8')
+
+
+def text(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+
+def message(rng, i, words):
+    return encode({"type": "message", "from": f"user{rng.randrange(1000)}", "to": "all",
+                   "msg": text(rng, words), "time": "2026-10-18 18:00:00", "id": i})
+
+
+def workloads(users, seed=1):
+    rng = random.Random(seed)
+    names = [f"người_dùng_{i:04d}" for i in range(users)]
+    return {
+        # live traffic: one frame per send_frame()
+        "short message": [message(rng, i, 8) for i in range(2000)],
+        "long message": [message(rng, i, 300) for i in range(500)],
+        "presence summary": [encode({"type": "system", "msg": ', '.join(names[:20]) + f" and {users - 20} others joined",
+                                     "joined": names[:20], "left": [], "joined_count": users, "left_count": 0})] * 200,
+        "online_list": [encode({"type": "online_list", "users": names})] * 20,
+        # replay: one stream of REPLAY_BATCH-frame chunks
+        "replay burst": [message(rng, i, 12) for i in range(5000)],
+    }
+
+
+def compress_frames(frames, compressor):
+    # distinct bytes objects, so the fan-out memo does not hide the cost
+    frames = [bytes(bytearray(f)) for f in frames]
+    start = time.perf_counter()
+    out = [compressor.frame(f) for f in frames]
+    return out, time.perf_counter() - start
+
+
+def compress_stream(frames, compressor, batch=256):
+    stream = compressor.stream()
+    start = time.perf_counter()
+    out = [stream.chunk(b''.join(frames[i:i + batch])) for i in range(0, len(frames), batch)]
+    return out, time.perf_counter() - start
+
+
+def decode(wire, decoder):
+    start = time.perf_counter()
+    n = 0
+    for data in wire:
+        n += len(decoder.feed(data))
+    return n, time.perf_counter() - start
+
+
+def ack(codec):
+    return encode({"type": "join_ack", "ok": True, "compress": codec})
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--min-size', default=frame_compression.DEFAULT_MIN_SIZE, type=int)
+    parser.add_argument('--users', default=1000, type=int, help="names in online_list / presence")
+    args = parser.parse_args()
+
+    codecs = frame_compression.available()
+    print(f"codecs: {', '.join(codecs)} (zstd needs the 'zstandard' package)")
+    print(f"{'workload':<17} {'codec':<6} {'frames':>6} {'plain KB':>9} {'wire KB':>9} {'ratio':>6} "
+          f"{'comp us/f':>9} {'dec us/f':>9}")
+    for name, frames in workloads(args.users).items():
+        plain = sum(len(f) for f in frames)
+        n, t_plain = decode(frames, LineDecoder(max_line=1 << 26))
+        assert n == len(frames)
+        print(f"{name:<17} {'none':<6} {len(frames):>6} {plain / 1024:>9.1f} {plain / 1024:>9.1f} {1:>6.2f} "
+              f"{0:>9.1f} {t_plain / n * 1e6:>9.1f}")
+        for codec in codecs:
+            compressor = frame_compression.FrameCompressor(codec, args.min_size)
+            if name == "replay burst":
+                wire, t_comp = compress_stream(frames, compressor)
+            else:
+                wire, t_comp = compress_frames(frames, compressor)
+            decoder = wire_codec.FrameDecoder(max_line=1 << 26)
+            decoder.feed(ack(codec))
+            n, t_dec = decode(wire, decoder)
+            assert n == len(frames), (name, codec, n)
+            sent = sum(len(w) for w in wire)
+            print(f"{'':<17} {codec:<6} {len(frames):>6} {plain / 1024:>9.1f} {sent / 1024:>9.1f} "
+                  f"{plain / sent:>6.2f} {t_comp / n * 1e6:>9.1f} {t_dec / n * 1e6:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
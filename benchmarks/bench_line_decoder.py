@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# bench_line_decoder.py
+# Parse throughput of one received chunk holding N messages: the old
+# str-concat + split(DELIM, 1) loop vs. line_decoder.LineDecoder.
+# Run: python benchmarks/bench_line_decoder.py [--sizes 10,100,1000,10000]
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'chat-app'))
+from line_decoder import LineDecoder  # noqa: E402
+
+DELIM = '\n'
+
+
+def split_loop(chunk):
+    """The pre-change parsing loop from handle_connection/_recv_loop."""
+    buffer = ''
+    buffer += chunk.decode('utf-8')
+    out = []
+    while DELIM in buffer:
+        raw, buffer = buffer.split(DELIM, 1)
+        try:
+            out.append(json.loads(raw))
+        except Exception:
+            continue
+    return out
+
+
+def decoder_loop(chunk):
+    return LineDecoder(max_line=len(chunk)).feed(chunk)
+
+
+def timed(fn, chunk, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        n = len(fn(chunk))
+    return (time.perf_counter() - start) / repeat, n
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='10,100,1000,10000')
+    args = parser.parse_args()
+
+    line = (json.dumps({"type": "message", "to": "all", "msg": "Xin chào mọi người!"},
+                       ensure_ascii=False) + DELIM).encode('utf-8')
+    print(f"{'messages':>9} {'split msg/s':>14} {'decoder msg/s':>14}")
+    for size in [int(x) for x in args.sizes.split(',')]:
+        chunk = line * size
+        repeat = max(1, 20000 // size)
+        t_old, n_old = timed(split_loop, chunk, repeat)
+        t_new, n_new = timed(decoder_loop, chunk, repeat)
+        assert n_old == n_new == size
+        print(f"{size:>9} {size / t_old:>14,.0f} {size / t_new:>14,.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# bench_ui.py
+# Server CPU per request and bytes per page load for chap_app_ui, in
+# development mode (render_template on every request, Tailwind compiled in the
+# browser from the CDN script) and in production mode (CHAT_UI_PRODUCTION=1:
+# cached page shells, built CSS bundle, precompressed assets).
+# Uses Flask's test client, so it measures the app without the network.
+# Needs the built assets: python chap_app_ui/build_assets.py
+# Run: python benchmarks/bench_ui.py [--requests 2000]
+
+import argparse
+import importlib
+import os
+import re
+import sys
+import time
+
+UI = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'chap_app_ui')
+sys.path.insert(0, UI)
+
+from werkzeug.test import EnvironBuilder  # noqa: E402 (installed with flask)
+
+PAGES = ("/", "/profile", "/settings")
+BROWSER = {"Accept-Encoding": "gzip, deflate, br"}
+
+
+def load_app(production):
+    os.environ["CHAT_UI_PRODUCTION"] = "1" if production else "0"
+    sys.modules.pop("app", None)
+    return importlib.import_module("app").app
+
+
+def per_request(app, path, n, headers):
+    """Server time per request: the WSGI app called directly, as a WSGI server
+    would (the test client's own overhead would hide the difference)."""
+    environ = EnvironBuilder(path=path, headers=headers).get_environ()
+    status = []
+
+    def start_response(s, h):
+        status.append(s)
+
+    start = time.perf_counter()
+    for _ in range(n):
+        b''.join(app(dict(environ), start_response))
+    return (time.perf_counter() - start) / n * 1e6, status[-1]
+
+
+def page_load(client, path):
+    """Bytes the server sends for a first visit: the page and its local assets."""
+    response = client.get(path, headers=BROWSER)
+    total = len(response.data)
+    html = client.get(path).get_data(as_text=True)
+    for asset in re.findall(r'(?:href|src)="(/static/[^"]+)"', html):
+        total += len(client.get(asset, headers=BROWSER).data)
+    cdn = 'cdn.tailwindcss.com' in html
+    return total, cdn
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', default=2000, type=int)
+    args = parser.parse_args()
+    n = args.requests
+
+    print(f"{'mode':<11} {'page':<10} {'us/req':>8} {'us/304':>8} {'first visit B':>13}  notes")
+    for production in (False, True):
+        app = load_app(production)
+        client = app.test_client()
+        mode = "production" if production else "dev"
+        for path in PAGES:
+            t_full, _ = per_request(app, path, n, BROWSER)
+            etag = client.get(path, headers=BROWSER).headers.get("ETag")
+            t_304 = None
+            if etag:
+                t_304, status = per_request(app, path, n, dict(BROWSER, **{"If-None-Match": etag}))
+                assert status.startswith("304"), status
+            size, cdn = page_load(client, path)
+            notes = "+ Tailwind CDN script, compiled in the browser" if cdn else ""
+            print(f"{mode:<11} {path:<10} {t_full:>8.1f} {t_304 if t_304 else float('nan'):>8.1f} "
+                  f"{size:>13}  {notes}")
+
+
+if __name__ == "__main__":
+    main()
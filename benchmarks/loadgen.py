@@ -0,0 +1,499 @@
+#!/usr/bin/env python3
+# loadgen.py
+# Load generator / latency benchmark for the three chat servers.
+#
+# Starts the chosen server locally, connects N simulated clients (asyncio,
+# one process), runs a scripted join + broadcast/private/list workload and
+# reports throughput, end-to-end delivery latency (p50/p99/p999), join
+# latency and the server's RSS/CPU. Results are written as JSON so runs can
+# be compared between releases.
+#
+# Run:
+#   python benchmarks/loadgen.py --target chat-app --clients 200 --duration 10
+#   python benchmarks/loadgen.py --target chat-app-asyncio --out results.json
+#   python benchmarks/loadgen.py --target chat-app --server-args="--workers 4"   (multi-process scaling)
+#   python benchmarks/loadgen.py --target chat-app --rooms 50 --mix room=1   (room fan-out)
+#   python benchmarks/loadgen.py --target chat-app --server-args="--store server_store"   (with the message store)
+#   python benchmarks/loadgen.py --target final --mix broadcast=0.9,private=0.1
+#   python benchmarks/loadgen.py --target server-socker   (broadcast only, port 12345)
+#   python benchmarks/loadgen.py --target chat-app --no-server --port 5555   (already running server)
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'chat-app'))
+sys.path.insert(0, os.path.join(ROOT, 'Final'))
+import framing  # noqa: E402
+from line_decoder import LineDecoder  # noqa: E402
+
+MARK = "bench|"  # prefix of generated message bodies: bench|<sender>|<send time ns>|<padding>
+
+
+# ---------------- protocol drivers ----------------
+class ChatAppDriver:
+    """chat-app/server.py: newline-delimited JSON, join -> join_ack."""
+
+    supports = ("broadcast", "private", "list", "room")
+
+    def __init__(self):
+        self._decoder = LineDecoder()
+
+    def join(self, user, room=None):
+        if room:
+            # joins straight into the room: presence is scoped to it
+            return self._encode({"type": "join", "from": user, "room": room})
+        return self._encode({"type": "join", "from": user})
+
+    def joined(self, msg, user):
+        return msg.get("type") == "join_ack"
+
+    def broadcast(self, text):
+        return self._encode({"type": "message", "to": "all", "msg": text})
+
+    def private(self, to, text):
+        return self._encode({"type": "message", "to": to, "msg": text})
+
+    def room_message(self, room, text):
+        return self._encode({"type": "message", "room": room, "msg": text})
+
+    def list_request(self):
+        return self._encode({"type": "list_request"})
+
+    def is_list_reply(self, msg):
+        return msg.get("type") == "online_list"
+
+    def text(self, msg):
+        return msg.get("msg") if msg.get("type") == "message" else None
+
+    @staticmethod
+    def _encode(obj):
+        return (json.dumps(obj, ensure_ascii=False) + "\n").encode('utf-8')
+
+    def feed(self, data):
+        return self._decoder.feed(data)
+
+
+class FinalDriver:
+    """Final/server.py: length-prefixed JSON frames, handshake {"username"}."""
+
+    supports = ("broadcast", "private")
+
+    def __init__(self):
+        self._decoder = framing.FrameDecoder()
+
+    def _encode(self, obj):
+        return framing.encode(obj)
+
+    def join(self, user, room=None):
+        return self._encode({"username": user})
+
+    def joined(self, msg, user):
+        return msg.get("type") == "user_list" and user in msg.get("users", ())
+
+    def broadcast(self, text):
+        return self._encode({"type": "chat_all", "msg": text})
+
+    def private(self, to, text):
+        return self._encode({"type": "chat_private", "to": to, "msg": text})
+
+    def text(self, msg):
+        return msg.get("msg") if msg.get("type") in ("chat", "private") else None
+
+    def feed(self, data):
+        self._decoder.feed(data)
+        return self._decoder.frames()
+
+
+class SockerDriver:
+    """server-socker/server_socker.py: raw bytes relayed to every other client.
+    No join step and no framing, so we send newline-terminated text."""
+
+    supports = ("broadcast",)
+
+    def __init__(self):
+        self._buf = b''
+
+    def join(self, user, room=None):
+        return b''
+
+    def joined(self, msg, user):
+        return True
+
+    def broadcast(self, text):
+        return (text + "\n").encode('utf-8')
+
+    def text(self, msg):
+        return msg.get("msg")
+
+    def feed(self, data):
+        self._buf += data
+        *lines, self._buf = self._buf.split(b'\n')
+        return [{"msg": line.decode('utf-8', 'replace')} for line in lines]
+
+
+# chat-app is measured bare: no message store (disk writes per message), no
+# rate limiter (it would throttle the load itself) and no management listener
+# (it would collide with a server already running on the default port). The
+# flags are explicit so a change of server defaults does not change results;
+# --server-args comes after them, so it can turn each one back on.
+CHAT_APP_ARGS = ["--store", "none", "--rate-msgs", "0", "--rate-bytes", "0", "--management-port", "0"]
+
+TARGETS = {
+    # name: (driver, default port, server command builder)
+    "chat-app": (ChatAppDriver, 5555,
+                 lambda port: ([sys.executable, "server.py", "--port", str(port), *CHAT_APP_ARGS], "chat-app")),
+    "chat-app-asyncio": (ChatAppDriver, 5555,
+                         lambda port: ([sys.executable, "server.py", "--engine", "asyncio", "--port", str(port),
+                                        *CHAT_APP_ARGS], "chat-app")),
+    "final": (FinalDriver, 65432,
+              lambda port: ([sys.executable, "-c", f"import server; server.PORT = {port}; server.main()"], "Final")),
+    "server-socker": (SockerDriver, 12345,
+                      lambda port: ([sys.executable, "server_socker.py"], "server-socker")),
+}
+
+
+# ---------------- server process ----------------
+class ServerProcess:
+    """Runs a server as a subprocess and samples the RSS/CPU of it and its
+    children from /proc (Linux)."""
+
+    def __init__(self, cmd, cwd, port):
+        self.port = port
+        self.proc = subprocess.Popen(cmd, cwd=os.path.join(ROOT, cwd),
+                                     stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self.rss_max_kb = 0
+        self._cpu_start = None
+        self._wall_start = None
+
+    def wait_ready(self, timeout=10.0):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.proc.poll() is not None:
+                raise RuntimeError(f"server exited with code {self.proc.returncode}")
+            try:
+                socket.create_connection(("127.0.0.1", self.port), timeout=0.2).close()
+                return
+            except OSError:
+                time.sleep(0.05)
+        raise RuntimeError("server did not start listening")
+
+    def _pids(self):
+        """The server and its child processes (multi-process mode workers)."""
+        pids = [self.proc.pid]
+        try:
+            for entry in os.listdir("/proc"):
+                if entry.isdigit():
+                    try:
+                        with open(f"/proc/{entry}/stat") as f:
+                            if int(f.read().rsplit(")", 1)[1].split()[1]) == self.proc.pid:
+                                pids.append(int(entry))
+                    except (OSError, ValueError, IndexError):
+                        pass
+        except OSError:
+            pass
+        return pids
+
+    def rss_kb(self):
+        total = None
+        for pid in self._pids():
+            try:
+                with open(f"/proc/{pid}/status") as f:
+                    for line in f:
+                        if line.startswith("VmRSS:"):
+                            total = (total or 0) + int(line.split()[1])
+            except OSError:
+                pass
+        return total
+
+    def cpu_seconds(self):
+        total = None
+        for pid in self._pids():
+            try:
+                with open(f"/proc/{pid}/stat") as f:
+                    fields = f.read().rsplit(")", 1)[1].split()
+                total = (total or 0) + (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+            except (OSError, ValueError, IndexError):
+                pass
+        return total
+
+    def sample(self):
+        rss = self.rss_kb()
+        if rss:
+            self.rss_max_kb = max(self.rss_max_kb, rss)
+
+    def start_measuring(self):
+        self._cpu_start = self.cpu_seconds()
+        self._wall_start = time.monotonic()
+
+    def report(self):
+        cpu = self.cpu_seconds()
+        out = {"pid": self.proc.pid, "rss_kb_max": self.rss_max_kb or None, "rss_kb_end": self.rss_kb(),
+               "cpu_seconds": None, "cpu_percent": None}
+        if cpu is not None and self._cpu_start is not None:
+            out["cpu_seconds"] = round(cpu - self._cpu_start, 3)
+            out["cpu_percent"] = round(100 * (cpu - self._cpu_start) / (time.monotonic() - self._wall_start), 1)
+        return out
+
+    def stop(self):
+        self.proc.terminate()
+        try:
+            self.proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+
+
+# ---------------- simulated clients ----------------
+class Stats:
+    def __init__(self):
+        self.join_ms = []
+        self.delivery_ms = []
+        self.list_ms = []
+        self.sent = {"broadcast": 0, "private": 0, "list": 0, "room": 0}
+        self.delivered = 0
+        self.errors = 0
+        self.measuring = False
+
+
+class SimClient:
+    def __init__(self, name, driver_cls, host, port, stats, room=None):
+        self.name = name
+        self.room = room
+        self.driver = driver_cls()
+        self.host = host
+        self.port = port
+        self.stats = stats
+        self.reader = None
+        self.writer = None
+        self.joined = asyncio.Event()
+        self.pending_lists = []
+
+    async def connect(self):
+        t0 = time.perf_counter()
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        frame = self.driver.join(self.name, self.room)
+        if frame:
+            self.writer.write(frame)
+        self.read_task = asyncio.ensure_future(self.read_loop())
+        await asyncio.wait_for(self.joined.wait(), timeout=30)
+        self.stats.join_ms.append((time.perf_counter() - t0) * 1000)
+
+    async def read_loop(self):
+        if not self.driver.join(self.name):
+            self.joined.set()
+        try:
+            while True:
+                data = await self.reader.read(65536)
+                if not data:
+                    break
+                now = time.perf_counter_ns()
+                for msg in self.driver.feed(data):
+                    self.on_message(msg, now)
+        except (OSError, asyncio.CancelledError):
+            pass
+
+    def on_message(self, msg, now):
+        if not self.joined.is_set():
+            if self.driver.joined(msg, self.name):
+                self.joined.set()
+            return
+        text = self.driver.text(msg)
+        if text and text.startswith(MARK):
+            _, sender, sent_ns, _ = text.split("|", 3)
+            if sender != self.name and self.stats.measuring:
+                self.stats.delivered += 1
+                self.stats.delivery_ms.append((now - int(sent_ns)) / 1e6)
+        elif self.pending_lists and getattr(self.driver, "is_list_reply", None) and self.driver.is_list_reply(msg):
+            sent_ns = self.pending_lists.pop(0)
+            if self.stats.measuring:
+                self.stats.list_ms.append((now - sent_ns) / 1e6)
+
+    def body(self, padding):
+        return f"{MARK}{self.name}|{time.perf_counter_ns()}|{padding}"
+
+    async def run(self, names, rate, mix, padding, stop_at):
+        kinds, weights = zip(*mix.items())
+        interval = 1.0 / rate
+        # spread clients over the first interval so they do not fire in lockstep
+        await asyncio.sleep(random.random() * interval)
+        next_at = time.monotonic()
+        while time.monotonic() < stop_at:
+            kind = random.choices(kinds, weights)[0]
+            try:
+                if kind == "broadcast":
+                    self.writer.write(self.driver.broadcast(self.body(padding)))
+                elif kind == "room":
+                    self.writer.write(self.driver.room_message(self.room, self.body(padding)))
+                elif kind == "private":
+                    to = random.choice(names)
+                    while to == self.name and len(names) > 1:
+                        to = random.choice(names)
+                    self.writer.write(self.driver.private(to, self.body(padding)))
+                else:
+                    self.pending_lists.append(time.perf_counter_ns())
+                    self.writer.write(self.driver.list_request())
+                self.stats.sent[kind] += 1
+                await self.writer.drain()
+            except OSError:
+                self.stats.errors += 1
+                return
+            next_at += interval
+            await asyncio.sleep(max(0.0, next_at - time.monotonic()))
+
+    async def close(self):
+        self.read_task.cancel()
+        try:
+            self.writer.close()
+            await self.writer.wait_closed()
+        except OSError:
+            pass
+
+
+def percentiles(values):
+    if not values:
+        return None
+    values = sorted(values)
+
+    def pick(q):
+        return round(values[min(len(values) - 1, int(q * len(values)))], 3)
+    return {"count": len(values), "p50": pick(0.50), "p99": pick(0.99), "p999": pick(0.999),
+            "max": round(values[-1], 3), "mean": round(sum(values) / len(values), 3)}
+
+
+def parse_mix(text, supported, rooms=0):
+    mix = {}
+    for part in text.split(","):
+        kind, _, weight = part.partition("=")
+        kind = kind.strip()
+        if kind not in ("broadcast", "private", "list", "room"):
+            raise SystemExit(f"unknown workload kind: {kind}")
+        if kind == "room" and not rooms:
+            raise SystemExit("the room workload needs --rooms")
+        if kind in supported and float(weight or 1) > 0:
+            mix[kind] = float(weight or 1)
+    if not mix:
+        raise SystemExit(f"target supports only: {', '.join(supported)}")
+    return mix
+
+
+async def run_benchmark(args, driver_cls, server):
+    stats = Stats()
+    names = [f"bench{i}" for i in range(args.clients)]
+    clients = [SimClient(n, driver_cls, args.host, args.port, stats,
+                         room=f"room{i % args.rooms}" if args.rooms else None) for i, n in enumerate(names)]
+    mix = parse_mix(args.mix, driver_cls.supports, args.rooms)
+
+    sampler_stop = asyncio.Event()
+
+    async def sampler():
+        while not sampler_stop.is_set() and server:
+            server.sample()
+            await asyncio.sleep(0.2)
+    sampler_task = asyncio.ensure_future(sampler())
+
+    # join phase, at most --join-concurrency handshakes in flight
+    sem = asyncio.Semaphore(args.join_concurrency)
+
+    async def join(c):
+        async with sem:
+            await c.connect()
+    t0 = time.perf_counter()
+    await asyncio.gather(*(join(c) for c in clients))
+    join_wall = time.perf_counter() - t0
+
+    # measured phase
+    if server:
+        server.start_measuring()
+    stats.measuring = True
+    start = time.monotonic()
+    stop_at = start + args.duration
+    await asyncio.gather(*(c.run(names, args.rate, mix, "x" * args.payload, stop_at) for c in clients))
+    await asyncio.sleep(args.drain)  # let in-flight messages arrive
+    stats.measuring = False
+    elapsed = time.monotonic() - start
+    server_report = server.report() if server else None
+
+    sampler_stop.set()
+    await sampler_task
+    for c in clients:
+        await c.close()
+
+    sent = sum(stats.sent.values())
+    return {
+        "target": args.target,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "host": platform.node(),
+        "python": platform.python_version(),
+        "config": {"server_args": args.server_args, "clients": args.clients, "duration_s": args.duration, "rate_per_client": args.rate,
+                   "mix": mix, "rooms": args.rooms, "payload_bytes": args.payload},
+        "join": {"wall_s": round(join_wall, 3), "latency_ms": percentiles(stats.join_ms)},
+        "sent": stats.sent,
+        "sent_per_s": round(sent / args.duration, 1),
+        "delivered": stats.delivered,
+        "delivered_per_s": round(stats.delivered / elapsed, 1),
+        "delivery_latency_ms": percentiles(stats.delivery_ms),
+        "list_latency_ms": percentiles(stats.list_ms),
+        "errors": stats.errors,
+        "server": server_report,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load generator for the chat servers")
+    parser.add_argument('--target', choices=sorted(TARGETS), default='chat-app')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, help="default: the target's usual port")
+    parser.add_argument('--no-server', action='store_true', help="benchmark an already running server")
+    parser.add_argument('--server-args', default='', help="extra command-line arguments for the server")
+    parser.add_argument('--clients', type=int, default=100)
+    parser.add_argument('--duration', type=float, default=10.0, help="seconds of measured load")
+    parser.add_argument('--rate', type=float, default=2.0, help="messages per second per client")
+    parser.add_argument('--mix', default='broadcast=0.7,private=0.25,list=0.05',
+                        help="workload weights; kinds the target lacks are ignored")
+    parser.add_argument('--payload', type=int, default=64, help="padding bytes per message")
+    parser.add_argument('--rooms', type=int, default=0,
+                        help="chat-app: spread clients over this many rooms (joined at login) for the room workload")
+    parser.add_argument('--join-concurrency', type=int, default=50)
+    parser.add_argument('--drain', type=float, default=1.0, help="seconds to wait for in-flight messages")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--out', help="write the JSON result here (default: stdout only)")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    driver_cls, default_port, command = TARGETS[args.target]
+    if args.port is None:
+        args.port = default_port
+    if args.target == "server-socker" and args.port != 12345 and not args.no_server:
+        raise SystemExit("server_socker.py always listens on 12345")
+
+    server = None
+    if not args.no_server:
+        cmd, cwd = command(args.port)
+        cmd += args.server_args.split()
+        server = ServerProcess(cmd, cwd, args.port)
+    try:
+        if server:
+            server.wait_ready()
+        result = asyncio.run(run_benchmark(args, driver_cls, server))
+    finally:
+        if server:
+            server.stop()
+
+    text = json.dumps(result, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,141 @@
-from flask import Flask, render_template
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+from collections import namedtuple
 
-app = Flask(__name__)
+from flask import Flask, Response, render_template, request, send_from_directory, url_for
+from werkzeug.http import http_date
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# production mode (wsgi.py turns it on): assets built by build_assets.py,
+# page shells rendered once per worker and revalidated with ETag/Last-Modified
+PRODUCTION = os.environ.get("CHAT_UI_PRODUCTION") == "1"
+
+app = Flask(__name__, static_folder=None if PRODUCTION else "static")
+
+# gateway.py: live WebSocket/SSE channel from the browser to chat-app/server.py
+GATEWAY_URL = os.environ.get("CHAT_GATEWAY_URL", "http://127.0.0.1:8765")
+
+STATIC_DIR = os.path.join(app.root_path, "static")
+MANIFEST = os.path.join(STATIC_DIR, "manifest.json")
+IMMUTABLE = "public, max-age=31536000, immutable"  # built names change with their content
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))        # preferred first
+
+manifest = {}      # logical name -> built name (build_assets.py)
+precompressed = set()
+if PRODUCTION:
+    try:
+        with open(MANIFEST, encoding="utf-8") as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        raise RuntimeError("production mode needs built assets: run python build_assets.py") from None
+    for folder, _, files in os.walk(STATIC_DIR):
+        for name in files:
+            precompressed.add(os.path.relpath(os.path.join(folder, name), STATIC_DIR).replace(os.sep, "/"))
+
+def asset_url(name):
+    if PRODUCTION:
+        return "/static/" + manifest.get(name, name)
+    return url_for("static", filename=name)
+
+@app.context_processor
+def assets():
+    # without a built stylesheet, base.html falls back to the Tailwind CDN script
+    css = asset_url("css/app.css") if "css/app.css" in manifest else None
+    return {"asset_url": asset_url, "css_bundle": css}
+
+def accepted_encoding(available):
+    for encoding, suffix in ENCODINGS:
+        if suffix in available and request.accept_encodings.quality(encoding) > 0:
+            return encoding, suffix
+    return None, ""
+
+if PRODUCTION:
+    built = set(manifest.values())
+
+    @app.route("/static/<path:filename>")
+    def static_file(filename):
+        # the .br/.gz written by build_assets.py are sent as they are
+        encoding, suffix = accepted_encoding({s for _, s in ENCODINGS if filename + s in precompressed})
+        response = send_from_directory(STATIC_DIR, filename + suffix,
+                                       mimetype=mimetypes.guess_type(filename)[0])
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+        response.headers["Vary"] = "Accept-Encoding"
+        if filename in built:
+            response.headers["Cache-Control"] = IMMUTABLE
+        return response
+
+# a rendered page: suffix ("", ".gz", ".br") -> (body, response headers)
+Shell = namedtuple("Shell", "variants modified")
+shells = {}          # template -> Shell
+shell_encodings = {}  # Accept-Encoding header -> (encoding, suffix), parsed once per distinct header
+
+def last_modified():
+    paths = [MANIFEST] + [os.path.join(folder, name)
+                          for folder, _, files in os.walk(os.path.join(app.root_path, "templates"))
+                          for name in files]
+    return http_date(max(os.path.getmtime(p) for p in paths))
+
+def build_shell(body):
+    bodies = {"": (None, body), ".gz": ("gzip", gzip.compress(body, 9, mtime=0))}
+    if brotli:
+        bodies[".br"] = ("br", brotli.compress(body, quality=11))
+    digest = hashlib.sha256(body).hexdigest()[:16]
+    modified = last_modified()
+    variants = {}
+    for suffix, (encoding, data) in bodies.items():
+        # revalidate every time (no-cache): the shell names this deploy's asset bundles
+        headers = [("Content-Type", "text/html; charset=utf-8"), ("Vary", "Accept-Encoding"),
+                   ("ETag", f'"{digest}{suffix.replace(".", "-")}"'), ("Last-Modified", modified),
+                   ("Cache-Control", "no-cache")]
+        if encoding:
+            headers.append(("Content-Encoding", encoding))
+        variants[suffix] = (data, headers)
+    return Shell(variants, modified)
+
+def page(template, **context):
+    if not PRODUCTION:
+        return render_template(template, **context)
+    shell = shells.get(template)
+    if shell is None:
+        # pages only change with a deploy: render and compress once per worker
+        shell = shells[template] = build_shell(render_template(template, **context).encode("utf-8"))
+    accept = request.headers.get("Accept-Encoding", "")
+    choice = shell_encodings.get(accept)
+    if choice is None:
+        if len(shell_encodings) > 256:
+            shell_encodings.clear()
+        choice = shell_encodings[accept] = accepted_encoding(shell.variants)
+    body, headers = shell.variants[choice[1]]
+    # conditional GET without werkzeug's general-purpose parsing; the values
+    # to match are the ones this worker sent
+    match = request.headers.get("If-None-Match")
+    if match is not None:
+        fresh = match.strip() == "*" or headers[2][1] in (tag.strip() for tag in match.split(","))
+    else:
+        fresh = request.headers.get("If-Modified-Since") == shell.modified
+    if fresh:
+        return Response(status=304, headers=headers[1:])
+    return Response(body, headers=headers)
 
 @app.route("/")
 def home():
-    return render_template("home.html")
+    return page("home.html", gateway_url=GATEWAY_URL)
 
 @app.route("/profile")
 def profile():
-    return render_template("profile.html")
+    return page("profile.html")
 
 @app.route("/settings")
 def settings():
-    return render_template("settings.html")
+    return page("settings.html")
 
 if __name__ == "__main__":
     app.run(debug=True)
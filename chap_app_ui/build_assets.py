@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# build_assets.py
+# Builds the static assets served in production mode (CHAT_UI_PRODUCTION=1,
+# see wsgi.py):
+#   - compiles the Tailwind classes used in templates/ and static/js/, plus
+#     static/css/style.css, into static/css/app.<hash>.css. This replaces the
+#     CDN script that compiles the styles in the browser on every page load;
+#   - copies static/js/*.js to <name>.<hash>.js;
+#   - writes .gz (and .br if the 'brotli' package is installed) next to every
+#     bundle, so the server sends them without compressing per request;
+#   - records logical name -> built name in static/manifest.json.
+# Bundle names change with their content, so browsers may cache them forever.
+#
+# Needs the Tailwind CLI v3 (the version of the CDN script the templates were
+# written against): pip install pytailwindcss, which downloads the
+# standalone binary on first use.
+# Run: python build_assets.py [--tailwind tailwindcss]
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+STATIC = os.path.join(ROOT, 'static')
+MANIFEST = os.path.join(STATIC, 'manifest.json')
+TAILWIND_VERSION = 'v3.4.17'
+# a built file: name.<10 hex digits>.ext, possibly compressed
+BUILT = re.compile(r'\.[0-9a-f]{10}\.\w+(\.gz|\.br)?$')
+
+
+def compile_css(tailwind):
+    """Tailwind utilities for the classes in use, followed by style.css."""
+    with open(os.path.join(STATIC, 'css', 'style.css'), encoding='utf-8') as f:
+        own = f.read()
+    content = ','.join([os.path.join(ROOT, 'templates', '**', '*.html'),
+                        os.path.join(STATIC, 'js', '**', '*.js')])
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, 'input.css')
+        output = os.path.join(tmp, 'app.css')
+        with open(source, 'w', encoding='utf-8') as f:
+            f.write("@tailwind base;\n@tailwind components;\n@tailwind utilities;\n" + own)
+        env = dict(os.environ)
+        env.setdefault('TAILWINDCSS_VERSION', TAILWIND_VERSION)  # read by pytailwindcss
+        subprocess.run([tailwind, '-i', source, '-o', output, '--content', content, '--minify'],
+                       check=True, env=env)
+        with open(output, 'rb') as f:
+            return f.read()
+
+
+def write_bundle(logical, data):
+    """Write data as static/<logical with its hash>, plus compressed copies.
+    Returns the built name, relative to static/."""
+    stem, ext = os.path.splitext(logical)
+    built = f"{stem}.{hashlib.sha256(data).hexdigest()[:10]}{ext}"
+    path = os.path.join(STATIC, built)
+    with open(path, 'wb') as f:
+        f.write(data)
+    with open(path + '.gz', 'wb') as f:
+        f.write(gzip.compress(data, 9, mtime=0))  # mtime=0: same input, same bytes
+    if brotli:
+        with open(path + '.br', 'wb') as f:
+            f.write(brotli.compress(data, quality=11))
+    return built
+
+
+def remove_old_builds(keep):
+    for folder, _, files in os.walk(STATIC):
+        for name in files:
+            path = os.path.join(folder, name)
+            rel = os.path.relpath(path, STATIC).replace(os.sep, '/')
+            if BUILT.search(name) and re.sub(r'\.(gz|br)$', '', rel) not in keep:
+                os.remove(path)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tailwind', default='tailwindcss', help="Tailwind CLI executable")
+    args = parser.parse_args()
+    tailwind = shutil.which(args.tailwind)
+    if not tailwind:
+        sys.exit(f"Tailwind CLI '{args.tailwind}' not found: pip install pytailwindcss, "
+                 "or pass --tailwind with the path of the standalone binary")
+
+    manifest = {"css/app.css": write_bundle('css/app.css', compile_css(tailwind))}
+    js_dir = os.path.join(STATIC, 'js')
+    for name in sorted(os.listdir(js_dir)):
+        if name.endswith('.js') and not BUILT.search(name):
+            with open(os.path.join(js_dir, name), 'rb') as f:
+                manifest['js/' + name] = write_bundle('js/' + name, f.read())
+    remove_old_builds(set(manifest.values()))
+    with open(MANIFEST, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    for logical, built in manifest.items():
+        size = os.path.getsize(os.path.join(STATIC, built))
+        gz = os.path.getsize(os.path.join(STATIC, built + '.gz'))
+        print(f"{logical:<14} -> {built:<28} {size:>7} B, gzip {gz:>6} B")
+    if not brotli:
+        print("brotli not installed: only .gz copies were written (pip install brotli)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,519 @@
+#!/usr/bin/env python3
+# gateway.py
+# Live channel from the browser (chap_app_ui) to the chat server in chat-app/.
+#
+# A browser tab connects with a WebSocket (GET /ws) or, where WebSockets are
+# blocked, with Server-Sent Events (GET /events to receive, POST /send to
+# send). Either way it speaks the chat-app protocol in JSON: the first
+# message is a "join", everything after that is relayed to chat-app/server.py.
+#
+# Upstream connections are pooled per user: all tabs of one user share one
+# TCP connection to the chat server (the protocol ties a username to one
+# connection, so a socket cannot carry several users). Once the join is
+# acknowledged, server frames are relayed without being parsed, and reach the
+# browser in batches: one WebSocket message / SSE event carrying a JSON array
+# of the frames that arrived within BATCH_DELAY.
+#
+# The gateway trusts the username sent by the browser, just as the chat
+# server trusts its TCP clients. It does not let one browser into another's
+# session, though: when the server accepts a join, the tabs of that upstream
+# get a random token (a "session_token" frame), and a later join for the same
+# user shares the upstream only if it quotes that token ("token" in the join,
+# or ?token= for SSE). Any other join goes to the chat server on a connection
+# of its own, where it is refused as username_taken like a second TCP client.
+#
+# Run: python gateway.py [--port 8765] [--chat-host 127.0.0.1] [--chat-port 5555]
+
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import secrets
+import struct
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+
+HOST = '0.0.0.0'
+PORT = 8765
+CHAT_HOST = '127.0.0.1'
+CHAT_PORT = 5555
+BATCH_DELAY = 0.025          # seconds frames wait so they reach the browser together
+BATCH_MAX = 64 * 1024        # a batch this large is sent at once
+MAX_MESSAGE = 64 * 1024      # longest message accepted from a browser (the server's MAX_LINE_LENGTH)
+MAX_BUFFERED = 1024 * 1024   # a browser this far behind is disconnected
+LINGER = 5.0                 # seconds an upstream outlives its last tab, so a page reload reuses it
+HEARTBEAT = 15.0             # SSE comment interval; keeps proxies from closing idle streams
+MAX_HEADER = 16 * 1024
+BACKLOG = 4096
+
+WS_GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC11B85'
+OP_CONT, OP_TEXT, OP_BINARY, OP_CLOSE, OP_PING, OP_PONG = 0x0, 0x1, 0x2, 0x8, 0x9, 0xA
+CLOSE_NORMAL = struct.pack('!H', 1000)
+CLOSE_TOO_BIG = struct.pack('!H', 1009)
+
+ERROR_UNAVAILABLE = b'{"type": "error", "msg": "chat_server_unavailable"}'
+ERROR_NO_USER = b'{"type": "error", "msg": "No username provided"}'
+
+chat_address = (CHAT_HOST, CHAT_PORT)
+allow_origin = '*'  # Origin allowed to open sessions (the chap_app_ui site)
+upstreams = {}      # username -> Upstream
+sse_sessions = {}   # session id -> Session (SSE only; WebSocket sessions live in their handler)
+
+
+class Session:
+    """One browser tab. Frames from the upstream collect in pending and are
+    written as one batch BATCH_DELAY later; encode turns the batch (a JSON
+    array) into a WebSocket message or an SSE event."""
+
+    __slots__ = ('writer', 'encode', 'websocket', 'user', 'upstream', 'pending', 'pending_size',
+                 'scheduled', 'closed')
+
+    def __init__(self, writer, encode, websocket=False):
+        self.writer = writer
+        self.encode = encode
+        self.websocket = websocket
+        self.user = None
+        self.upstream = None
+        self.pending = []
+        self.pending_size = 0
+        self.scheduled = False
+        self.closed = False
+
+    def push(self, frame):
+        if self.closed:
+            return
+        self.pending.append(frame)
+        self.pending_size += len(frame)
+        if self.pending_size >= BATCH_MAX:
+            self.flush()
+        elif not self.scheduled:
+            self.scheduled = True
+            asyncio.get_running_loop().call_later(BATCH_DELAY, self.flush)
+
+    def flush(self):
+        self.scheduled = False
+        if self.closed or not self.pending:
+            return
+        batch = b'[' + b','.join(self.pending) + b']'
+        self.pending = []
+        self.pending_size = 0
+        if self.writer.transport.get_write_buffer_size() > MAX_BUFFERED:
+            # the browser stopped reading: drop it rather than buffer without bound
+            self.closed = True
+            self._detach()
+            self.writer.transport.abort()
+            return
+        self.writer.write(self.encode(batch))
+
+    def close(self):
+        """Send what is pending, then end the session."""
+        if self.closed:
+            return
+        self.flush()
+        if self.closed:
+            return
+        self.closed = True
+        self._detach()
+        if self.websocket:
+            self.writer.write(ws_frame(OP_CLOSE, CLOSE_NORMAL))
+        self.writer.close()
+
+    def _detach(self):
+        if self.upstream:
+            self.upstream.detach(self)
+            self.upstream = None
+
+
+class Upstream(asyncio.Protocol):
+    """The TCP connection to the chat server for one user, shared by all of
+    that user's tabs. Frames are split on the newline and handed to every
+    tab as the same bytes object; only frames before join_ack are parsed."""
+
+    def __init__(self, user):
+        self.user = user
+        self.sessions = set()
+        self.transport = None
+        self.buffer = bytearray()
+        self.ack = None      # the join_ack frame, replayed to tabs that attach later
+        self.closing = False
+        self.token = secrets.token_urlsafe(16)  # a tab quoting it may share this upstream
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        self.buffer += data
+        end = self.buffer.rfind(b'\n')
+        if end < 0:
+            return
+        frames = bytes(self.buffer[:end]).split(b'\n')
+        del self.buffer[:end + 1]
+        sessions = list(self.sessions)
+        for frame in frames:
+            if not frame:
+                continue
+            token = self._check_ack(frame) if self.ack is None else None
+            for session in sessions:
+                session.push(frame)
+                if token:
+                    session.push(token)
+
+    def _check_ack(self, frame):
+        """Remember the join_ack; returns the session_token frame for the tabs
+        if the join was accepted."""
+        try:
+            msg = json.loads(frame)
+        except ValueError:
+            return None
+        if msg.get('type') != 'join_ack':
+            return None
+        self.ack = frame
+        if not msg.get('ok'):
+            # username taken: the tabs get the ack, then the connection goes
+            self.closing = True
+            asyncio.get_running_loop().call_soon(self.transport.close)
+            return None
+        return json.dumps({"type": "session_token", "token": self.token}).encode('ascii')
+
+    def connection_lost(self, exc):
+        self.closing = True
+        if upstreams.get(self.user) is self:
+            del upstreams[self.user]
+        # kicked, server shut down, or join refused: end the tabs too
+        for session in list(self.sessions):
+            session.close()
+
+    def send(self, msg):
+        if self.transport and not self.closing:
+            self.transport.write((json.dumps(msg, ensure_ascii=False) + '\n').encode('utf-8'))
+
+    def detach(self, session):
+        self.sessions.discard(session)
+        if not self.sessions and not self.closing:
+            asyncio.get_running_loop().call_later(LINGER, self._linger_expired)
+
+    def _linger_expired(self):
+        if not self.sessions and not self.closing:
+            self.closing = True
+            if upstreams.get(self.user) is self:
+                del upstreams[self.user]
+            if self.transport:
+                self.transport.close()
+
+    def fail(self, frame):
+        """The chat server could not be reached: tell every waiting tab."""
+        self.closing = True
+        if upstreams.get(self.user) is self:
+            del upstreams[self.user]
+        for session in list(self.sessions):
+            session.push(frame)
+            session.close()
+
+
+def same_session(join, upstream):
+    token = join.get('token')
+    return isinstance(token, str) and secrets.compare_digest(token.encode('utf-8'),
+                                                             upstream.token.encode('ascii'))
+
+
+async def attach(session, join):
+    """Connect a tab to its user's upstream, opening one (and joining) if
+    needed. False if the tab could not be attached."""
+    user = join.get('from')
+    if not isinstance(user, str) or not user:
+        session.push(ERROR_NO_USER)
+        return False
+    session.user = user
+    upstream = upstreams.get(user)
+    if upstream is not None and not upstream.closing:
+        if same_session(join, upstream):
+            upstream.sessions.add(session)
+            session.upstream = upstream
+            if upstream.ack is not None:
+                session.push(upstream.ack)
+                # the first tab got the online list with its join; this one asks
+                upstream.send({"type": "list_request"})
+            return True
+        # not that session's tab: a connection of its own (not in upstreams),
+        # which the chat server refuses while the name is in use
+        upstream = Upstream(user)
+    else:
+        upstream = upstreams[user] = Upstream(user)
+    upstream.sessions.add(session)
+    session.upstream = upstream
+    try:
+        await asyncio.get_running_loop().create_connection(lambda: upstream, *chat_address)
+    except OSError:
+        upstream.fail(ERROR_UNAVAILABLE)
+        return False
+    if upstream.closing:
+        # every tab left while we were connecting
+        upstream.transport.close()
+        return False
+    # frames are relayed to the browser as they come, so ask for plain JSON lines
+    join = {k: v for k, v in join.items() if k not in ('compress', 'encoding', 'token')}
+    upstream.send(join)
+    return True
+
+
+def relay(session, msg):
+    """A message from a joined tab, on its way to the chat server."""
+    if not isinstance(msg, dict) or msg.get('type') == 'join' or session.upstream is None:
+        return
+    msg['from'] = session.user  # a tab only speaks for its own user
+    session.upstream.send(msg)
+
+
+def parse(data):
+    try:
+        msg = json.loads(data)
+    except ValueError:
+        return None
+    return msg if isinstance(msg, dict) else None
+
+
+# ---- WebSocket (RFC 6455) ----
+def ws_frame(opcode, payload):
+    n = len(payload)
+    if n < 126:
+        head = struct.pack('!BB', 0x80 | opcode, n)
+    elif n < 65536:
+        head = struct.pack('!BBH', 0x80 | opcode, 126, n)
+    else:
+        head = struct.pack('!BBQ', 0x80 | opcode, 127, n)
+    return head + payload
+
+
+def ws_text(batch):
+    return ws_frame(OP_TEXT, batch)
+
+
+def unmask(payload, mask):
+    # one big-integer XOR instead of a Python loop over the bytes
+    n = len(payload)
+    key = int.from_bytes((mask * (n // 4 + 1))[:n], 'big')
+    return (int.from_bytes(payload, 'big') ^ key).to_bytes(n, 'big')
+
+
+async def ws_messages(reader, writer):
+    """Yield each complete message from the browser. Answers pings; ends on
+    a close frame, an unmasked frame or a message over MAX_MESSAGE."""
+    fragments = []
+    size = 0
+    while True:
+        b0, b1 = await reader.readexactly(2)
+        if not b1 & 0x80:
+            return  # browsers always mask (RFC 6455 5.1)
+        opcode = b0 & 0x0F
+        length = b1 & 0x7F
+        if length == 126:
+            length, = struct.unpack('!H', await reader.readexactly(2))
+        elif length == 127:
+            length, = struct.unpack('!Q', await reader.readexactly(8))
+        if size + length > MAX_MESSAGE:
+            writer.write(ws_frame(OP_CLOSE, CLOSE_TOO_BIG))
+            return
+        mask = await reader.readexactly(4)
+        payload = unmask(await reader.readexactly(length), mask)
+        if opcode == OP_CLOSE:
+            return
+        if opcode == OP_PING:
+            writer.write(ws_frame(OP_PONG, payload))
+            continue
+        if opcode == OP_PONG:
+            continue
+        fragments.append(payload)
+        size += length
+        if b0 & 0x80:  # FIN
+            yield b''.join(fragments)
+            fragments = []
+            size = 0
+
+
+async def websocket_session(reader, writer, headers):
+    key = headers.get('sec-websocket-key')
+    if 'websocket' not in headers.get('upgrade', '').lower() or not key:
+        respond(writer, 400)
+        return
+    accept = base64.b64encode(hashlib.sha1(key.encode('ascii') + WS_GUID).digest()).decode('ascii')
+    writer.write(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                  f"Sec-WebSocket-Accept: {accept}\r\n\r\n").encode('ascii'))
+    session = Session(writer, ws_text, websocket=True)
+    try:
+        async for data in ws_messages(reader, writer):
+            msg = parse(data)
+            if msg is None:
+                continue
+            if session.user is None:
+                # like the chat server: ignore everything until join
+                if msg.get('type') == 'join' and not await attach(session, msg):
+                    break
+            else:
+                relay(session, msg)
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        session.close()
+
+
+# ---- Server-Sent Events ----
+def sse_event(batch):
+    # frames are single-line JSON, so the batch is one data: line
+    return b'data: ' + batch + b'\n\n'
+
+
+async def sse_session(reader, writer, query):
+    join = {"type": "join", "from": first(query, 'user')}
+    if first(query, 'room'):
+        join["room"] = first(query, 'room')
+    if first(query, 'token'):
+        join["token"] = first(query, 'token')
+    if first(query, 'last_id', '').isdigit():
+        join["last_id"] = int(first(query, 'last_id'))
+        if first(query, 'store'):
+            join["store"] = first(query, 'store')
+    writer.write(("HTTP/1.1 200 OK\r\nContent-Type: text/event-stream; charset=utf-8\r\n"
+                  "Cache-Control: no-cache\r\nX-Accel-Buffering: no\r\n"
+                  f"Access-Control-Allow-Origin: {allow_origin}\r\n\r\nretry: 3000\n\n").encode('utf-8'))
+    session = Session(writer, sse_event)
+    if await attach(session, join):
+        # the id the tab quotes in POST /send
+        sid = secrets.token_urlsafe(16)
+        sse_sessions[sid] = session
+        writer.write(f"event: session\ndata: {sid}\n\n".encode('ascii'))
+        try:
+            # nothing more comes from the browser; EOF means the tab went away
+            while await reader.read(4096):
+                pass
+        except ConnectionError:
+            pass
+        finally:
+            del sse_sessions[sid]
+    session.close()
+
+
+async def sse_send(reader, writer, headers, query):
+    """POST /send?session=ID with one JSON message as the body. Returns False
+    if the HTTP connection should be closed."""
+    length = headers.get('content-length', '0')
+    if not length.isdigit() or int(length) > MAX_MESSAGE:
+        respond(writer, 413)
+        return False
+    body = await reader.readexactly(int(length))
+    session = sse_sessions.get(first(query, 'session'))
+    msg = parse(body)
+    if session is None:
+        respond(writer, 404)
+    elif msg is None:
+        respond(writer, 400)
+    else:
+        relay(session, msg)
+        respond(writer, 204)
+    return True
+
+
+async def heartbeat():
+    while True:
+        await asyncio.sleep(HEARTBEAT)
+        for session in list(sse_sessions.values()):
+            if not session.closed:
+                session.writer.write(b': ping\n\n')
+
+
+# ---- HTTP ----
+def first(query, name, default=''):
+    return query.get(name, [default])[0]
+
+
+def respond(writer, status, body=b'', headers=()):
+    lines = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}",
+             f"Content-Length: {len(body)}",
+             f"Access-Control-Allow-Origin: {allow_origin}", *headers]
+    writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+
+
+def parse_head(head):
+    lines = head.decode('latin-1').split('\r\n')
+    method, target, _ = lines[0].split(' ', 2)
+    headers = {}
+    for line in lines[1:]:
+        if ':' in line:
+            name, value = line.split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+    return method, target, headers
+
+
+def origin_allowed(headers):
+    # non-browser clients send no Origin; browsers on other sites are refused
+    origin = headers.get('origin')
+    return allow_origin == '*' or origin is None or origin == allow_origin
+
+
+async def handle_http(reader, writer):
+    try:
+        while True:
+            try:
+                head = await reader.readuntil(b'\r\n\r\n')
+                method, target, headers = parse_head(head)
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+                return
+            url = urlsplit(target)
+            query = parse_qs(url.query)
+            if method == 'OPTIONS':
+                # CORS preflight for POST /send
+                respond(writer, 204, headers=("Access-Control-Allow-Methods: GET, POST",
+                                              "Access-Control-Allow-Headers: Content-Type"))
+            elif not origin_allowed(headers):
+                respond(writer, 403)
+                return
+            elif method == 'GET' and url.path == '/ws':
+                await websocket_session(reader, writer, headers)
+                return
+            elif method == 'GET' and url.path == '/events':
+                await sse_session(reader, writer, query)
+                return
+            elif method == 'POST' and url.path == '/send':
+                if not await sse_send(reader, writer, headers, query):
+                    return
+            else:
+                respond(writer, 404)
+            if headers.get('connection', '').lower() == 'close':
+                return
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(host, port):
+    srv = await asyncio.start_server(handle_http, host, port, limit=MAX_HEADER, backlog=BACKLOG)
+    beat = asyncio.create_task(heartbeat())
+    print(f"Chat gateway on {host}:{port} -> chat server {chat_address[0]}:{chat_address[1]}")
+    try:
+        async with srv:
+            await srv.serve_forever()
+    finally:
+        beat.cancel()
+
+
+def main():
+    global chat_address, allow_origin
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', default=PORT, type=int)
+    parser.add_argument('--chat-host', default=CHAT_HOST)
+    parser.add_argument('--chat-port', default=CHAT_PORT, type=int)
+    parser.add_argument('--allow-origin', default=allow_origin,
+                        help="Origin allowed to open sessions, e.g. http://localhost:5000 ('*' = any)")
+    args = parser.parse_args()
+    chat_address = (args.chat_host, args.chat_port)
+    allow_origin = args.allow_origin
+    try:
+        asyncio.run(serve(args.host, args.port))
+    except KeyboardInterrupt:
+        print("Shutting down gateway...")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,10 @@
+# gunicorn.conf.py
+# Settings for: gunicorn -c gunicorn.conf.py wsgi:app
+
+import multiprocessing
+import os
+
+bind = os.environ.get("CHAT_UI_BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("CHAT_UI_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+# import the app (and read the asset manifest) once, before forking the workers
+preload_app = True
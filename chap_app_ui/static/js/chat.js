@@ -0,0 +1,144 @@
+// chat.js
+// Live chat for home.html through gateway.py: a WebSocket, or Server-Sent
+// Events + POST /send where WebSockets are unavailable. The gateway sends
+// frames in batches (a JSON array per message); each batch is rendered with
+// one DOM insert and one scroll.
+(function () {
+    const root = document.getElementById("chatApp");
+    if (!root || !root.dataset.gateway) {
+        return;
+    }
+    const gateway = root.dataset.gateway.replace(/\/$/, "");
+    const area = document.getElementById("messageArea");
+    const input = document.getElementById("messageInput");
+    const button = document.getElementById("sendButton");
+    const status = document.getElementById("chatStatus");
+
+    const params = new URLSearchParams(location.search);
+    let user = params.get("user") || localStorage.getItem("chat_user");
+    while (!user) {
+        user = (prompt("Tên người dùng:") || "").trim();
+    }
+    localStorage.setItem("chat_user", user);
+    // lets this browser's other tabs (and a reload) share the gateway session
+    const tokenKey = "chat_token:" + user;
+
+    let send = null;     // set once joined
+    let refused = false; // join refused: do not reconnect
+
+    function bubble(frame) {
+        const row = document.createElement("div");
+        const box = document.createElement("div");
+        if (frame.type === "message") {
+            const mine = frame.from === user;
+            row.className = mine ? "flex items-start justify-end gap-3" : "flex items-start gap-3";
+            box.className = mine
+                ? "bg-blue-500 text-white px-4 py-2 rounded-lg max-w-sm shadow"
+                : "bg-white px-4 py-2 rounded-lg max-w-sm shadow";
+            const to = frame.to && frame.to !== "all" && !frame.room ? " → " + frame.to : "";
+            box.textContent = (mine ? "" : frame.from + to + ": ") + frame.msg;
+            box.title = frame.time || "";
+        } else {
+            row.className = "flex justify-center";
+            box.className = "text-xs text-gray-500";
+            box.textContent = frame.msg || frame.reason || frame.type;
+        }
+        row.appendChild(box);
+        return row;
+    }
+
+    function onFrames(frames) {
+        const batch = document.createDocumentFragment();
+        for (const frame of frames) {
+            if (frame.type === "session_token") {
+                localStorage.setItem(tokenKey, frame.token);
+            } else if (frame.type === "join_ack") {
+                if (!frame.ok) {
+                    refused = true;
+                    status.textContent = "Tên đã được dùng";
+                    continue;
+                }
+                area.replaceChildren();
+                status.textContent = "Đang hoạt động";
+            } else if (frame.type === "online_list") {
+                if (!frame.room) {
+                    status.textContent = frame.users.length + " người đang online";
+                }
+            } else if (frame.type === "message" || frame.type === "system" || frame.type === "error") {
+                batch.appendChild(bubble(frame));
+            }
+        }
+        if (batch.childNodes.length) {
+            area.appendChild(batch);
+            area.scrollTop = area.scrollHeight;
+        }
+    }
+
+    function connectSSE() {
+        const token = localStorage.getItem(tokenKey);
+        const source = new EventSource(gateway + "/events?user=" + encodeURIComponent(user) +
+            (token ? "&token=" + encodeURIComponent(token) : ""));
+        source.addEventListener("session", function (event) {
+            const url = gateway + "/send?session=" + encodeURIComponent(event.data);
+            // text/plain keeps the POST a "simple" request (no CORS preflight)
+            send = function (msg) {
+                fetch(url, {method: "POST", body: JSON.stringify(msg), headers: {"Content-Type": "text/plain"}});
+            };
+        });
+        source.onmessage = function (event) {
+            onFrames(JSON.parse(event.data));
+            if (refused) {
+                source.close();
+            }
+        };
+    }
+
+    function connect() {
+        if (!window.WebSocket) {
+            connectSSE();
+            return;
+        }
+        const ws = new WebSocket(gateway.replace(/^http/, "ws") + "/ws");
+        let opened = false;
+        ws.onopen = function () {
+            opened = true;
+            const join = {type: "join", from: user};
+            const token = localStorage.getItem(tokenKey);
+            if (token) {
+                join.token = token;
+            }
+            ws.send(JSON.stringify(join));
+            send = function (msg) {
+                ws.send(JSON.stringify(msg));
+            };
+        };
+        ws.onmessage = function (event) {
+            onFrames(JSON.parse(event.data));
+        };
+        ws.onclose = function () {
+            send = null;
+            if (!opened) {
+                connectSSE();  // blocked by a proxy or firewall
+            } else if (!refused) {
+                status.textContent = "Mất kết nối, đang thử lại...";
+                setTimeout(connect, 3000);
+            }
+        };
+    }
+
+    function submit() {
+        const text = input.value.trim();
+        if (text && send) {
+            send({type: "message", to: "all", msg: text});
+            input.value = "";
+        }
+    }
+
+    button.addEventListener("click", submit);
+    input.addEventListener("keydown", function (event) {
+        if (event.key === "Enter") {
+            submit();
+        }
+    });
+    connect();
+})();
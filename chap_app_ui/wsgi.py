@@ -0,0 +1,11 @@
+# wsgi.py
+# Production entry point for chap_app_ui: built assets (python build_assets.py
+# first), page shells cached per worker, several worker processes.
+# Run: gunicorn -c gunicorn.conf.py wsgi:app
+#      (Windows, no gunicorn: waitress-serve --threads 8 --port 8000 wsgi:app)
+
+import os
+
+os.environ.setdefault("CHAT_UI_PRODUCTION", "1")
+
+from app import app  # noqa: E402,F401
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+# async_server.py
+# Event-loop engine for the chat server: one thread, one asyncio Protocol per
+# connection, same newline-delimited JSON protocol as server.py.
+# Run: python server.py --engine asyncio
+
+import asyncio
+
+import rate_limit
+import send_queue
+import server
+from line_decoder import LineDecoder, LineTooLong
+
+BACKLOG = 4096
+# transport buffer above which we stop writing and let frames wait in the
+# bounded SendQueue (where the slow-consumer policy applies)
+WRITE_HIGH_WATER = 64 * 1024
+
+
+class ChatProtocol(asyncio.Protocol):
+    """One connected client.
+
+    Exposes the same send_frame()/close() interface as server.Connection so
+    the shared handlers in server.py (send_json, broadcast, register_user, ...)
+    work unchanged. A Protocol keeps no task or stream objects per connection,
+    which keeps idle connections cheap.
+
+    Outgoing frames are written straight to the transport until its buffer
+    passes WRITE_HIGH_WATER (pause_writing); after that they wait in a
+    bounded SendQueue and are flushed on resume_writing. A source (a replay)
+    is pulled one item per turn of the loop while the transport keeps up.
+    """
+
+    __slots__ = ('transport', 'addr', 'username', 'queue', 'encoder', 'compressor', '_decoder', '_closed',
+                 '_paused', '_pulling', '_bucket')
+
+    def __init__(self):
+        self.transport = None
+        self.addr = None
+        self.username = None
+        self.queue = send_queue.SendQueue(server.SEND_QUEUE_SIZE, server.SLOW_CONSUMER_POLICY)
+        self.encoder = None
+        self.compressor = None
+        # bufsize=0: idle connections hold no receive buffer
+        self._decoder = LineDecoder(max_line=server.MAX_LINE_LENGTH, bufsize=0)
+        self._closed = False
+        self._paused = False
+        self._pulling = False  # a _pull() is scheduled
+        self._bucket = None  # rate limit state, if server.limiter is set
+
+    # ---- connection interface used by server.py ----
+    def send_frame(self, data, key=None):
+        if self._closed:
+            return
+        if not self.queue.put(server.wire_frame(self, data), key):
+            # slow-consumer policy says disconnect
+            self.abort()
+            return
+        if not self._paused:
+            self._flush()
+
+    def send_source(self, source):
+        """Write the items of source (wire data) as the transport catches up."""
+        self.queue.add_source(source)
+        if not self._paused and not self._closed:
+            self._flush()
+
+    def _flush(self):
+        batch = self.queue.get_nowait()
+        if batch:
+            self.transport.writelines(batch)
+            server.frames_sent.value += len(batch)
+            server.bytes_sent.value += sum(map(len, batch))
+        if self.queue.pulling and not self._pulling:
+            # one item per turn, so a long replay does not hold up the loop
+            self._pulling = True
+            asyncio.get_running_loop().call_soon(self._pull)
+
+    def _pull(self):
+        self._pulling = False
+        if not self._paused and not self._closed:
+            self._flush()
+
+    def close(self):
+        """Flush whatever is queued, then close the transport."""
+        if not self._closed:
+            self._flush()
+            self._closed = True
+            self.queue.close()
+            self.transport.close()
+
+    def abort(self):
+        """Close now, discarding queued frames."""
+        if not self._closed:
+            self._closed = True
+            self.queue.close()
+            self.transport.abort()
+
+    # ---- asyncio callbacks ----
+    def connection_made(self, transport):
+        self.transport = transport
+        self.addr = transport.get_extra_info('peername')
+        transport.set_write_buffer_limits(high=WRITE_HIGH_WATER)
+        if server.limiter:
+            self._bucket = server.limiter.open(self.addr[0])
+        server.connections_accepted.value += 1
+        print(f"[NEW CONNECTION] {self.addr}")
+
+    def data_received(self, data):
+        try:
+            messages = self._decoder.feed(data)
+        except LineTooLong:
+            self.abort()
+            return
+        server.bytes_received.value += len(data)
+        server.frames_received.value += len(messages)
+        if self._bucket:
+            server.limiter.received(self._bucket, len(data))
+        self._process(messages, 0)
+
+    def _process(self, messages, i):
+        """Handle messages[i:]. Returns False if the rate limiter (or a join
+        waiting for its name to be claimed) paused the connection; _release()
+        (or _claimed()) carries on from there."""
+        for i in range(i, len(messages)):
+            if self._closed:
+                break
+            if self._bucket:
+                try:
+                    wait = server.rate_admit(self, self._bucket)
+                except rate_limit.RateLimitExceeded:
+                    self.close()
+                    break
+                if wait is None:
+                    continue
+                if wait:
+                    # the kernel buffers fill up while we are not reading, and
+                    # TCP slows the client down
+                    self.transport.pause_reading()
+                    asyncio.get_running_loop().call_later(wait, self._release, messages, i)
+                    return False
+            if not self._handle(messages, i):
+                return False
+        return True
+
+    def _release(self, messages, i):
+        """messages[i] was admitted after a wait: handle it and the rest."""
+        if self._closed:
+            return
+        if self._handle(messages, i) and self._process(messages, i + 1) and not self._closed:
+            self.transport.resume_reading()
+
+    def _handle(self, messages, i):
+        """Handle messages[i]. Returns False if it paused the connection."""
+        msg = messages[i]
+        if self.username is None:
+            # ignore everything until join
+            if msg.get('type') == 'join':
+                name = msg.get('from')
+                if server.backplane and isinstance(name, str) and name:
+                    # claiming the name waits for the other workers: do it
+                    # off the loop, and read nothing more until it is done
+                    self.transport.pause_reading()
+                    future = asyncio.get_running_loop().run_in_executor(None, server.claim_name, name)
+                    future.add_done_callback(lambda f: self._claimed(messages, i, f))
+                    return False
+                self._join(msg)
+            return True
+        server.handle_frame(self, self.username, msg)
+        return True
+
+    def _join(self, msg, claimed=None):
+        self.username = server.register_user(self, self.addr, msg, claimed)
+        if self.username and self.encoder:
+            self._decoder = server.binary_decoder(self._decoder)
+
+    def _claimed(self, messages, i, future):
+        """The name in the join messages[i] was claimed (or not): finish the
+        join and handle the rest."""
+        claimed = future.exception() is None and future.result()
+        if self._closed:
+            if claimed:
+                server.backplane.release(messages[i]['from'])
+            return
+        self._join(messages[i], claimed)
+        if self._process(messages, i + 1) and not self._closed:
+            self.transport.resume_reading()
+
+    def pause_writing(self):
+        self._paused = True
+
+    def resume_writing(self):
+        self._paused = False
+        if not self._closed:
+            self._flush()
+
+    def connection_lost(self, exc):
+        self._closed = True
+        self.queue.close()
+        if self._bucket:
+            server.limiter.close(self._bucket)
+        if self.username:
+            server.unregister_user(self.username)
+        server.frames_dropped.value += self.queue.dropped
+        print(f"[DISCONNECTED] {self.addr} ({self.username})")
+
+
+async def _serve(host, port, reuse_port=False):
+    loop = asyncio.get_running_loop()
+    # presence announcements are flushed on the loop thread too
+    server.presence.call_later = loop.call_later
+    # admin commands (kick, broadcast, shutdown) arrive on the management threads
+    server.dispatch = loop.call_soon_threadsafe
+    if server.backplane:
+        # frames from other workers arrive on the bus thread; hand them to the loop
+        server.backplane.dispatch = loop.call_soon_threadsafe
+    srv = await loop.create_server(ChatProtocol, host, port, reuse_address=True,
+                                   reuse_port=reuse_port or None, backlog=BACKLOG)
+    # resolved by an admin shutdown once the connections have drained
+    stopped = loop.create_future()
+    server.stop_engine = lambda: loop.call_soon_threadsafe(stopped.set_result, None)
+    print(f"Starting chat server (asyncio) on {host}:{port}")
+    async with srv:
+        await stopped
+
+
+def serve(host=server.HOST, port=server.PORT, reuse_port=False):
+    try:
+        asyncio.run(_serve(host, port, reuse_port))
+    except KeyboardInterrupt:
+        print("Shutting down server...")
+
+
+if __name__ == "__main__":
+    serve()
@@ -0,0 +1,505 @@
+# backplane.py
+# Shares presence and fan-out between chat server processes.
+#
+# server.py talks to one Backplane object (server.backplane) and never to the
+# transport behind it:
+#   ipc_bus.BusClient       - workers of one multi-process server (--workers N)
+#   TcpPeerBackplane        - cluster of nodes linked by plain TCP (--peers ...)
+# A broker-based backend (Redis pub/sub plus a SETNX-style registry) would
+# implement the same methods.
+#
+# Every backend uses the same small binary message format:
+#   [op:1][req_id:4][name_len:2][payload_len:4] name(UTF-8) payload
+# Frames are carried as the already-encoded bytes, so a broadcast is still
+# serialized once, by the process that received it.
+#
+# Sending never blocks: each link has its own queue and writer thread
+# (LinkWriter), like client connections have their SendQueue, so a slow
+# peer or worker does not stall the threads that talk to the others, nor
+# anyone waiting for a lock the sender holds.
+
+import socket
+import struct
+import threading
+import time
+import zlib
+
+import send_queue
+
+_HDR = struct.Struct('!BIHI')
+
+CLAIM = 1            # reserve a username; answered with REPLY
+REPLY = 2            # payload b'\x01' = ok, b'\x00' = taken
+RELEASE = 3          # username left
+PUBLISH = 4          # name = excluded username, payload = frame for everyone
+UNICAST = 5          # name = recipient, payload = frame
+PRESENCE_ADD = 6     # name came online on the sender's side
+PRESENCE_REMOVE = 7  # name went offline on the sender's side
+HELLO = 8            # first message on a peer link; name = sender's node id
+ROOM_ADD = 9         # name = username, payload = room (UTF-8)
+ROOM_REMOVE = 10     # name = username, payload = room (UTF-8)
+ROOM_PUBLISH = 11    # name = room, payload = frame for the room's members
+
+CLAIM_TIMEOUT = 5.0
+RECONNECT_DELAY = 1.0
+LINK_QUEUE = 65536  # messages queued for one link before the other end is considered stuck
+
+
+def pack_message(op, name='', payload=b'', req_id=0):
+    name = name.encode('utf-8')
+    return _HDR.pack(op, req_id, len(name), len(payload)) + name + payload
+
+
+def read_message(stream):
+    """Read one message from a buffered socket file (sock.makefile('rb')).
+    Returns (op, req_id, name, payload), or None on EOF."""
+    head = stream.read(_HDR.size)
+    if len(head) < _HDR.size:
+        return None
+    op, req_id, name_len, payload_len = _HDR.unpack(head)
+    body = stream.read(name_len + payload_len)
+    if len(body) < name_len + payload_len:
+        return None
+    return op, req_id, body[:name_len].decode('utf-8'), body[name_len:]
+
+
+def parse_address(text):
+    host, _, port = text.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+class Backplane:
+    """Interface used by server.py.
+
+    Frames received from elsewhere are delivered by calling
+    on_publish(frame, exclude_username), on_unicast(username, frame) and
+    on_room_publish(room, frame) through dispatch(fn, *args); the asyncio
+    engine replaces dispatch with loop.call_soon_threadsafe so delivery
+    happens on the loop thread.
+    """
+
+    def __init__(self, on_publish, on_unicast, on_room_publish):
+        self.on_publish = on_publish
+        self.on_unicast = on_unicast
+        self.on_room_publish = on_room_publish
+        self.dispatch = lambda fn, *args: fn(*args)
+
+    def claim(self, username):
+        """Reserve username everywhere; False if it is already taken."""
+        raise NotImplementedError
+
+    def release(self, username):
+        raise NotImplementedError
+
+    def publish(self, frame, exclude_username=None):
+        """Deliver frame to every user connected elsewhere."""
+        raise NotImplementedError
+
+    def unicast(self, username, frame):
+        """Deliver frame to a user connected elsewhere; False if unknown."""
+        raise NotImplementedError
+
+    def users(self):
+        """Usernames online elsewhere."""
+        raise NotImplementedError
+
+    def join_room(self, username, room):
+        raise NotImplementedError
+
+    def leave_room(self, username, room):
+        raise NotImplementedError
+
+    def publish_room(self, room, frame):
+        """Deliver frame to the room's members connected elsewhere; only
+        processes that have members in the room receive it."""
+        raise NotImplementedError
+
+    def room_users(self, room):
+        """Members of room connected elsewhere."""
+        raise NotImplementedError
+
+    def room_counts(self):
+        """{room: member count} for members connected elsewhere."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class RoomTable:
+    """Room memberships owned by other processes: room -> {username: owner}."""
+
+    def __init__(self):
+        self.rooms = {}
+
+    def add(self, room, username, owner):
+        self.rooms.setdefault(room, {})[username] = owner
+
+    def remove(self, room, username, owner=None):
+        members = self.rooms.get(room)
+        if members is None or username not in members:
+            return
+        if owner is not None and members[username] != owner:
+            return
+        del members[username]
+        if not members:
+            del self.rooms[room]
+
+    def drop_owner(self, owner):
+        """Forget every membership of owner; returns [(room, username)]."""
+        gone = []
+        for room, members in list(self.rooms.items()):
+            for username, o in list(members.items()):
+                if o == owner:
+                    gone.append((room, username))
+                    self.remove(room, username)
+        return gone
+
+    def members(self, room):
+        return list(self.rooms.get(room, ()))
+
+    def owners(self, room):
+        return set(self.rooms.get(room, {}).values())
+
+    def counts(self):
+        return {room: len(members) for room, members in self.rooms.items()}
+
+
+class LinkWriter:
+    """Outbound side of one link (a peer node or a bus worker). send() only
+    queues, so it can be called under a lock; a thread of its own writes the
+    queue to the socket, everything pending in one sendall. The writer owns
+    the socket and closes it when it stops.
+
+    The queue uses the DISCONNECT policy: dropping some messages would leave
+    the other end with a wrong view of presence, so a link that falls
+    LINK_QUEUE messages behind is shut down instead. The reading side sees
+    that as the link going away (and a peer link reconnects and resyncs)."""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.queue = send_queue.SendQueue(LINK_QUEUE, send_queue.DISCONNECT)
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def send(self, data):
+        """Queue data; False if the link is gone (the data is dropped)."""
+        if self.queue.put(data):
+            return True
+        self.close()
+        return False
+
+    def close(self):
+        """Stop the link; also wakes a thread blocked reading the socket."""
+        self.queue.close()
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def _run(self):
+        try:
+            while True:
+                batch = self.queue.get()
+                if not batch:
+                    return  # closed and drained
+                self.sock.sendall(b''.join(batch))
+        except OSError:
+            self.close()
+        finally:
+            self.sock.close()
+
+
+class _Waiters:
+    """Pending CLAIM requests, matched to REPLY by req_id."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.next_id = 0
+
+    def new(self):
+        with self.lock:
+            self.next_id += 1
+            waiter = self.pending[self.next_id] = [threading.Event(), False]
+            return self.next_id, waiter
+
+    def resolve(self, req_id, ok):
+        with self.lock:
+            waiter = self.pending.pop(req_id, None)
+            if waiter:
+                waiter[1] = ok
+                waiter[0].set()
+
+    def wait(self, req_id, waiter, timeout=CLAIM_TIMEOUT):
+        """(answered, ok). Once it returns, a late reply changes nothing."""
+        waiter[0].wait(timeout)
+        with self.lock:
+            self.pending.pop(req_id, None)
+            return waiter[0].is_set(), waiter[1]
+
+
+class _PeerLink:
+    """Outgoing connection to one peer node. Reconnects in the background;
+    messages sent while it is down are dropped."""
+
+    def __init__(self, node_id, on_connect):
+        self.node_id = node_id
+        self.on_connect = on_connect
+        self.lock = threading.Lock()
+        self.writer = None  # LinkWriter while connected
+        self._closed = False
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def send(self, data):
+        with self.lock:
+            writer = self.writer
+        return writer is not None and writer.send(data)
+
+    def _drop(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    def _run(self):
+        while not self._closed:
+            try:
+                sock = socket.create_connection(parse_address(self.node_id), timeout=RECONNECT_DELAY)
+            except OSError:
+                time.sleep(RECONNECT_DELAY)
+                continue
+            sock.settimeout(None)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.on_connect(self, sock)
+            # the link is send-only; recv() just tells us when the peer goes away
+            try:
+                while sock.recv(4096):
+                    pass
+            except OSError:
+                pass
+            with self.lock:
+                if self.writer is not None and self.writer.sock is sock:
+                    self._drop()
+            if not self._closed:
+                print(f"[CLUSTER] lost link to {self.node_id}")
+                time.sleep(RECONNECT_DELAY)
+
+    def close(self):
+        self._closed = True
+        with self.lock:
+            self._drop()
+
+
+class TcpPeerBackplane(Backplane):
+    """Full mesh of TCP links between cluster nodes.
+
+    Each node listens on its cluster address (its node id, "host:port") and
+    dials every peer; a pair of nodes therefore uses one connection in each
+    direction, each carrying traffic one way.
+
+    Username uniqueness: every name has a home node, picked by hashing the
+    name over the sorted node list, which holds the authoritative claim.
+    All nodes must be started with the same node list, spelled the same
+    way. If the home node is unreachable the claim falls back to what this
+    node can see, so joins keep working while a node is down.
+
+    Presence: a node announces its own users to every peer (and replays them
+    when a link comes up), so each node knows which node owns each user and
+    sends private frames straight to it.
+    """
+
+    def __init__(self, node_id, peers, on_publish, on_unicast, on_room_publish):
+        super().__init__(on_publish, on_unicast, on_room_publish)
+        self.node_id = node_id
+        self.nodes = sorted(set(peers) | {node_id})
+        self._lock = threading.Lock()
+        self._local = {}    # usernames on this node (dict keeps join order)
+        self._remote = {}   # username -> owning node id
+        self._claims = {}   # username -> node id, for names whose home is this node
+        self._local_rooms = RoomTable()   # owner = None
+        self._remote_rooms = RoomTable()  # owner = node id
+        self._waiters = _Waiters()
+        self._listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._listener.bind(parse_address(node_id))
+        self._listener.listen(64)
+        self._links = {peer: _PeerLink(peer, self._link_up) for peer in self.nodes if peer != node_id}
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+        print(f"[CLUSTER] node {node_id}, peers: {', '.join(self._links) or '(none)'}")
+
+    def _home(self, username):
+        return self.nodes[zlib.crc32(username.encode('utf-8')) % len(self.nodes)]
+
+    def _send_all(self, data):
+        for link in self._links.values():
+            link.send(data)
+
+    # ---- Backplane interface ----
+    def claim(self, username):
+        home = self._home(username)
+        if home == self.node_id:
+            with self._lock:
+                ok = username not in self._claims
+                if ok:
+                    self._claims[username] = self.node_id
+        else:
+            req_id, waiter = self._waiters.new()
+            sent = self._links[home].send(pack_message(CLAIM, username, req_id=req_id))
+            answered, ok = self._waiters.wait(req_id, waiter, CLAIM_TIMEOUT if sent else 0)
+            if not sent:
+                # home node is down: best effort with what this node knows
+                with self._lock:
+                    ok = username not in self._remote and username not in self._local
+            elif not answered:
+                # no answer in time (ok is False): the home node may still
+                # grant it, or just has, so give it back
+                self._links[home].send(pack_message(RELEASE, username))
+        if ok:
+            with self._lock:
+                self._local[username] = None
+                self._send_all(pack_message(PRESENCE_ADD, username))
+        return ok
+
+    def release(self, username):
+        home = self._home(username)
+        with self._lock:
+            self._local.pop(username, None)
+            if home == self.node_id:
+                if self._claims.get(username) == self.node_id:
+                    del self._claims[username]
+            self._send_all(pack_message(PRESENCE_REMOVE, username))
+        if home != self.node_id:
+            self._links[home].send(pack_message(RELEASE, username))
+
+    def publish(self, frame, exclude_username=None):
+        self._send_all(pack_message(PUBLISH, exclude_username or '', frame))
+
+    def unicast(self, username, frame):
+        with self._lock:
+            owner = self._remote.get(username)
+        if owner is None:
+            return False
+        return self._links[owner].send(pack_message(UNICAST, username, frame))
+
+    def users(self):
+        with self._lock:
+            return list(self._remote)
+
+    def join_room(self, username, room):
+        with self._lock:
+            self._local_rooms.add(room, username, None)
+            self._send_all(pack_message(ROOM_ADD, username, room.encode('utf-8')))
+
+    def leave_room(self, username, room):
+        with self._lock:
+            self._local_rooms.remove(room, username)
+            self._send_all(pack_message(ROOM_REMOVE, username, room.encode('utf-8')))
+
+    def publish_room(self, room, frame):
+        with self._lock:
+            nodes = self._remote_rooms.owners(room)
+        if nodes:
+            data = pack_message(ROOM_PUBLISH, room, frame)
+            for node in nodes:
+                self._links[node].send(data)
+
+    def room_users(self, room):
+        with self._lock:
+            return self._remote_rooms.members(room)
+
+    def room_counts(self):
+        with self._lock:
+            return self._remote_rooms.counts()
+
+    def close(self):
+        for link in self._links.values():
+            link.close()
+        self._listener.close()
+
+    # ---- links ----
+    def _link_up(self, link, sock):
+        """Outgoing link connected: introduce ourselves and replay our users.
+        Done under _lock so no presence change can slip in between; the replay
+        is queued before the link is usable, so it goes out first."""
+        with self._lock:
+            data = pack_message(HELLO, self.node_id)
+            data += b''.join(pack_message(PRESENCE_ADD, name) for name in self._local)
+            data += b''.join(pack_message(ROOM_ADD, name, room.encode('utf-8'))
+                             for room, members in self._local_rooms.rooms.items() for name in members)
+            writer = LinkWriter(sock)
+            writer.send(data)
+            with link.lock:
+                link.writer = writer
+        print(f"[CLUSTER] linked to {link.node_id}")
+
+    def _accept_loop(self):
+        try:
+            while True:
+                conn, _ = self._listener.accept()
+                threading.Thread(target=self._serve_peer, args=(conn,), daemon=True).start()
+        except OSError:
+            pass  # closed
+
+    def _serve_peer(self, conn):
+        stream = conn.makefile('rb')
+        node = None
+        try:
+            msg = read_message(stream)
+            if msg is None or msg[0] != HELLO or msg[2] not in self._links:
+                return
+            node = msg[2]
+            while True:
+                msg = read_message(stream)
+                if msg is None:
+                    break
+                self._handle(node, *msg)
+        except OSError:
+            pass
+        finally:
+            conn.close()
+            if node:
+                self._node_lost(node)
+
+    def _handle(self, node, op, req_id, name, payload):
+        if op == PUBLISH:
+            self.dispatch(self.on_publish, payload, name or None)
+        elif op == UNICAST:
+            self.dispatch(self.on_unicast, name, payload)
+        elif op == PRESENCE_ADD:
+            with self._lock:
+                self._remote[name] = node
+                if self._home(name) == self.node_id:
+                    # also rebuilds the claim table after this node restarts
+                    self._claims.setdefault(name, node)
+        elif op == PRESENCE_REMOVE:
+            with self._lock:
+                if self._remote.get(name) == node:
+                    del self._remote[name]
+        elif op == CLAIM:
+            with self._lock:
+                ok = name not in self._claims
+                if ok:
+                    self._claims[name] = node
+            self._links[node].send(pack_message(REPLY, req_id=req_id, payload=b'\x01' if ok else b'\x00'))
+        elif op == RELEASE:
+            with self._lock:
+                if self._claims.get(name) == node:
+                    del self._claims[name]
+        elif op == REPLY:
+            self._waiters.resolve(req_id, payload == b'\x01')
+        elif op == ROOM_ADD:
+            with self._lock:
+                self._remote_rooms.add(payload.decode('utf-8'), name, node)
+        elif op == ROOM_REMOVE:
+            with self._lock:
+                self._remote_rooms.remove(payload.decode('utf-8'), name, node)
+        elif op == ROOM_PUBLISH:
+            self.dispatch(self.on_room_publish, name, payload)
+
+    def _node_lost(self, node):
+        """A peer went away: its users are no longer online anywhere."""
+        with self._lock:
+            for table in (self._remote, self._claims):
+                for name in [n for n, owner in table.items() if owner == node]:
+                    del table[name]
+            self._remote_rooms.drop_owner(node)
+        print(f"[CLUSTER] node {node} disconnected")
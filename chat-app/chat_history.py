@@ -1,57 +1,610 @@
 # chat_history.py
+#
+# Lưu trữ lịch sử dạng log chỉ-ghi-thêm (append-only):
+#   chat_history/<user>/<first_id>.jsonl
+# Mỗi dòng là một tin nhắn JSON kèm "id" tăng dần. Ghi thêm một tin là O(1)
+# (một lần write vào segment đang mở). Khi segment đầy thì mở segment mới và
+# xóa các segment nằm hẳn ngoài giới hạn MAX_HISTORY (compaction).
+# File cũ chat_history/<user>.json được tự động chuyển đổi lần đầu mở log,
+# hoặc chạy một lần cho tất cả: python chat_history.py migrate
+#
+# Mỗi segment có file chỉ mục <first_id>.idx (offset từng dòng) và thư mục có
+# meta.json (số đếm, peers, khoảng thời gian của từng segment). query_history()
+# dùng chúng để phân trang theo con trỏ mà chỉ đọc phần cuối hoặc đúng các
+# segment cần thiết.
+#
+# search.db (xem history_search.py) là chỉ mục toàn văn được cập nhật cùng lúc
+# với mỗi lần ghi thêm; search_history() tìm theo từ khóa, không phân biệt dấu.
+#
+# HistoryWriter ghi log trong một thread nền theo lô (group commit), để luồng
+# nhận tin của client không phải chờ đĩa.
+import bisect
 import json
 import os
+import queue
+import shutil
+import struct
+import sys
+import threading
+import time
 from datetime import datetime
 
+import history_search
+
 HISTORY_DIR = "chat_history"
+MAX_HISTORY = 1000      # số tin nhắn giữ lại cho mỗi user
+SEGMENT_RECORDS = 256   # số tin nhắn tối đa trong một segment
+SEGMENT_EXT = ".jsonl"
+INDEX_EXT = ".idx"
+META_FILE = "meta.json"
+SEARCH_DB = "search.db"
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Một entry chỉ mục: id, offset của dòng trong segment, thời gian (epoch ms), chiều
+_IDX = struct.Struct('<QQqB')
+DIR_FLAGS = {"in": 1, "out": 2}
+
+# Chính sách fsync của HistoryWriter
+FSYNC_NEVER = "never"        # để hệ điều hành tự ghi xuống đĩa
+FSYNC_BATCH = "batch"        # fsync sau mỗi lô
+FSYNC_INTERVAL = "interval"  # fsync tối đa một lần mỗi FSYNC_INTERVAL giây
+FSYNC_POLICIES = (FSYNC_NEVER, FSYNC_BATCH, FSYNC_INTERVAL)
+FSYNC_INTERVAL_SECONDS = 1.0
+
+_logs = {}  # user dir -> HistoryLog
+_logs_lock = threading.Lock()
 
 def ensure_history_dir():
     """Đảm bảo thư mục lịch sử tồn tại"""
     if not os.path.exists(HISTORY_DIR):
         os.makedirs(HISTORY_DIR)
 
-def get_user_file(username):
-    """Lấy đường dẫn file lịch sử của user"""
+def _safe_name(username):
     # Làm sạch username để tránh lỗi đường dẫn
     safe_username = "".join(c for c in username if c.isalnum() or c in ('-', '_')).rstrip()
     if not safe_username:
         safe_username = "unknown"
-    return os.path.join(HISTORY_DIR, f"{safe_username}.json")
+    return safe_username
 
-def repair_history_file(username):
-    """Sửa chữa file lịch sử bị hỏng"""
-    ensure_history_dir()
+def get_user_file(username):
+    """Lấy đường dẫn file lịch sử kiểu cũ (một file JSON) của user"""
+    return os.path.join(HISTORY_DIR, f"{_safe_name(username)}.json")
+
+def get_user_dir(username):
+    """Lấy thư mục chứa các segment lịch sử của user"""
+    return os.path.join(HISTORY_DIR, _safe_name(username))
+
+def _time_ms(value):
+    """Chuyển thời gian (chuỗi TIME_FORMAT, datetime hoặc epoch ms) sang epoch ms; 0 nếu không đọc được."""
+    if isinstance(value, (int, float)):
+        return int(value)
+    try:
+        if isinstance(value, str):
+            value = datetime.strptime(value, TIME_FORMAT)
+        if isinstance(value, datetime):
+            return int(value.timestamp() * 1000)
+    except (ValueError, OverflowError, OSError):
+        pass
+    return 0
+
+
+class HistoryLog:
+    """Log append-only của một user. Dùng qua get_log(), không tạo trực tiếp.
+
+    Bên cạnh mỗi segment <first_id>.jsonl có file chỉ mục <first_id>.idx gồm
+    các bản ghi _IDX cố định (id, offset, thời gian, chiều), nhờ đó truy vấn
+    chỉ đọc đúng đoạn byte cần thiết. meta.json lưu số đếm, khoảng thời gian
+    và tập người chat (peers) của từng segment để bỏ qua segment không khớp
+    và tính thống kê mà không phải quét lại toàn bộ.
+
+    meta.json chỉ được ghi khi chuyển segment, flush() và close(), không phải
+    mỗi lần append: nếu chương trình dừng giữa chừng, kích thước segment đang
+    ghi không khớp meta và _open chỉ dựng lại segment đó.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.segments = []   # first id của từng segment, tăng dần
+        self.seg_info = {}   # first id -> {"count", "in", "out", "size", "t0", "t1", "peers"}
+        self.next_id = 1
+        self._active_index = []  # các entry chỉ mục của segment đang ghi
+        self._fh = None
+        self._idx_fh = None
+        self._meta_dirty = False  # seg_info đã đổi mà chưa ghi meta.json
+        self.search = None
+        self._open()
+        self._open_search()
+
+    def _segment_path(self, first_id):
+        return os.path.join(self.path, f"{first_id:012d}{SEGMENT_EXT}")
+
+    def _index_path(self, first_id):
+        return os.path.join(self.path, f"{first_id:012d}{INDEX_EXT}")
+
+    def _open(self):
+        os.makedirs(self.path, exist_ok=True)
+        self.segments = sorted(
+            int(name[:-len(SEGMENT_EXT)]) for name in os.listdir(self.path)
+            if name.endswith(SEGMENT_EXT) and name[:-len(SEGMENT_EXT)].isdigit()
+        )
+        meta = {}
+        try:
+            with open(os.path.join(self.path, META_FILE), 'r', encoding='utf-8') as f:
+                meta = json.load(f).get("segments", {})
+        except (OSError, ValueError):
+            pass
+        if self.segments:
+            self._repair_tail(self._segment_path(self.segments[-1]))
+        for first_id in self.segments:
+            info = meta.get(str(first_id))
+            if (info is None or not os.path.exists(self._index_path(first_id))
+                    or info.get("size") != os.path.getsize(self._segment_path(first_id))):
+                # thiếu chỉ mục/meta hoặc segment đã thay đổi: dựng lại từ segment
+                info = self._reindex(first_id)
+            else:
+                info["peers"] = set(info.get("peers", ()))
+            self.seg_info[first_id] = info
+        if not self.segments:
+            return
+        last = self.segments[-1]
+        self._active_index = self._read_index(last)
+        self.next_id = self._active_index[-1][0] + 1 if self._active_index else last
+        self._save_meta()
+
+    def _open_search(self):
+        """Mở chỉ mục toàn văn và đánh chỉ mục bù các tin còn thiếu (vd. log cũ hoặc sau khi bị tắt đột ngột)."""
+        self.search = history_search.SearchIndex(os.path.join(self.path, SEARCH_DB))
+        last = self.search.last_id()
+        if last >= self.next_id:
+            self.search.reset()  # chỉ mục không khớp với log
+            last = 0
+        while True:
+            missing = self.query(after=last, limit=5000)
+            if not missing:
+                break
+            self.search.add((r["id"], r.get("msg")) for r in missing)
+            last = missing[-1]["id"]
+
+    @staticmethod
+    def _repair_tail(seg_path):
+        """Cắt bỏ dòng ghi dở ở cuối segment (vd. chương trình bị tắt giữa chừng)."""
+        with open(seg_path, 'rb+') as f:
+            data = f.read()
+            if data and not data.endswith(b'\n'):
+                cut = data.rfind(b'\n') + 1
+                f.truncate(cut)
+                print(f" Đã sửa dòng ghi dở ở cuối {seg_path}")
+
+    @staticmethod
+    def _new_info():
+        return {"count": 0, "in": 0, "out": 0, "size": 0, "t0": 0, "t1": 0, "peers": set()}
+
+    @staticmethod
+    def _account(info, record, ts, size):
+        info["count"] += 1
+        direction = record.get("dir")
+        if direction in ("in", "out"):
+            info[direction] += 1
+        info["size"] += size
+        if ts:
+            info["t0"] = min(info["t0"], ts) if info["t0"] else ts
+            info["t1"] = max(info["t1"], ts)
+        for key in ("from", "to"):
+            if record.get(key):
+                info["peers"].add(record[key])
+
+    def _reindex(self, first_id):
+        """Dựng lại file .idx và thông tin meta của một segment bằng cách quét nó."""
+        info = self._new_info()
+        entries = bytearray()
+        offset = 0
+        with open(self._segment_path(first_id), 'rb') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    ts = _time_ms(record.get("time"))
+                    entries += _IDX.pack(record["id"], offset, ts, DIR_FLAGS.get(record.get("dir"), 0))
+                    self._account(info, record, ts, 0)
+                except (ValueError, KeyError, TypeError):
+                    pass  # bỏ qua dòng hỏng
+                offset += len(line)
+        info["size"] = offset
+        with open(self._index_path(first_id), 'wb') as f:
+            f.write(entries)
+        return info
+
+    def _read_index(self, first_id):
+        if self.segments and first_id == self.segments[-1] and self._active_index:
+            return self._active_index
+        try:
+            with open(self._index_path(first_id), 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return []
+        return list(_IDX.iter_unpack(data[:len(data) - len(data) % _IDX.size]))
+
+    def _save_meta(self):
+        segments = {str(k): {**v, "peers": sorted(v["peers"])} for k, v in self.seg_info.items()}
+        tmp = os.path.join(self.path, META_FILE + ".tmp")
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({"next_id": self.next_id, "segments": segments}, f, ensure_ascii=False)
+        os.replace(tmp, os.path.join(self.path, META_FILE))
+        self._meta_dirty = False
+
+    def _roll(self):
+        """Mở segment mới và xóa các segment đã nằm ngoài MAX_HISTORY."""
+        self._close_files()
+        self.segments.append(self.next_id)
+        self.seg_info[self.next_id] = self._new_info()
+        self._active_index = []
+        oldest_kept = self.next_id - MAX_HISTORY
+        # segment i chứa các id < segments[i + 1]
+        dropped = False
+        while len(self.segments) > 1 and self.segments[1] <= oldest_kept:
+            first_id = self.segments.pop(0)
+            self.seg_info.pop(first_id, None)
+            for p in (self._segment_path(first_id), self._index_path(first_id)):
+                try:
+                    os.remove(p)
+                except FileNotFoundError:
+                    pass
+            dropped = True
+        if dropped and self.search:
+            self.search.prune(self.segments[0])
+        self._save_meta()
+
+    def append(self, records, fsync=False):
+        """Ghi thêm một hoặc nhiều tin nhắn. Trả về id của tin cuối."""
+        with self.lock:
+            lines, entries, texts = [], [], []
+            for record in records:
+                if not self.segments or self.seg_info[self.segments[-1]]["count"] >= SEGMENT_RECORDS:
+                    self._write(lines, entries, fsync)
+                    lines, entries = [], []
+                    self._roll()
+                info = self.seg_info[self.segments[-1]]
+                line = json.dumps({"id": self.next_id, **record}, ensure_ascii=False).encode('utf-8') + b'\n'
+                ts = _time_ms(record.get("time"))
+                entry = (self.next_id, info["size"], ts, DIR_FLAGS.get(record.get("dir"), 0))
+                self._account(info, record, ts, len(line))
+                lines.append(line)
+                entries.append(entry)
+                texts.append((self.next_id, record.get("msg")))
+                self.next_id += 1
+            self._write(lines, entries, fsync)
+            self._meta_dirty = True
+            if self.search:
+                self.search.add(texts)
+            return self.next_id - 1
+
+    def _write(self, lines, entries, fsync):
+        if not lines:
+            return
+        first_id = self.segments[-1]
+        if self._fh is None:
+            self._fh = open(self._segment_path(first_id), 'ab')
+            self._idx_fh = open(self._index_path(first_id), 'ab')
+        # dữ liệu trước, chỉ mục sau: nếu bị ngắt giữa chừng, _open sẽ dựng lại chỉ mục
+        self._fh.write(b''.join(lines))
+        self._fh.flush()
+        self._idx_fh.write(b''.join(_IDX.pack(*e) for e in entries))
+        self._idx_fh.flush()
+        self._active_index.extend(entries)
+        if fsync:
+            os.fsync(self._fh.fileno())
+            os.fsync(self._idx_fh.fileno())
+
+    def query(self, before=None, after=None, before_time=None, after_time=None, peer=None, limit=50):
+        """Truy vấn theo con trỏ, trả về list tin nhắn theo thứ tự thời gian (cũ -> mới).
+
+        before/after: id tin nhắn (không bao gồm); before_time/after_time: thời
+        gian ('%Y-%m-%d %H:%M:%S', datetime hoặc epoch ms); peer: chỉ lấy tin có
+        from/to là peer. Nếu chỉ có after/after_time thì lấy limit tin ngay sau
+        con trỏ, còn lại lấy limit tin mới nhất trước con trỏ. limit=0: không giới hạn.
+        """
+        t_lo = _time_ms(after_time) if after_time is not None else None
+        t_hi = _time_ms(before_time) if before_time is not None else None
+        forward = (after is not None or after_time is not None) and before is None and before_time is None
+        with self.lock:
+            lo_id = self.next_id - MAX_HISTORY
+            if after is not None:
+                lo_id = max(lo_id, after + 1)
+            hi_id = self.next_id if before is None else min(self.next_id, before)
+            # segment i chứa các id trong [segments[i], segments[i + 1])
+            bounds = list(zip(self.segments, self.segments[1:] + [self.next_id]))
+            if not forward:
+                bounds.reverse()
+            pages = []
+            found = 0
+            for first_id, seg_end in bounds:
+                if limit and found >= limit:
+                    break
+                info = self.seg_info[first_id]
+                if seg_end <= lo_id or first_id >= hi_id or not info["count"]:
+                    continue
+                if peer is not None and peer not in info["peers"]:
+                    continue
+                if (t_lo is not None and info["t1"] and info["t1"] <= t_lo) or \
+                        (t_hi is not None and info["t0"] and info["t0"] >= t_hi):
+                    continue
+                need = limit - found if limit else 0
+                records = self._read_range(first_id, lo_id, hi_id, t_lo, t_hi, peer, need, forward)
+                found += len(records)
+                pages.append(records)
+        if not forward:
+            pages.reverse()
+        result = [r for page in pages for r in page]
+        if limit and len(result) > limit:
+            result = result[:limit] if forward else result[-limit:]
+        return result
+
+    def _read_range(self, first_id, lo_id, hi_id, t_lo, t_hi, peer, need, forward):
+        """Đọc các tin trong một segment thỏa điều kiện, chỉ đọc đoạn byte cần thiết."""
+        index = self._read_index(first_id)
+        ids = [e[0] for e in index]
+        start = bisect.bisect_left(ids, lo_id)
+        stop = bisect.bisect_left(ids, hi_id)
+        picked = [k for k in range(start, stop)
+                  if (t_lo is None or index[k][2] > t_lo) and (t_hi is None or index[k][2] < t_hi)]
+        if need and peer is None:
+            # không lọc theo peer: biết trước chính xác cần những dòng nào
+            picked = picked[:need] if forward else picked[-need:]
+        if not picked:
+            return []
+        size = self.seg_info[first_id]["size"]
+        base = index[picked[0]][1]
+        last = picked[-1]
+        end = index[last + 1][1] if last + 1 < len(index) else size
+        with open(self._segment_path(first_id), 'rb') as f:
+            f.seek(base)
+            block = f.read(end - base)
+        records = []
+        for k in picked:
+            off = index[k][1] - base
+            nxt = (index[k + 1][1] if k + 1 < len(index) else size) - base
+            try:
+                record = json.loads(block[off:nxt])
+            except ValueError:
+                continue
+            if peer is not None and record.get("from") != peer and record.get("to") != peer:
+                continue
+            records.append(record)
+        if need and len(records) > need:
+            records = records[:need] if forward else records[-need:]
+        return records
+
+    def get_messages(self, ids):
+        """Đọc các tin nhắn theo id (bỏ qua id không còn trong log), giữ thứ tự của ids."""
+        found = {}
+        with self.lock:
+            oldest_kept = self.next_id - MAX_HISTORY
+            indexes = {}
+            for msg_id in sorted(set(ids)):
+                if msg_id < oldest_kept or msg_id >= self.next_id:
+                    continue
+                first_id = self.segments[bisect.bisect_right(self.segments, msg_id) - 1]
+                if first_id not in indexes:
+                    indexes[first_id] = self._read_index(first_id)
+                index = indexes[first_id]
+                k = bisect.bisect_left(index, (msg_id,))
+                if k == len(index) or index[k][0] != msg_id:
+                    continue
+                end = index[k + 1][1] if k + 1 < len(index) else self.seg_info[first_id]["size"]
+                with open(self._segment_path(first_id), 'rb') as f:
+                    f.seek(index[k][1])
+                    try:
+                        found[msg_id] = json.loads(f.read(end - index[k][1]))
+                    except ValueError:
+                        pass
+        return [found[i] for i in ids if i in found]
+
+    def stats(self):
+        """Thống kê từ số đếm của từng segment; chỉ segment cũ nhất (bị cắt một
+        phần bởi MAX_HISTORY) mới cần đọc file chỉ mục."""
+        with self.lock:
+            oldest_kept = self.next_id - MAX_HISTORY
+            total = incoming = outgoing = 0
+            for first_id in self.segments:
+                if first_id >= oldest_kept:
+                    info = self.seg_info[first_id]
+                    total += info["count"]
+                    incoming += info["in"]
+                    outgoing += info["out"]
+                    continue
+                for entry in self._read_index(first_id):
+                    if entry[0] >= oldest_kept:
+                        total += 1
+                        incoming += entry[3] == DIR_FLAGS["in"]
+                        outgoing += entry[3] == DIR_FLAGS["out"]
+        return {"total_messages": total, "incoming": incoming, "outgoing": outgoing}
+
+    def _close_files(self):
+        for fh in (self._fh, self._idx_fh):
+            if fh:
+                fh.close()
+        self._fh = self._idx_fh = None
+
+    def flush(self):
+        """Ghi meta.json nếu có thay đổi."""
+        with self.lock:
+            if self._meta_dirty:
+                self._save_meta()
+
+    def close(self):
+        with self.lock:
+            self._close_files()
+            if self._meta_dirty:
+                self._save_meta()
+            if self.search:
+                self.search.close()
+                self.search = None
+
+
+class HistoryWriter:
+    """Ghi lịch sử trong thread nền theo lô (group commit).
+
+    append() chỉ đưa tin vào hàng đợi nên không bao giờ chờ đĩa. Thread ghi
+    gom tin cho đến khi đủ batch_size hoặc đã qua flush_interval giây kể từ
+    tin đầu tiên của lô, rồi ghi cả lô bằng một lần write (và fsync tùy
+    chính sách). flush() và close() ghi nốt mọi tin còn trong hàng đợi và
+    cập nhật meta.json.
+    """
+
+    def __init__(self, username, batch_size=64, flush_interval=0.2, fsync=FSYNC_BATCH):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"unknown fsync policy: {fsync}")
+        self.username = username
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self._queue = queue.Queue()
+        self._last_sync = 0.0
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def append(self, message_data):
+        """Đưa tin nhắn vào hàng đợi ghi (không chặn)."""
+        if not self._closed:
+            self._queue.put(message_data)
+
+    def flush(self, timeout=None):
+        """Chờ đến khi mọi tin đã append trước đó được ghi xong."""
+        if self._closed:
+            return True
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def close(self):
+        """Ghi nốt hàng đợi rồi dừng thread ghi."""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        stop = False
+        while not stop:
+            item = self._queue.get()
+            batch = []
+            waiters = []
+            deadline = time.monotonic() + self.flush_interval
+            # gom lô: dừng khi đủ batch_size, hết thời gian, có yêu cầu flush hoặc close
+            while True:
+                if item is None:
+                    stop = True
+                    break
+                if isinstance(item, threading.Event):
+                    waiters.append(item)
+                    break
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if batch:
+                self._commit(batch)
+            if waiters or stop:
+                try:
+                    get_log(self.username).flush()
+                except Exception as e:
+                    print(f" Lỗi lưu lịch sử: {e}")
+            for done in waiters:
+                done.set()
+
+    def _commit(self, batch):
+        sync = self.fsync == FSYNC_BATCH
+        if self.fsync == FSYNC_INTERVAL:
+            now = time.monotonic()
+            if now - self._last_sync >= FSYNC_INTERVAL_SECONDS:
+                sync = True
+                self._last_sync = now
+        try:
+            get_log(self.username).append(batch, fsync=sync)
+        except Exception as e:
+            print(f" Lỗi lưu lịch sử: {e}")
+
+
+def get_log(username):
+    """Lấy (hoặc mở) log lịch sử của user; tự chuyển đổi file JSON kiểu cũ nếu có."""
+    path = get_user_dir(username)
+    with _logs_lock:
+        log = _logs.get(path)
+        if log is None:
+            ensure_history_dir()
+            log = HistoryLog(path)
+            _logs[path] = log
+            if os.path.exists(get_user_file(username)):
+                migrate_legacy_file(username, log)
+        return log
+
+def migrate_legacy_file(username, log=None):
+    """Chuyển file chat_history/<user>.json (định dạng cũ) sang log segment.
+    File cũ được đổi tên thành .json.migrated."""
     user_file = get_user_file(username)
-    
     if not os.path.exists(user_file):
-        return True
-        
+        return 0
+    history = []
     try:
         with open(user_file, 'r', encoding='utf-8') as f:
             content = f.read().strip()
-            
-        if not content:
-            return True
-            
-        # Thử parse JSON
-        json.loads(content)
-        return True  # File OK
-        
-    except json.JSONDecodeError:
-        # File hỏng, tạo file mới
-        try:
-            backup_file = user_file + ".backup_" + datetime.now().strftime('%Y%m%d_%H%M%S')
-            os.rename(user_file, backup_file)
-            print(f"Đã sửa file lịch sử hỏng, backup: {backup_file}")
-            return True
-        except Exception as e:
-            print(f" Không thể sửa file lịch sử: {e}")
-            return False
+        if content:
+            history = json.loads(content)
+    except (OSError, ValueError) as e:
+        print(f" Không đọc được file lịch sử cũ {user_file}: {e}")
+        return 0
+    if log is None:
+        log = get_log(username)  # mở log lần đầu sẽ tự chuyển đổi
+        if not os.path.exists(user_file):
+            return len(history)
+    if not isinstance(history, list):
+        history = []
+    history = [h for h in history if isinstance(h, dict)][-MAX_HISTORY:]
+    if history:
+        log.append(history)
+    os.replace(user_file, user_file + ".migrated")
+    print(f" Đã chuyển {len(history)} tin nhắn từ {user_file}")
+    return len(history)
+
+def migrate_all():
+    """Chuyển toàn bộ file lịch sử kiểu cũ trong HISTORY_DIR (chạy một lần)."""
+    ensure_history_dir()
+    total = 0
+    for name in sorted(os.listdir(HISTORY_DIR)):
+        if name.endswith(".json") and os.path.isfile(os.path.join(HISTORY_DIR, name)):
+            total += migrate_legacy_file(name[:-len(".json")])
+    return total
+
+def repair_history_file(username):
+    """Sửa chữa log lịch sử bị ghi dở (dòng cuối không trọn vẹn)"""
+    log = get_log(username)
+    try:
+        with log.lock:
+            log._close_files()
+            if log.segments:
+                last = log.segments[-1]
+                log._repair_tail(log._segment_path(last))
+                log.seg_info[last] = log._reindex(last)
+                log._active_index = []
+                log._active_index = log._read_index(last)
+                log._save_meta()
+        return True
+    except OSError as e:
+        print(f" Không thể sửa file lịch sử: {e}")
+        return False
 
 def append_message(username, message_data):
     """
     Thêm tin nhắn vào lịch sử
-    
+
     Args:
         username: Tên người dùng
         message_data: Dict chứa thông tin tin nhắn
@@ -61,41 +614,9 @@ def append_message(username, message_data):
             - msg: Nội dung tin nhắn
             - time: Thời gian
     """
-    ensure_history_dir()
-    
-    # Kiểm tra và sửa file nếu cần
-    if not repair_history_file(username):
-        return False
-        
-    user_file = get_user_file(username)
-    
     try:
-        # Đọc lịch sử hiện tại
-        history = []
-        if os.path.exists(user_file):
-            try:
-                with open(user_file, 'r', encoding='utf-8') as f:
-                    content = f.read().strip()
-                    if content:
-                        history = json.loads(content)
-            except json.JSONDecodeError as e:
-                print(f" File lịch sử bị lỗi, tạo file mới: {e}")
-                # Tạo file mới
-                history = []
-        
-        # Thêm tin nhắn mới
-        history.append(message_data)
-        
-        # Giới hạn lịch sử (1000 tin nhắn gần nhất)
-        if len(history) > 1000:
-            history = history[-1000:]
-        
-        # Lưu file
-        with open(user_file, 'w', encoding='utf-8') as f:
-            json.dump(history, f, ensure_ascii=False, indent=2)
-            
+        get_log(username).append([message_data])
         return True
-        
     except Exception as e:
         print(f" Lỗi lưu lịch sử: {e}")
         return False
@@ -103,90 +624,131 @@ def append_message(username, message_data):
 def load_history(username, limit=200):
     """
     Đọc lịch sử tin nhắn
-    
+
     Args:
         username: Tên người dùng
         limit: Số tin nhắn tối đa (0 để lấy tất cả)
-    
+
     Returns:
         List các tin nhắn (mới nhất đầu tiên)
     """
-    ensure_history_dir()
-    user_file = get_user_file(username)
-    
     try:
-        if os.path.exists(user_file):
-            with open(user_file, 'r', encoding='utf-8') as f:
-                content = f.read().strip()
-                if not content:
-                    return []
-                
-                try:
-                    history = json.loads(content)
-                except json.JSONDecodeError as e:
-                    print(f"⚠️ File lịch sử bị lỗi, tạo file mới: {e}")
-                    # Sao lưu file hỏng và tạo file mới
-                    backup_file = user_file + ".backup"
-                    try:
-                        os.rename(user_file, backup_file)
-                        print(f" Đã sao lưu file hỏng thành: {backup_file}")
-                    except:
-                        pass
-                    return []
-            
-            # Đảo ngược để tin nhắn mới nhất ở cuối
-            history.reverse()
-            
-            if limit and limit > 0:
-                return history[:limit]
-            return history
-            
+        history = get_log(username).query(limit=limit)
+        history.reverse()
+        return history
     except Exception as e:
         print(f" Lỗi đọc lịch sử: {e}")
-    
+
     return []
 
+def query_history(username, before=None, after=None, before_time=None, after_time=None, peer=None, limit=50):
+    """
+    Truy vấn lịch sử có phân trang theo con trỏ
+
+    Args:
+        username: Tên người dùng
+        before / after: id tin nhắn làm con trỏ (không bao gồm chính nó)
+        before_time / after_time: thời gian làm con trỏ ('%Y-%m-%d %H:%M:%S',
+            datetime hoặc epoch ms)
+        peer: chỉ lấy tin nhắn có from hoặc to là peer (vd. 'all', 'Bob')
+        limit: Số tin nhắn tối đa (0 để lấy tất cả)
+
+    Returns:
+        List các tin nhắn theo thứ tự thời gian (cũ trước). Trang cũ hơn:
+        before=result[0]["id"]; trang mới hơn: after=result[-1]["id"].
+    """
+    try:
+        return get_log(username).query(before, after, before_time, after_time, peer, limit)
+    except Exception as e:
+        print(f" Lỗi đọc lịch sử: {e}")
+    return []
+
+def search_history(username, terms, limit=20):
+    """
+    Tìm tin nhắn chứa tất cả các từ khóa (không phân biệt hoa thường và dấu)
+
+    Returns:
+        List các tin nhắn, phù hợp nhất trước
+    """
+    try:
+        log = get_log(username)
+        with log.lock:
+            oldest_kept = log.next_id - MAX_HISTORY
+        hits = log.search.search(terms, limit=limit, min_id=oldest_kept)
+        return log.get_messages([msg_id for msg_id, _ in hits])
+    except Exception as e:
+        print(f" Lỗi tìm kiếm lịch sử: {e}")
+    return []
+
+def server_position(username, limit=100):
+    """
+    Vị trí của client trong kho tin của server, để khi kết nối lại server gửi
+    bù các tin bị lỡ: (store, các id đã nhận), với store là mã kho (trường
+    "store") và các id (trường "sid") lấy từ `limit` tin mới nhất.
+
+    Id chỉ có nghĩa trong một kho, nên chỉ lấy các tin cùng kho với tin mới
+    nhất; tin cũ không ghi kho thì bỏ qua. (None, []) nếu chưa có.
+    """
+    store, ids = None, []
+    try:
+        for h in reversed(get_log(username).query(limit=limit)):
+            if not isinstance(h.get("sid"), int) or not h.get("store"):
+                continue
+            if store is None:
+                store = h["store"]
+            if h["store"] == store:
+                ids.append(h["sid"])
+    except Exception as e:
+        print(f" Lỗi đọc lịch sử: {e}")
+        return None, []
+    return store, ids
+
 def clear_history(username):
     """Xóa toàn bộ lịch sử của user"""
-    ensure_history_dir()
-    user_file = get_user_file(username)
-    
+    path = get_user_dir(username)
     try:
-        if os.path.exists(user_file):
-            os.remove(user_file)
-            return True
+        with _logs_lock:
+            log = _logs.pop(path, None)
+            if log:
+                log.close()
+        removed = False
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+            removed = True
+        if os.path.exists(get_user_file(username)):
+            os.remove(get_user_file(username))
+            removed = True
+        return removed
     except Exception as e:
         print(f" Lỗi xóa lịch sử: {e}")
-    
+
     return False
 
 def get_history_stats(username):
-    """Lấy thống kê lịch sử"""
-    history = load_history(username, limit=0)
-    
-    total = len(history)
-    incoming = len([h for h in history if h.get('dir') == 'in'])
-    outgoing = len([h for h in history if h.get('dir') == 'out'])
-    
-    return {
-        "total_messages": total,
-        "incoming": incoming,
-        "outgoing": outgoing
-    }
+    """Lấy thống kê lịch sử (đếm tăng dần khi ghi, không quét lại lịch sử)"""
+    try:
+        return get_log(username).stats()
+    except Exception as e:
+        print(f" Lỗi đọc lịch sử: {e}")
+    return {"total_messages": 0, "incoming": 0, "outgoing": 0}
 
 # Test code
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "migrate":
+        print(f" Đã chuyển đổi tổng cộng {migrate_all()} tin nhắn")
+        sys.exit(0)
+
     # Test các chức năng
     test_user = "test_user"
-    
+
     # Thêm tin nhắn test
     append_message(test_user, {
         "dir": "out",
-        "to": "all", 
+        "to": "all",
         "msg": "Xin chào mọi người!",
         "time": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     })
-    
+
     append_message(test_user, {
         "dir": "in",
         "from": "user2",
@@ -194,11 +756,11 @@ if __name__ == "__main__":
         "msg": "Chào bạn!",
         "time": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     })
-    
+
     # Đọc lịch sử
     history = load_history(test_user)
     print(f" Lịch sử cho {test_user}: {len(history)} tin nhắn")
-    
+
     # Thống kê
     stats = get_history_stats(test_user)
-    print(f" Thống kê: {stats}")
\ No newline at end of file
+    print(f" Thống kê: {stats}")
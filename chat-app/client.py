@@ -7,17 +7,23 @@ import socket
 import threading
 import json
 import argparse
+from collections import deque
 from datetime import datetime
 from queue import Queue, Empty
 import chat_history
+import frame_compression
+import wire_codec
 
 DELIM = '\n'
+MAX_LINE_LENGTH = 16 * 1024 * 1024  # online_list of a big server can be large
+SEEN_IDS = 4096  # server message ids remembered to drop duplicates (replay overlap)
 
 def now_str():
     return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
 class ChatClient:
-    def __init__(self, username, host='127.0.0.1', port=5555):
+    def __init__(self, username, host='127.0.0.1', port=5555, history_fsync=chat_history.FSYNC_BATCH, compress=True,
+                 binary=True):
         self.username = username
         self.host = host
         self.port = int(port)
@@ -25,12 +31,38 @@ class ChatClient:
         self.recv_thread = None
         self.running = False
         self.recv_queue = Queue()  # queue for received JSON messages
-        self._recv_buffer = ''
+        # JSON lines, plus binary and compressed frames once join_ack enables them
+        self._decoder = wire_codec.FrameDecoder(max_line=MAX_LINE_LENGTH)
+        self.compress = compress
+        self.offer_binary = binary
+        self.binary = False  # server agreed to binary frames
+        # local history is written by a background thread, off the receive path
+        self.history = chat_history.HistoryWriter(username, fsync=history_fsync)
+        # server message ids are only unique within one store (join_ack 'store');
+        # last_seen_id is sent on join so the server replays what we missed
+        self.store, seen = chat_history.server_position(username)
+        self.last_seen_id = max(seen) if seen else None
+        self._seen = set()
+        self._seen_order = deque()
+        for msg_id in seen:
+            self._remember(msg_id)
+        # while the server replays up to the join_ack's last_id, newer messages
+        # arrive live alongside it; they are written to history (which sets
+        # the position for next time) only after replay_end
+        self._replay_upto = None
+        self._held = []
 
     def connect(self):
         self.sock.connect((self.host, self.port))
         # send join
         join_msg = {"type": "join", "from": self.username}
+        if self.last_seen_id is not None:
+            join_msg["last_id"] = self.last_seen_id
+            join_msg["store"] = self.store
+        if self.compress:
+            join_msg["compress"] = frame_compression.available()
+        if self.offer_binary:
+            join_msg["encoding"] = list(wire_codec.ENCODINGS)
         self._send_raw(join_msg)
         # wait for join_ack or rejection
         # start receiver thread
@@ -41,6 +73,11 @@ class ChatClient:
         return True
 
     def _send_raw(self, obj):
+        if self.binary:
+            encoded = wire_codec.encode_message(obj)
+            if encoded:
+                self.sock.sendall(encoded[0])
+                return
         data = json.dumps(obj, ensure_ascii=False) + DELIM
         self.sock.sendall(data.encode('utf-8'))
 
@@ -48,29 +85,78 @@ class ChatClient:
         msg = {"type": "message", "from": self.username, "to": to, "msg": text}
         self._send_raw(msg)
         # save to local history (as outgoing)
-        chat_history.append_message(self.username, {"dir": "out", "to": to, "msg": text, "time": now_str()})
+        self.history.append({"dir": "out", "to": to, "msg": text, "time": now_str()})
 
-    def request_online(self):
-        self._send_raw({"type": "list_request"})
+    def send_room_message(self, room, text):
+        self._send_raw({"type": "message", "from": self.username, "room": room, "msg": text})
+        self.history.append({"dir": "out", "to": room, "room": room, "msg": text, "time": now_str()})
+
+    def request_online(self, room=None):
+        if room:
+            self._send_raw({"type": "list_request", "room": room})
+        else:
+            self._send_raw({"type": "list_request"})
+
+    def join_room(self, room):
+        self._send_raw({"type": "room_join", "room": room})
+
+    def leave_room(self, room):
+        self._send_raw({"type": "room_leave", "room": room})
+
+    def request_rooms(self):
+        self._send_raw({"type": "room_list"})
+
+    def _remember(self, msg_id):
+        self._seen.add(msg_id)
+        self._seen_order.append(msg_id)
+        if len(self._seen_order) > SEEN_IDS:
+            self._seen.discard(self._seen_order.popleft())
 
     def _recv_loop(self):
         try:
             while self.running:
-                data = self.sock.recv(4096).decode('utf-8')
-                if not data:
+                if not self._decoder.recv_from(self.sock):
                     break
-                self._recv_buffer += data
-                while DELIM in self._recv_buffer:
-                    raw, self._recv_buffer = self._recv_buffer.split(DELIM, 1)
-                    try:
-                        obj = json.loads(raw)
-                    except Exception:
-                        continue
+                for obj in self._decoder.frames():
+                    msg_id = obj.get('id')
+                    if obj.get('type') == 'message' and isinstance(msg_id, int):
+                        if msg_id in self._seen:
+                            continue  # already have it (replay overlap)
+                        self._remember(msg_id)
+                        if self._replay_upto is None or msg_id <= self._replay_upto:
+                            self.last_seen_id = max(self.last_seen_id or 0, msg_id)
+                    elif obj.get('type') == 'join_ack':
+                        self.binary = obj.get('encoding') == wire_codec.BINARY
+                        if obj.get('ok') and isinstance(obj.get('last_id'), int):
+                            self._replay_upto = obj['last_id']
+                        if obj.get('store') != self.store:
+                            # a different store (wiped, or another server): our ids mean nothing there
+                            self.store = obj.get('store')
+                            self.last_seen_id = None
+                            self._seen.clear()
+                            self._seen_order.clear()
+                    elif obj.get('type') == 'replay_end' and isinstance(obj.get('last_id'), int):
+                        # the replay (sent after join_ack) is in; we are caught up to here
+                        self.last_seen_id = max([self.last_seen_id or 0, obj['last_id']] +
+                                                [record['sid'] for record in self._held])
+                        self._replay_upto = None
+                        for record in self._held:
+                            self.history.append(record)
+                        self._held = []
                     # push to queue for consumer
                     self.recv_queue.put(obj)
                     # automatically save message type 'message' to history (incoming)
                     if obj.get('type') == 'message':
-                        chat_history.append_message(self.username, {"dir": "in", "from": obj.get('from'), "to": obj.get('to'), "msg": obj.get('msg'), "time": obj.get('time')})
+                        record = {"dir": "in", "from": obj.get('from'), "to": obj.get('to'), "msg": obj.get('msg'), "time": obj.get('time')}
+                        if 'room' in obj:
+                            record['room'] = obj['room']
+                        if isinstance(msg_id, int):
+                            record['sid'] = msg_id
+                            record['store'] = self.store
+                            if self._replay_upto is not None and msg_id > self._replay_upto:
+                                self._held.append(record)
+                                continue
+                        self.history.append(record)
         except Exception:
             pass
         finally:
@@ -90,19 +176,24 @@ class ChatClient:
             self.sock.close()
         except:
             pass
+        self.history.close()
 
 # ---------------- CLI runner ----------------
 def cli_main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--host', default='127.0.0.1')
     parser.add_argument('--port', default=5555, type=int)
+    parser.add_argument('--history-fsync', choices=chat_history.FSYNC_POLICIES, default=chat_history.FSYNC_BATCH)
+    parser.add_argument('--no-compress', action='store_true', help="do not ask the server for compressed frames")
+    parser.add_argument('--json', action='store_true', help="plain JSON only (no binary message frames)")
     args = parser.parse_args()
 
     name = input("Nhập tên của bạn: ").strip()
     if not name:
         print("Tên không hợp lệ.")
         return
-    client = ChatClient(name, host=args.host, port=args.port)
+    client = ChatClient(name, host=args.host, port=args.port, history_fsync=args.history_fsync,
+                        compress=not args.no_compress, binary=not args.json)
     client.connect()
     print("Đã kết nối. Gõ '/help' để biết lệnh.")
     # print history
@@ -128,7 +219,20 @@ def cli_main():
             elif t == 'system':
                 print(f"[{obj.get('time')}] *SYSTEM* {obj.get('msg')}")
             elif t == 'online_list':
-                print(f"*ONLINE*: {', '.join(obj.get('users', []))}")
+                where = f" [{obj['room']}]" if 'room' in obj else ''
+                print(f"*ONLINE*{where}: {', '.join(obj.get('users', []))}")
+            elif t == 'room_list':
+                rooms = ', '.join(f"{r} ({n})" for r, n in sorted(obj.get('rooms', {}).items()))
+                print(f"*ROOMS*: {rooms or '-'}  | joined: {', '.join(obj.get('joined', [])) or '-'}")
+            elif t == 'replay':
+                print("---- Tin nhắn bị lỡ ----")
+            elif t == 'replay_end':
+                if obj.get('count'):
+                    print(f"---- Hết {obj['count']} tin nhắn bị lỡ ----")
+            elif t == 'room_left':
+                print(f"*Left room {obj.get('room')}*")
+            elif t == 'error':
+                print("ERROR:", obj.get('msg'), obj.get('room', ''))
             elif t == 'join_ack':
                 if not obj.get('ok'):
                     print("Join failed:", obj.get('reason'))
@@ -157,17 +261,41 @@ def cli_main():
                     client.send_message(body, to=target)
                 else:
                     print("Usage: /w <username> <message>")
-            elif text == '/online':
-                client.request_online()
+            elif text == '/online' or text.startswith('/online '):
+                client.request_online(text[len('/online'):].strip() or None)
+            elif text.startswith('/join '):
+                client.join_room(text[len('/join '):].strip())
+            elif text.startswith('/leave '):
+                client.leave_room(text[len('/leave '):].strip())
+            elif text == '/rooms':
+                client.request_rooms()
+            elif text.startswith('/r '):
+                # room message: /r general hello
+                parts = text.split(' ', 2)
+                if len(parts) >= 3:
+                    client.send_room_message(parts[1], parts[2])
+                else:
+                    print("Usage: /r <room> <message>")
             elif text == '/history':
+                client.history.flush()
                 hist = chat_history.load_history(client.username, limit=200)
                 for h in hist:
                     if h.get('dir') == 'in':
                         print(f"[{h.get('time')}] {h.get('from')} -> {h.get('to')}: {h.get('msg')}")
                     else:
                         print(f"[{h.get('time')}] me -> {h.get('to')}: {h.get('msg')}")
+            elif text.startswith('/search '):
+                client.history.flush()
+                hits = chat_history.search_history(client.username, text[len('/search '):], limit=20)
+                if not hits:
+                    print("Không tìm thấy tin nhắn nào.")
+                for h in hits:
+                    if h.get('dir') == 'in':
+                        print(f"[{h.get('time')}] {h.get('from')} -> {h.get('to')}: {h.get('msg')}")
+                    else:
+                        print(f"[{h.get('time')}] me -> {h.get('to')}: {h.get('msg')}")
             elif text == '/help':
-                print("Commands:\n  /w <user> <msg>  (private)\n  /online  (show online)\n  /history (show local history)\n  /quit")
+                print("Commands:\n  /w <user> <msg>  (private)\n  /online [room]  (show online, everyone or one room)\n  /join <room> | /leave <room> | /rooms\n  /r <room> <msg>  (room message)\n  /history (show local history)\n  /search <terms> (search local history)\n  /quit")
             else:
                 client.send_message(text, to='all')
     finally:
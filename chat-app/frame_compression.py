@@ -0,0 +1,181 @@
+# frame_compression.py
+# Optional compression of server -> client frames, negotiated at join.
+#
+# The client lists the codecs it can decode in its join frame
+# ("compress": ["zstd", "zlib"]); join_ack names the one the server picked
+# ("compress": "zlib", "compress_min": 512). After that, any frame the server
+# sends may be a compressed envelope instead of a JSON line:
+#
+#   b'\x00' kind(1) seq(2) length(4) payload
+#
+# JSON lines never contain a raw 0x00 (json.dumps escapes control
+# characters), so a 0x00 at a frame boundary is always an envelope. Kinds:
+#   f  one independently compressed block (one or more JSON lines)
+#   s  first chunk of a compression stream (a replay burst)
+#   c  next chunk of that stream; seq counts chunks, so a chunk dropped by the
+#      slow-consumer policy is noticed and the rest of the stream is skipped
+# Decompressed payloads are always whole frames (JSON lines or binary frames,
+# see wire_codec.py); wire_codec.FrameDecoder reads all of them.
+#
+# Live frames are compressed once and the result is shared by every
+# recipient (FrameCompressor remembers the last one), so serialize-once still
+# holds. Replays are per connection anyway and use one stream, which lets
+# later batches refer back to earlier ones.
+
+import struct
+import threading
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MAGIC = 0
+HEADER = struct.Struct('!BcHI')
+FRAME = b'f'
+STREAM_START = b's'
+STREAM = b'c'
+
+DEFAULT_MIN_SIZE = 512  # frames shorter than this are sent as they are
+ZLIB_LEVEL = 6
+# independent frames use a 4 KiB window and little memory: on chat-sized
+# frames setting up zlib's default 256 KiB state costs more than compressing
+# and the output is no larger. Streams keep the full window.
+ZLIB_FRAME_WBITS = 12
+ZLIB_FRAME_MEMLEVEL = 4
+ZSTD_LEVEL = 3
+MAX_DECOMPRESSED = 64 * 1024 * 1024  # per envelope, guards against zip bombs
+# zstd streams have no output limit, so stream chunks are decompressed this
+# many input bytes at a time with a running total. A few bytes can expand to
+# a whole 128 KiB block, so one step overshoots the limit by at most ~8 MiB.
+ZSTD_STREAM_STEP = 256
+RECV_SIZE = 64 * 1024  # client reads; envelopes can be large
+
+
+class _Zlib:
+    name = 'zlib'
+
+    def compress(self, data):
+        c = zlib.compressobj(ZLIB_LEVEL, zlib.DEFLATED, ZLIB_FRAME_WBITS, ZLIB_FRAME_MEMLEVEL)
+        return c.compress(data) + c.flush()
+
+    def compressor(self):
+        c = zlib.compressobj(ZLIB_LEVEL)
+        return lambda data: c.compress(data) + c.flush(zlib.Z_SYNC_FLUSH)
+
+    def decompress(self, data):
+        d = zlib.decompressobj()
+        out = d.decompress(data, MAX_DECOMPRESSED)
+        if d.unconsumed_tail:
+            raise ValueError("decompressed envelope too large")
+        return out
+
+    def decompressor(self):
+        d = zlib.decompressobj()
+
+        def feed(data):
+            out = d.decompress(data, MAX_DECOMPRESSED)
+            if d.unconsumed_tail:
+                raise ValueError("decompressed envelope too large")
+            return out
+        return feed
+
+
+class _Zstd:
+    name = 'zstd'
+
+    def compress(self, data):
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+
+    def compressor(self):
+        c = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+        return lambda data: c.compress(data) + c.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def decompress(self, data):
+        return zstandard.ZstdDecompressor().decompress(data, max_output_size=MAX_DECOMPRESSED)
+
+    def decompressor(self):
+        d = zstandard.ZstdDecompressor().decompressobj()
+
+        def feed(data):
+            view = memoryview(data)
+            out = []
+            total = 0
+            for i in range(0, len(view), ZSTD_STREAM_STEP):
+                part = d.decompress(view[i:i + ZSTD_STREAM_STEP])
+                total += len(part)
+                if total > MAX_DECOMPRESSED:
+                    raise ValueError("decompressed envelope too large")
+                out.append(part)
+            return b''.join(out)
+        return feed
+
+
+CODECS = {'zlib': _Zlib()}
+if zstandard is not None:
+    CODECS['zstd'] = _Zstd()
+PREFERENCE = ('zstd', 'zlib')  # server's choice when the client offers several
+
+
+def available():
+    """Codec names this process can use, best first."""
+    return [name for name in PREFERENCE if name in CODECS]
+
+
+def negotiate(offered, allowed=None):
+    """Pick a codec from the client's list, or None."""
+    if not isinstance(offered, list):
+        return None
+    for name in allowed if allowed is not None else available():
+        if name in offered and name in CODECS:
+            return name
+    return None
+
+
+def envelope(kind, seq, payload):
+    return HEADER.pack(MAGIC, kind, seq & 0xFFFF, len(payload)) + payload
+
+
+class FrameCompressor:
+    """One per codec, shared by every connection that negotiated it."""
+
+    def __init__(self, name, min_size=DEFAULT_MIN_SIZE):
+        self.name = name
+        self.codec = CODECS[name]
+        self.min_size = min_size
+        # (frame, what to send for it) per thread: a fan-out runs on one thread,
+        # and concurrent fan-outs on other threads must not evict its entry
+        self._local = threading.local()
+
+    def frame(self, data):
+        """What to send for an encoded frame: the frame itself if it is small
+        (or already an envelope), else a compressed envelope. A fan-out passes
+        the same bytes object to every recipient, so only the first one pays."""
+        if len(data) < self.min_size or data[0] == MAGIC:
+            return data
+        last = getattr(self._local, 'last', None)
+        if last is not None and last[0] is data:
+            return last[1]
+        packed = envelope(FRAME, 0, self.codec.compress(data))
+        if len(packed) >= len(data):
+            packed = data  # incompressible
+        self._local.last = (data, packed)
+        return packed
+
+    def stream(self):
+        return StreamCompressor(self.codec)
+
+
+class StreamCompressor:
+    """Compresses consecutive chunks of one burst as a single stream."""
+
+    def __init__(self, codec):
+        self._compress = codec.compressor()
+        self._seq = 0
+
+    def chunk(self, data):
+        kind = STREAM_START if self._seq == 0 else STREAM
+        packed = envelope(kind, self._seq, self._compress(data))
+        self._seq += 1
+        return packed
@@ -0,0 +1,133 @@
+# history_search.py
+#
+# Chỉ mục tìm kiếm toàn văn (inverted index) cho lịch sử chat.
+# Lưu trên đĩa bằng sqlite3 (có sẵn trong Python): bảng postings (term, id)
+# là B-tree nên tra một từ chỉ tốn O(log n), không phải quét file lịch sử.
+# Từ khóa được chuẩn hóa bỏ dấu tiếng Việt: "Xin chào" khớp "xin chao".
+
+import math
+import re
+import sqlite3
+import threading
+import unicodedata
+
+MAX_CANDIDATES = 1000  # số tin ứng viên tối đa (mới nhất) được chấm điểm mỗi truy vấn
+BM25_K1 = 1.2
+
+_WORD = re.compile(r"\w+")
+
+
+def normalize(text):
+    """Chữ thường + bỏ dấu: 'Đi chơi Đà Lạt' -> 'di choi da lat'."""
+    text = unicodedata.normalize('NFD', text.lower())
+    text = ''.join(c for c in text if unicodedata.category(c) != 'Mn')
+    return text.replace('đ', 'd')
+
+
+def tokenize(text):
+    return _WORD.findall(normalize(text or ''))
+
+
+class SearchIndex:
+    """Inverted index của một user, cập nhật dần mỗi khi ghi thêm tin nhắn."""
+
+    def __init__(self, db_path):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.executescript("""
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=NORMAL;
+            CREATE TABLE IF NOT EXISTS postings (
+                term TEXT NOT NULL, msg_id INTEGER NOT NULL, tf INTEGER NOT NULL,
+                PRIMARY KEY (term, msg_id)) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS postings_by_id ON postings (msg_id);
+            CREATE TABLE IF NOT EXISTS terms (term TEXT PRIMARY KEY, df INTEGER NOT NULL) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+        """)
+
+    def _state(self, key):
+        row = self.db.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else 0
+
+    def last_id(self):
+        """Id lớn nhất đã được đánh chỉ mục."""
+        with self.lock:
+            return self._state('last_id')
+
+    def add(self, items):
+        """Đánh chỉ mục các tin nhắn mới; items là các cặp (msg_id, text).
+        Tin có id <= last_id() đã có trong chỉ mục và được bỏ qua."""
+        with self.lock, self.db:
+            last = self._state('last_id')
+            docs = self._state('docs')
+            postings = []
+            df = {}
+            for msg_id, text in items:
+                if msg_id <= last:
+                    continue
+                counts = {}
+                for term in tokenize(text):
+                    counts[term] = counts.get(term, 0) + 1
+                for term, tf in counts.items():
+                    postings.append((term, msg_id, tf))
+                    df[term] = df.get(term, 0) + 1
+                last = msg_id
+                if counts:
+                    docs += 1
+            self.db.executemany("INSERT OR REPLACE INTO postings VALUES (?, ?, ?)", postings)
+            self.db.executemany(
+                "INSERT INTO terms VALUES (?, ?) ON CONFLICT(term) DO UPDATE SET df = df + excluded.df",
+                df.items())
+            self.db.executemany("INSERT OR REPLACE INTO state VALUES (?, ?)", (('last_id', last), ('docs', docs)))
+
+    def prune(self, oldest_id):
+        """Xóa postings của các tin có id < oldest_id (đã bị compaction xóa khỏi log)."""
+        with self.lock, self.db:
+            removed = self.db.execute(
+                "SELECT term, COUNT(*) FROM postings WHERE msg_id < ? GROUP BY term", (oldest_id,)).fetchall()
+            if not removed:
+                return
+            docs = self.db.execute(
+                "SELECT COUNT(DISTINCT msg_id) FROM postings WHERE msg_id < ?", (oldest_id,)).fetchone()[0]
+            self.db.executemany("UPDATE terms SET df = df - ? WHERE term = ?", [(n, t) for t, n in removed])
+            self.db.execute("DELETE FROM terms WHERE df <= 0")
+            self.db.execute("DELETE FROM postings WHERE msg_id < ?", (oldest_id,))
+            self.db.execute("UPDATE state SET value = MAX(0, value - ?) WHERE key = 'docs'", (docs,))
+
+    def search(self, query, limit=20, min_id=0):
+        """Trả về list (msg_id, score), điểm cao trước; tin phải chứa mọi từ khóa."""
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+        with self.lock:
+            n_docs = max(1, self._state('docs'))
+            dfs = {}
+            for term in terms:
+                row = self.db.execute("SELECT df FROM terms WHERE term = ?", (term,)).fetchone()
+                if not row:
+                    return []
+                dfs[term] = row[0]
+            # bắt đầu từ từ hiếm nhất, join các từ còn lại theo khóa chính (term, msg_id)
+            terms.sort(key=dfs.get)
+            joins = ''.join(f" JOIN postings p{i} ON p{i}.term = ? AND p{i}.msg_id = p0.msg_id"
+                            for i in range(1, len(terms)))
+            cols = ', '.join(f"p{i}.tf" for i in range(len(terms)))
+            sql = (f"SELECT p0.msg_id, {cols} FROM postings p0{joins} "
+                   f"WHERE p0.term = ? AND p0.msg_id >= ? ORDER BY p0.msg_id DESC LIMIT ?")
+            rows = self.db.execute(sql, (*terms[1:], terms[0], min_id, MAX_CANDIDATES)).fetchall()
+        idf = [math.log(1 + (n_docs - dfs[t] + 0.5) / (dfs[t] + 0.5)) for t in terms]
+        scored = []
+        for row in rows:
+            score = sum(w * tf * (BM25_K1 + 1) / (tf + BM25_K1) for w, tf in zip(idf, row[1:]))
+            scored.append((row[0], score))
+        scored.sort(key=lambda x: (-x[1], -x[0]))
+        return scored[:limit] if limit else scored
+
+    def reset(self):
+        with self.lock, self.db:
+            for table in ('postings', 'terms', 'state'):
+                self.db.execute(f"DELETE FROM {table}")
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,271 @@
+# ipc_bus.py
+# Local IPC bus for multi-process mode (python server.py --workers N).
+#
+# The parent process runs a Hub on a Unix domain socket; every worker process
+# connects a BusClient to it. The hub owns the global username registry (so
+# join uniqueness holds across workers) and relays:
+#   - PUBLISH: a broadcast frame from one worker to all the others
+#   - UNICAST: a private frame to the worker that owns the recipient
+#   - PRESENCE_ADD / PRESENCE_REMOVE: registry changes, mirrored by every
+#     worker so online_list is answered locally
+#   - ROOM_ADD / ROOM_REMOVE: room memberships, mirrored the same way
+#   - ROOM_PUBLISH: a room frame, only to the workers with members in the room
+# Messages use the format and op codes from backplane.py. The hub writes to
+# each worker through a backplane.LinkWriter, so routing never waits for a
+# slow worker.
+
+import os
+import socket
+import threading
+
+from backplane import (Backplane, LinkWriter, RoomTable, CLAIM, CLAIM_TIMEOUT, PRESENCE_ADD, PRESENCE_REMOVE,
+                       PUBLISH, RELEASE, REPLY, ROOM_ADD, ROOM_PUBLISH, ROOM_REMOVE, UNICAST,
+                       pack_message as _pack, read_message as _read)
+
+
+class _Link(LinkWriter):
+    """Hub side of one worker connection."""
+
+    def __init__(self, sock):
+        super().__init__(sock)
+        self.users = set()
+
+
+class Hub:
+    """Registry and router; runs in the parent process, one thread per worker."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.owners = {}  # username -> _Link
+        self.rooms = RoomTable()  # owner = _Link
+        self.links = []
+        if os.path.exists(path):
+            os.unlink(path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(path)
+        self.sock.listen(64)
+
+    def serve_forever(self):
+        try:
+            while True:
+                conn, _ = self.sock.accept()
+                threading.Thread(target=self._serve_link, args=(_Link(conn),), daemon=True).start()
+        except OSError:
+            pass  # closed
+
+    def close(self):
+        self.sock.close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+    def _others(self, link):
+        return [l for l in self.links if l is not link]
+
+    def _serve_link(self, link):
+        with self.lock:
+            # snapshot of everyone already online, then start receiving updates
+            link.send(b''.join(_pack(PRESENCE_ADD, name) for name in self.owners) +
+                      b''.join(_pack(ROOM_ADD, name, room.encode('utf-8'))
+                               for room, members in self.rooms.rooms.items() for name in members))
+            self.links.append(link)
+        stream = link.sock.makefile('rb')
+        try:
+            while True:
+                msg = _read(stream)
+                if msg is None:
+                    break
+                self._route(link, *msg)
+        except OSError:
+            pass
+        finally:
+            with self.lock:
+                self.links.remove(link)
+                gone = [name for name in link.users if self.owners.get(name) is link]
+                for name in gone:
+                    del self.owners[name]
+                left = self.rooms.drop_owner(link)
+                others = list(self.links)
+            # a worker died: its users are no longer online anywhere
+            update = b''.join(_pack(ROOM_REMOVE, name, room.encode('utf-8')) for room, name in left)
+            update += b''.join(_pack(PRESENCE_REMOVE, name) for name in gone)
+            for other in others:
+                other.send(update)
+            link.close()
+
+    def _route(self, link, op, req_id, name, payload):
+        if op == CLAIM:
+            with self.lock:
+                ok = name not in self.owners
+                if ok:
+                    self.owners[name] = link
+                    link.users.add(name)
+                others = self._others(link)
+            link.send(_pack(REPLY, req_id=req_id, payload=b'\x01' if ok else b'\x00'))
+            if ok:
+                data = _pack(PRESENCE_ADD, name)
+                for other in others:
+                    other.send(data)
+        elif op == RELEASE:
+            with self.lock:
+                if self.owners.get(name) is not link:
+                    return
+                del self.owners[name]
+                link.users.discard(name)
+                others = self._others(link)
+            data = _pack(PRESENCE_REMOVE, name)
+            for other in others:
+                other.send(data)
+        elif op == PUBLISH:
+            with self.lock:
+                others = self._others(link)
+            data = _pack(PUBLISH, name, payload)
+            for other in others:
+                other.send(data)
+        elif op == UNICAST:
+            with self.lock:
+                owner = self.owners.get(name)
+            if owner is not None and owner is not link:
+                owner.send(_pack(UNICAST, name, payload))
+        elif op in (ROOM_ADD, ROOM_REMOVE):
+            with self.lock:
+                if op == ROOM_ADD:
+                    self.rooms.add(payload.decode('utf-8'), name, link)
+                else:
+                    self.rooms.remove(payload.decode('utf-8'), name, link)
+                others = self._others(link)
+            data = _pack(op, name, payload)
+            for other in others:
+                other.send(data)
+        elif op == ROOM_PUBLISH:
+            with self.lock:
+                targets = [l for l in self.rooms.owners(name) if l is not link]
+            data = _pack(ROOM_PUBLISH, name, payload)
+            for target in targets:
+                target.send(data)
+
+
+class BusClient(Backplane):
+    """Worker side of the bus; see backplane.Backplane for the interface."""
+
+    def __init__(self, path, on_publish, on_unicast, on_room_publish):
+        super().__init__(on_publish, on_unicast, on_room_publish)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self._send_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._remote = {}  # usernames online in other workers (dict: keeps join order)
+        self._mine = set()
+        self._rooms = RoomTable()  # memberships in other workers; owner not tracked
+        self._pending = {}  # req_id -> [Event, result]
+        self._next_id = 0
+        self.reader = threading.Thread(target=self._read_loop, daemon=True)
+        self.reader.start()
+
+    def _send(self, data):
+        with self._send_lock:
+            self.sock.sendall(data)
+
+    def claim(self, username):
+        """Reserve username across all workers; False if it is taken."""
+        with self._lock:
+            self._next_id += 1
+            req_id = self._next_id
+            waiter = self._pending[req_id] = [threading.Event(), False]
+        self._send(_pack(CLAIM, username, req_id=req_id))
+        answered = waiter[0].wait(CLAIM_TIMEOUT)
+        with self._lock:
+            # once popped, a late reply finds no waiter and changes nothing
+            self._pending.pop(req_id, None)
+            ok = answered and waiter[1]
+            if ok:
+                self._mine.add(username)
+        if not answered:
+            # the hub may still grant it (or just has): give it back
+            self._send(_pack(RELEASE, username))
+        return ok
+
+    def release(self, username):
+        with self._lock:
+            self._mine.discard(username)
+        self._send(_pack(RELEASE, username))
+
+    def publish(self, frame, exclude_username=None):
+        self._send(_pack(PUBLISH, exclude_username or '', frame))
+
+    def unicast(self, username, frame):
+        """Send frame to a user on another worker; False if nobody has that name."""
+        with self._lock:
+            if username not in self._remote:
+                return False
+        self._send(_pack(UNICAST, username, frame))
+        return True
+
+    def users(self):
+        """Usernames online in the other workers."""
+        with self._lock:
+            return list(self._remote)
+
+    def join_room(self, username, room):
+        self._send(_pack(ROOM_ADD, username, room.encode('utf-8')))
+
+    def leave_room(self, username, room):
+        self._send(_pack(ROOM_REMOVE, username, room.encode('utf-8')))
+
+    def publish_room(self, room, frame):
+        # the hub forwards it only to workers with members in the room
+        self._send(_pack(ROOM_PUBLISH, room, frame))
+
+    def room_users(self, room):
+        with self._lock:
+            return self._rooms.members(room)
+
+    def room_counts(self):
+        with self._lock:
+            return self._rooms.counts()
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+    def _read_loop(self):
+        stream = self.sock.makefile('rb')
+        try:
+            while True:
+                msg = _read(stream)
+                if msg is None:
+                    break
+                op, req_id, name, payload = msg
+                if op == REPLY:
+                    with self._lock:
+                        waiter = self._pending.get(req_id)
+                        if waiter:
+                            waiter[1] = payload == b'\x01'
+                            waiter[0].set()
+                elif op == PRESENCE_ADD:
+                    with self._lock:
+                        if name not in self._mine:
+                            self._remote[name] = None
+                elif op == PRESENCE_REMOVE:
+                    with self._lock:
+                        self._remote.pop(name, None)
+                elif op == PUBLISH:
+                    self.dispatch(self.on_publish, payload, name or None)
+                elif op == UNICAST:
+                    self.dispatch(self.on_unicast, name, payload)
+                elif op == ROOM_ADD:
+                    with self._lock:
+                        self._rooms.add(payload.decode('utf-8'), name, None)
+                elif op == ROOM_REMOVE:
+                    with self._lock:
+                        self._rooms.remove(payload.decode('utf-8'), name)
+                elif op == ROOM_PUBLISH:
+                    self.dispatch(self.on_room_publish, name, payload)
+        except OSError:
+            pass
+        print("[BUS] lost connection to hub")
@@ -0,0 +1,110 @@
+# line_decoder.py
+# Incremental decoder for the newline-delimited JSON protocol.
+#
+# Bytes are received straight into a preallocated bytearray (recv_into) and
+# scanned by offset: everything up to the last b'\n' is decoded and split in
+# one linear pass, so a chunk holding many messages costs O(chunk). Lines are
+# only decoded once complete, so a multi-byte UTF-8 character split across two
+# recv() calls is never decoded in halves.
+
+import json
+
+DEFAULT_MAX_LINE = 1024 * 1024  # 1 MiB
+DEFAULT_BUFSIZE = 4096
+
+
+class LineTooLong(ValueError):
+    """A line exceeded max_line bytes without a delimiter."""
+
+
+class LineDecoder:
+    def __init__(self, max_line=DEFAULT_MAX_LINE, bufsize=DEFAULT_BUFSIZE):
+        self.max_line = max_line
+        self._buf = bytearray(bufsize)
+        self._start = 0  # first unparsed byte
+        self._end = 0    # end of received data
+
+    def _make_room(self, need):
+        if len(self._buf) - self._end >= need:
+            return
+        pending = self._end - self._start
+        if self._start:
+            self._buf[:pending] = self._buf[self._start:self._end]
+            self._start, self._end = 0, pending
+        if len(self._buf) - self._end < need:
+            self._buf.extend(bytes(need - (len(self._buf) - self._end)))
+
+    def recv_from(self, sock, size=DEFAULT_BUFSIZE):
+        """recv_into the internal buffer. Returns the byte count (0 = EOF)."""
+        self._make_room(size)
+        with memoryview(self._buf) as view:
+            n = sock.recv_into(view[self._end:])
+        self._end += n
+        return n
+
+    def _parse(self, buf, start, end, out):
+        """Decode complete lines of buf[start:end] into out; returns the offset
+        of the first byte of the trailing partial line. Raises LineTooLong if
+        any line, complete or not, is longer than max_line."""
+        last = buf.rfind(b'\n', start, end)
+        if last >= 0:
+            chunk = buf[start:last]
+            # a chunk no longer than max_line cannot hold a line that is
+            if len(chunk) > self.max_line and max(map(len, chunk.split(b'\n'))) > self.max_line:
+                raise LineTooLong(f"line longer than {self.max_line} bytes")
+            try:
+                # common case: decode every complete line in one go
+                lines = chunk.decode('utf-8').split('\n')
+            except UnicodeDecodeError:
+                # some line is not valid UTF-8: split first, then drop the bad lines
+                lines = []
+                for raw in chunk.split(b'\n'):
+                    try:
+                        lines.append(raw.decode('utf-8'))
+                    except UnicodeDecodeError:
+                        pass
+            for raw in lines:
+                if not raw:
+                    continue
+                try:
+                    msg = json.loads(raw)
+                except ValueError:
+                    continue  # bad JSON: skip the line
+                if isinstance(msg, dict):
+                    out.append(msg)
+            start = last + 1
+        if end - start > self.max_line:
+            raise LineTooLong(f"line longer than {self.max_line} bytes")
+        return start
+
+    def frames(self):
+        """Return the messages completed by data received with recv_from()."""
+        out = []
+        start = self._parse(self._buf, self._start, self._end, out)
+        if start == self._end:
+            start = self._end = 0
+        self._start = start
+        return out
+
+    def pending(self):
+        """Bytes received but not yet parsed (a partial line), e.g. to hand
+        over to another decoder."""
+        return bytes(self._buf[self._start:self._end])
+
+    def feed(self, data):
+        """Add data received some other way (e.g. asyncio data_received) and
+        return the messages it completes. When nothing is pending the lines
+        are parsed straight out of data; only a trailing partial line is copied."""
+        out = []
+        if self._start == self._end:
+            rest = self._parse(data, 0, len(data), out)
+            if rest < len(data):
+                self._start = self._end = 0
+                self._make_room(len(data) - rest)
+                self._buf[:len(data) - rest] = data[rest:]
+                self._end = len(data) - rest
+            return out
+        self._make_room(len(data))
+        self._buf[self._end:self._end + len(data)] = data
+        self._end += len(data)
+        return self.frames()
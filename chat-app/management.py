@@ -0,0 +1,100 @@
+# management.py
+# Management listener of the chat server (default 127.0.0.1:5556) and the
+# optional Prometheus endpoint.
+#
+# Same framing as the chat protocol: one JSON object per line each way. Every
+# request {"type": <command>, ...} gets one reply line carrying the same
+# "type" (and the request's "id", if it had one). Requests may be pipelined:
+# replies come back in request order, and all replies to the requests found
+# in one read go out in one write. Commands are plain functions taking the
+# request and returning the reply dict; they run on the listener's own
+# threads, never on the chat engine's.
+
+import json
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from line_decoder import LineDecoder, LineTooLong
+
+DEFAULT_HOST = '127.0.0.1'  # admin access is local unless configured otherwise
+DEFAULT_PORT = 5556
+MAX_REQUEST = 64 * 1024
+
+
+def encode(obj):
+    return (json.dumps(obj, ensure_ascii=False) + '\n').encode('utf-8')
+
+
+class ManagementServer:
+    def __init__(self, host, port, commands):
+        self.commands = commands  # type -> fn(request) -> reply dict
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, port))
+        self.sock.listen(16)
+        self.address = self.sock.getsockname()
+
+    def start(self):
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+        return self
+
+    def close(self):
+        self.sock.close()
+
+    def _accept_loop(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return  # closed
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def handle(self, request):
+        command = self.commands.get(request.get('type'))
+        if command is None:
+            reply = {"type": "error", "msg": "unknown_command", "command": request.get('type')}
+        else:
+            try:
+                reply = command(request)
+            except Exception as e:
+                reply = {"type": "error", "msg": str(e)}
+            reply.setdefault("type", request.get('type'))
+        if 'id' in request:
+            reply["id"] = request['id']
+        return reply
+
+    def _serve(self, conn):
+        decoder = LineDecoder(max_line=MAX_REQUEST)
+        try:
+            while decoder.recv_from(conn):
+                replies = [encode(self.handle(request)) for request in decoder.frames()]
+                conn.sendall(b''.join(replies))
+        except (OSError, LineTooLong):
+            pass
+        finally:
+            conn.close()
+
+
+def serve_prometheus(host, port, registry):
+    """GET /metrics in Prometheus text format, from a background thread."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?', 1)[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # scrapes every few seconds would flood the console
+
+    httpd = ThreadingHTTPServer((host, port), Handler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
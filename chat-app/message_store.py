@@ -0,0 +1,294 @@
+# message_store.py
+# Server-side message store: every message frame gets a global, monotonically
+# increasing id and is appended to the queue of each channel it was sent to:
+#   all            - broadcasts (to == 'all')
+#   user <name>    - private messages to (and from) <name>
+#   room <name>    - room messages
+# A client that reconnects with the last id it saw is replayed the frames it
+# missed from its channels, merged in id order.
+#
+# Each channel is a directory of append-only segments named after the first id
+# they hold; a line is b"<id>\t" + the frame exactly as it was sent, so replay
+# never re-encodes anything. Recent lines are also kept in memory, but the cache
+# is bounded by memory_limit bytes across all channels: older lines are only on
+# disk (spilled) and are read back from there on replay. Segments older than
+# `retention` ids are deleted. Only the MAX_OPEN_FILES most recently written
+# channels keep their active segment open; a server with many users (one
+# channel each) would otherwise run out of file descriptors.
+#
+# Ids only mean something within one store. The store has a random id (its
+# epoch, in STORE_ID_FILE) that the server sends in join_ack, so a client can
+# tell when the store it remembers ids from was wiped or is another server's.
+
+import bisect
+import heapq
+import itertools
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+STORE_DIR = "server_store"
+SEGMENT_RECORDS = 4096
+DEFAULT_MEMORY_LIMIT = 8 * 1024 * 1024  # bytes of cached frames, all channels together
+DEFAULT_RETENTION = 1000000             # keep roughly the last million messages
+FLUSH_INTERVAL = 0.2                    # seconds; appends are buffered and flushed by a background thread
+MARKER_FILE = "marker"                  # last id that existed when the user went offline
+STORE_ID_FILE = "store_id"              # epoch of this store, created with it
+MAX_OPEN_FILES = 64                     # channels with an open segment handle (LRU)
+
+ALL = "all"
+
+
+def user_channel(username):
+    return "u_" + username.encode('utf-8').hex()
+
+
+def room_channel(room):
+    return "r_" + room.encode('utf-8').hex()
+
+
+def _line_id(line):
+    """Id of a stored line (b"<id>\t<frame>\n"), or None if it is not one:
+    torn by a crash mid-write, or a partial write seen while it happens."""
+    tab = line.find(b'\t')
+    if tab <= 0 or not line.endswith(b'\n'):
+        return None
+    try:
+        return int(line[:tab])
+    except ValueError:
+        return None
+
+
+class _Channel:
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.segments = sorted(int(name[:-4]) for name in os.listdir(path) if name.endswith('.log'))
+        self.cache = deque()  # (id, line), oldest first
+        self.file = None
+        self.count = 0        # records in the active (last) segment
+        self.last_id = 0
+        if self.segments:
+            with open(self._segment_path(self.segments[-1]), 'rb') as f:
+                lines = f.readlines()
+            # a torn last line (crash mid-write) is dropped by keeping only complete lines
+            complete = [line for line in lines if _line_id(line) is not None]
+            self.count = len(complete)
+            if complete:
+                self.last_id = _line_id(complete[-1])
+            if len(complete) < len(lines):
+                with open(self._segment_path(self.segments[-1]), 'wb') as f:
+                    f.writelines(complete)
+
+    def _segment_path(self, first_id):
+        return os.path.join(self.path, f"{first_id:012d}.log")
+
+    def append(self, msg_id, line):
+        if self.file is None or self.count >= SEGMENT_RECORDS:
+            if self.file is not None:
+                self.file.close()
+            if not self.segments or self.count >= SEGMENT_RECORDS:
+                self.segments.append(msg_id)
+                self.count = 0
+            self.file = open(self._segment_path(self.segments[-1]), 'ab')
+        self.file.write(line)
+        self.count += 1
+        self.last_id = msg_id
+
+    def flush(self):
+        if self.file is not None:
+            self.file.flush()
+
+    def expire(self, oldest_id):
+        """Delete whole segments that only hold ids < oldest_id."""
+        while len(self.segments) > 1 and self.segments[1] <= oldest_id:
+            os.remove(self._segment_path(self.segments.pop(0)))
+
+    def read(self, after_id, before_id):
+        """(id, line) with after_id < id < before_id, from disk, one segment
+        open at a time. Call flush() first, under the store's lock; the lines
+        can be consumed after it is released."""
+        start = max(0, bisect.bisect_right(self.segments, after_id + 1) - 1)
+        return self._read(self.segments[start:], after_id, before_id)
+
+    def _read(self, segments, after_id, before_id):
+        for first_id in segments:
+            if first_id >= before_id:
+                break
+            try:
+                f = open(self._segment_path(first_id), 'rb')
+            except FileNotFoundError:
+                continue  # expired meanwhile
+            with f:
+                for line in f:
+                    msg_id = _line_id(line)
+                    if msg_id is None:
+                        continue  # torn (older segments are not repaired at open)
+                    if msg_id >= before_id:
+                        return
+                    if msg_id > after_id:
+                        yield msg_id, line
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class MessageStore:
+    """Callers allocate an id and append under `lock`, and deliver the frame
+    while still holding it, so live delivery and replay see the same order."""
+
+    def __init__(self, path=STORE_DIR, memory_limit=DEFAULT_MEMORY_LIMIT, retention=DEFAULT_RETENTION):
+        self.path = path
+        self.memory_limit = memory_limit
+        self.retention = retention
+        self.lock = threading.RLock()
+        os.makedirs(path, exist_ok=True)
+        self.epoch = self._load_epoch()
+        self._channels = {}
+        for name in os.listdir(path):
+            if os.path.isdir(os.path.join(path, name)):
+                self._channels[name] = _Channel(os.path.join(path, name))
+        self.last_id = max((ch.last_id for ch in self._channels.values()), default=0)
+        self._cache_order = deque()  # (channel, size), oldest first, for eviction
+        self._cache_bytes = 0
+        self._dirty = set()
+        self._open = OrderedDict()  # channels with an open file, least recently written first
+        self._closed = False
+        threading.Thread(target=self._flush_loop, daemon=True).start()
+
+    def _load_epoch(self):
+        path = os.path.join(self.path, STORE_ID_FILE)
+        try:
+            with open(path) as f:
+                epoch = f.read().strip()
+            if epoch:
+                return epoch
+        except FileNotFoundError:
+            pass
+        epoch = os.urandom(8).hex()
+        with open(path + '.tmp', 'w') as f:
+            f.write(epoch)
+        os.replace(path + '.tmp', path)
+        return epoch
+
+    def _channel(self, name):
+        channel = self._channels.get(name)
+        if channel is None:
+            channel = self._channels[name] = _Channel(os.path.join(self.path, name))
+        return channel
+
+    def allocate_id(self):
+        self.last_id += 1
+        return self.last_id
+
+    def append(self, channels, msg_id, frame):
+        """Store an encoded frame (which should carry msg_id) in each channel."""
+        line = b'%d\t' % msg_id + frame
+        if not line.endswith(b'\n'):
+            line += b'\n'
+        with self.lock:
+            for name in channels:
+                channel = self._channel(name)
+                rolled = channel.count >= SEGMENT_RECORDS
+                channel.append(msg_id, line)
+                self._open[channel] = None
+                self._open.move_to_end(channel)
+                if rolled:
+                    channel.expire(msg_id - self.retention)
+                channel.cache.append((msg_id, line))
+                self._cache_order.append((channel, len(line)))
+                self._cache_bytes += len(line)
+                self._dirty.add(channel)
+            while len(self._open) > MAX_OPEN_FILES:
+                # closing flushes it; it is reopened on its next append
+                channel, _ = self._open.popitem(last=False)
+                channel.close()
+                self._dirty.discard(channel)
+            # bounded memory: older lines stay on disk only
+            while self._cache_bytes > self.memory_limit and self._cache_order:
+                channel, size = self._cache_order.popleft()
+                channel.cache.popleft()
+                self._cache_bytes -= size
+
+    def replay(self, channels, after_id, upto=None):
+        """Generate the frames from the given channels with after_id < id <= upto
+        (None = no upper bound), merged in id order (a frame stored in several
+        of them comes once).
+
+        What is in the store when this is called is what gets replayed. Older
+        lines are read from disk segment by segment as the caller consumes
+        them, so a long replay is never all in memory at once; the caller
+        need not hold the lock while it does."""
+        with self.lock:
+            if upto is None:
+                upto = self.last_id
+            sources = []
+            for name in channels:
+                channel = self._channels.get(name)
+                if channel is None:
+                    continue
+                cached = [entry for entry in channel.cache if after_id < entry[0] <= upto]
+                first_cached = channel.cache[0][0] if channel.cache else channel.last_id + 1
+                if after_id + 1 < first_cached:
+                    channel.flush()
+                    sources.append(itertools.chain(channel.read(after_id, min(first_cached, upto + 1)), cached))
+                else:
+                    sources.append(cached)
+        return self._merge(sources)
+
+    @staticmethod
+    def _merge(sources):
+        last = None
+        for msg_id, line in heapq.merge(*sources, key=lambda entry: entry[0]):
+            if msg_id != last:
+                yield line[line.index(b'\t') + 1:]
+                last = msg_id
+
+    def known_user(self, username):
+        """Whether username ever joined (or was written to). Every channel is
+        loaded at startup and set_marker() creates the user's, so this is a
+        lookup in memory, cheap enough to do under the lock."""
+        return user_channel(username) in self._channels
+
+    def set_marker(self, username):
+        """Remember the newest id at the moment username went offline."""
+        with self.lock:
+            marker = self.last_id
+            path = os.path.join(self._channel(user_channel(username)).path, MARKER_FILE)
+        with open(path + '.tmp', 'w') as f:
+            f.write(str(marker))
+        os.replace(path + '.tmp', path)
+
+    def get_marker(self, username):
+        try:
+            with open(os.path.join(self.path, user_channel(username), MARKER_FILE)) as f:
+                return int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return None
+
+    def cache_bytes(self):
+        return self._cache_bytes
+
+    def flush(self):
+        with self.lock:
+            dirty, self._dirty = self._dirty, set()
+            for channel in dirty:
+                channel.flush()
+
+    def _flush_loop(self):
+        while not self._closed:
+            time.sleep(FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except OSError as e:
+                print(f"[STORE] flush failed: {e}")
+
+    def close(self):
+        self._closed = True
+        with self.lock:
+            for channel in self._channels.values():
+                channel.close()
+            self._open.clear()
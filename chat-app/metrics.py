@@ -0,0 +1,166 @@
+# metrics.py
+# Counters, gauges and histograms for the chat server, readable as a JSON
+# snapshot (management "stats" command) or as Prometheus text (/metrics).
+#
+# Updates are plain attribute arithmetic with no lock: under the GIL an
+# increment can very occasionally be lost when two threads race, which is
+# fine for monitoring and keeps the hot path cheap. Rates ("per second") are
+# left to the reader: take two snapshots and divide by the time between them.
+
+import bisect
+import threading
+import time
+
+# seconds; fan-out, lock waits and store writes are all sub-millisecond when healthy
+LATENCY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025,
+                   0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+class Counter:
+    """A running total; fn, if given, is added when a snapshot is taken
+    (e.g. totals still held by live connections)."""
+    kind = 'counter'
+
+    def __init__(self, name, help, fn=None):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.value = 0
+
+    def inc(self, n=1):
+        self.value += n
+
+    def snapshot(self):
+        return self.value + self.fn() if self.fn else self.value
+
+
+class Gauge:
+    """A value read when a snapshot is taken (fn), or set by the code."""
+    kind = 'gauge'
+
+    def __init__(self, name, help, fn=None):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def snapshot(self):
+        return self.fn() if self.fn else self.value
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.bounds = list(buckets)
+        self.counts = [0] * (len(self.bounds) + 1)  # last = above the largest bound
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q, counts=None):
+        """Upper bound of the bucket holding the q-th observation (None if empty)."""
+        counts = counts or self.counts
+        total = sum(counts)
+        if not total:
+            return None
+        rank = q * total
+        seen = 0
+        for i, n in enumerate(counts):
+            seen += n
+            if seen >= rank:
+                return self.bounds[i] if i < len(self.bounds) else float('inf')
+        return float('inf')
+
+    def snapshot(self):
+        counts = list(self.counts)
+        return {"count": sum(counts), "sum": self.sum, "buckets": self.bounds, "counts": counts,
+                "p50": self.quantile(0.5, counts), "p99": self.quantile(0.99, counts)}
+
+
+class TimedLock:
+    """threading.Lock that records how long contended acquisitions waited.
+    An uncontended acquire costs one extra non-blocking attempt."""
+
+    def __init__(self, wait_histogram, acquisitions, contended):
+        self._lock = threading.Lock()
+        self.wait = wait_histogram
+        self.acquisitions = acquisitions
+        self.contended = contended
+
+    def acquire(self, blocking=True, timeout=-1):
+        self.acquisitions.value += 1
+        if self._lock.acquire(False):
+            return True
+        if not blocking:
+            return False
+        start = time.perf_counter()
+        got = self._lock.acquire(True, timeout)
+        self.contended.value += 1
+        self.wait.observe(time.perf_counter() - start)
+        return got
+
+    def release(self):
+        self._lock.release()
+
+    def locked(self):
+        return self._lock.locked()
+
+    __enter__ = acquire
+
+    def __exit__(self, *exc):
+        self._lock.release()
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.started = time.time()
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, fn=None):
+        return self._add(Counter(name, help, fn))
+
+    def gauge(self, name, help, fn=None):
+        return self._add(Gauge(name, help, fn))
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, help, buckets))
+
+    def snapshot(self):
+        out = {"time": time.time(), "uptime": time.time() - self.started}
+        for metric in self.metrics:
+            out[metric.name] = metric.snapshot()
+        return out
+
+    def prometheus(self):
+        """Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            if metric.kind == 'histogram':
+                counts = list(metric.counts)
+                cumulative = 0
+                for bound, n in zip(metric.bounds, counts):
+                    cumulative += n
+                    lines.append(f'{metric.name}_bucket{{le="{bound}"}} {cumulative}')
+                cumulative += counts[-1]
+                lines.append(f'{metric.name}_bucket{{le="+Inf"}} {cumulative}')
+                lines.append(f"{metric.name}_sum {metric.sum}")
+                lines.append(f"{metric.name}_count {cumulative}")
+            else:
+                lines.append(f"{metric.name} {metric.snapshot()}")
+        return '\n'.join(lines) + '\n'
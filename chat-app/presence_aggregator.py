@@ -0,0 +1,81 @@
+# presence_aggregator.py
+# Batches "X joined" / "X left" announcements.
+#
+# After a restart every client reconnects within seconds; announcing each
+# join to everyone is O(N^2) frames. The aggregator collects join/leave
+# events for a short window and then emits one summary per scope (the whole
+# server, or one room). A user who leaves and comes back inside the window
+# (a reconnect) cancels out and is not announced at all.
+
+import threading
+
+DEFAULT_WINDOW = 0.25  # seconds; 0 = announce every event immediately
+MAX_NAMES = 20         # names listed per summary frame; the rest are only counted
+
+JOINED = 'joined'
+LEFT = 'left'
+
+
+def _thread_call_later(delay, fn):
+    timer = threading.Timer(delay, fn)
+    timer.daemon = True
+    timer.start()
+    return timer
+
+
+class PresenceAggregator:
+    """emit(scope, joined, left) is called once per window and scope with the
+    net changes (lists of usernames, in event order). call_later(delay, fn)
+    schedules the flush; the asyncio engine swaps in loop.call_later so
+    flushes run on the loop thread."""
+
+    def __init__(self, emit, window=DEFAULT_WINDOW):
+        self.emit = emit
+        self.window = window
+        self.call_later = _thread_call_later
+        self._lock = threading.Lock()
+        self._pending = {}  # scope -> {username: (first event, last event)}
+
+    def add(self, scope, event, username):
+        if self.window <= 0:
+            self.emit(scope, [username] if event == JOINED else [], [username] if event == LEFT else [])
+            return
+        with self._lock:
+            batch = self._pending.get(scope)
+            schedule = batch is None
+            if schedule:
+                batch = self._pending[scope] = {}
+            first = batch[username][0] if username in batch else event
+            batch[username] = (first, event)
+        if schedule:
+            self.call_later(self.window, lambda: self.flush(scope))
+
+    def flush(self, scope):
+        with self._lock:
+            batch = self._pending.pop(scope, None)
+        if not batch:
+            return
+        joined, left = [], []
+        for username, (first, last) in batch.items():
+            if first != last:
+                continue  # left and came back (or joined and left): nothing changed
+            (joined if last == JOINED else left).append(username)
+        if joined or left:
+            self.emit(scope, joined, left)
+
+
+def _names(users):
+    shown = ', '.join(users[:MAX_NAMES])
+    if len(users) > MAX_NAMES:
+        shown += f" and {len(users) - MAX_NAMES} others"
+    return shown
+
+
+def summary_text(joined, left, where=''):
+    """"alice joined" for one event, "alice, bob and 3 others joined; carol left" for a batch."""
+    parts = []
+    if joined:
+        parts.append(f"{_names(joined)} joined{where}")
+    if left:
+        parts.append(f"{_names(left)} left{where}")
+    return '; '.join(parts)
@@ -0,0 +1,173 @@
+# rate_limit.py
+# Token-bucket limits on what clients send, in messages and bytes per second,
+# per connection and per client IP address.
+#
+# A bucket holds up to rate * BURST_SECONDS tokens and refills continuously;
+# receiving data takes tokens. Buckets are refilled lazily from the time of
+# the last check, so a check is a few float operations per received chunk
+# with no timers, and a bucket is one small __slots__ object: one per
+# connection, plus one per address shared by that address's connections.
+# Final uses this module too (Final/rate_limit.py loads this file).
+
+import threading
+import time
+
+# What happens to a client that goes over its limit:
+DELAY = 'delay'            # stop reading from it until the debt is paid back; TCP
+                           # flow control then slows the sender down
+DROP = 'drop'              # discard the frames over the limit (the client gets an error)
+DISCONNECT = 'disconnect'  # close the connection
+POLICIES = (DELAY, DROP, DISCONNECT)
+
+BURST_SECONDS = 2.0  # a bucket holds this many seconds' worth of tokens
+
+
+class RateLimitExceeded(Exception):
+    """A client went over its limit under the DISCONNECT policy."""
+
+
+class Limits:
+    """Rates shared by every bucket of one kind. A rate of 0 is unlimited."""
+
+    __slots__ = ('msg_rate', 'msg_burst', 'byte_rate', 'byte_burst')
+
+    def __init__(self, msg_rate=0, byte_rate=0, burst_seconds=BURST_SECONDS):
+        self.msg_rate = msg_rate
+        self.byte_rate = byte_rate
+        # at least one message always fits, whatever the rate
+        self.msg_burst = max(msg_rate * burst_seconds, 1.0)
+        self.byte_burst = byte_rate * burst_seconds
+
+    def __bool__(self):
+        return bool(self.msg_rate or self.byte_rate)
+
+
+class Bucket:
+    """Tokens left for messages and bytes. Goes negative (debt) when a client
+    sends more than it had tokens for; it has to wait the debt off."""
+
+    __slots__ = ('msgs', 'bytes', 'stamp', 'users')
+
+    def __init__(self, limits, now):
+        self.msgs = limits.msg_burst
+        self.bytes = limits.byte_burst
+        self.stamp = now
+        self.users = 0  # connections sharing an address bucket
+
+    def refill(self, limits, now):
+        elapsed = now - self.stamp
+        self.stamp = now
+        if limits.msg_rate:
+            self.msgs = min(limits.msg_burst, self.msgs + elapsed * limits.msg_rate)
+        if limits.byte_rate:
+            self.bytes = min(limits.byte_burst, self.bytes + elapsed * limits.byte_rate)
+
+    def has_room(self, limits):
+        """Whether a frame fits without going into debt."""
+        return (not limits.msg_rate or self.msgs >= 1) and (not limits.byte_rate or self.bytes >= 0)
+
+    def debt(self, limits):
+        """Seconds until the bucket is out of debt (0 if it is not in debt)."""
+        wait = 0.0
+        if limits.msg_rate and self.msgs < 0:
+            wait = -self.msgs / limits.msg_rate
+        if limits.byte_rate and self.bytes < 0:
+            wait = max(wait, -self.bytes / limits.byte_rate)
+        return wait
+
+
+class ConnectionBucket(Bucket):
+    __slots__ = ('ip', 'shared', 'dropping')
+
+    def __init__(self, limits, now, ip, shared):
+        super().__init__(limits, now)
+        self.ip = ip
+        self.shared = shared   # the address's Bucket, or None
+        self.dropping = False  # the last frame was dropped (DROP)
+
+
+class RateLimiter:
+    """Per-connection and per-address limits with one policy.
+
+    Thread-safe: connection buckets belong to their reader, and address
+    buckets are only touched under a lock (held for a few float operations).
+    """
+
+    def __init__(self, per_connection, per_ip, policy=DELAY, clock=time.monotonic):
+        if policy not in POLICIES:
+            raise ValueError(f"unknown rate limit policy: {policy}")
+        self.per_connection = per_connection
+        self.per_ip = per_ip
+        self.policy = policy
+        self.clock = clock
+        self._addresses = {}  # ip -> Bucket, while it has connections
+        self._lock = threading.Lock()
+
+    def open(self, ip):
+        """Bucket for a new connection from ip; pass it to close() when done."""
+        now = self.clock()
+        shared = None
+        if self.per_ip:
+            with self._lock:
+                shared = self._addresses.get(ip)
+                if shared is None:
+                    shared = self._addresses[ip] = Bucket(self.per_ip, now)
+                shared.users += 1
+        return ConnectionBucket(self.per_connection, now, ip, shared)
+
+    def close(self, bucket):
+        shared = bucket.shared
+        if shared is None:
+            return
+        with self._lock:
+            shared.users -= 1
+            if not shared.users:
+                # forgotten once the address has no connections left
+                del self._addresses[bucket.ip]
+
+    def addresses(self):
+        return len(self._addresses)
+
+    def received(self, bucket, nbytes):
+        """Charge nbytes just read from bucket's connection. Bytes are paid for
+        when they arrive; the frames they hold then wait (or are dropped) in
+        admit() until the debt is paid off."""
+        if self.per_connection.byte_rate:
+            bucket.bytes -= nbytes
+        shared = bucket.shared
+        if shared is not None and self.per_ip.byte_rate:
+            with self._lock:
+                shared.bytes -= nbytes
+
+    def admit(self, bucket):
+        """Account for one frame about to be handled. Returns None if it must be
+        discarded (DROP), otherwise the seconds to wait before handling it
+        (DELAY; 0 = now). Raises RateLimitExceeded under DISCONNECT."""
+        now = self.clock()
+        limits = self.per_connection
+        bucket.refill(limits, now)
+        shared = bucket.shared
+        if self.policy == DROP:
+            if shared is None:
+                fits = bucket.has_room(limits)
+            else:
+                with self._lock:
+                    shared.refill(self.per_ip, now)
+                    fits = bucket.has_room(limits) and shared.has_room(self.per_ip)
+                    if fits:
+                        shared.msgs -= 1
+            bucket.dropping = not fits
+            if not fits:
+                return None
+            bucket.msgs -= 1
+            return 0.0
+        bucket.msgs -= 1
+        wait = bucket.debt(limits)
+        if shared is not None:
+            with self._lock:
+                shared.refill(self.per_ip, now)
+                shared.msgs -= 1
+                wait = max(wait, shared.debt(self.per_ip))
+        if wait and self.policy == DISCONNECT:
+            raise RateLimitExceeded(f"rate limit exceeded by {bucket.ip}")
+        return wait
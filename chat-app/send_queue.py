@@ -0,0 +1,137 @@
+# send_queue.py
+# Bounded per-connection outbound queue with a slow-consumer policy.
+
+import itertools
+import threading
+from collections import deque
+
+# What to do when a client's queue is full:
+DROP_OLDEST = 'drop_oldest'  # discard the oldest pending frame
+DISCONNECT = 'disconnect'    # give up on the client
+COALESCE = 'coalesce'        # frames with a key replace the pending frame with the same key
+                             # (e.g. only the newest online_list matters); if the queue is
+                             # still full, fall back to dropping the oldest frame
+POLICIES = (DROP_OLDEST, DISCONNECT, COALESCE)
+
+DEFAULT_MAXSIZE = 256
+
+
+class SendQueue:
+    """Thread-safe bounded FIFO of encoded frames for one connection.
+
+    Producers (broadcast, private messages) call put() and never block.
+    The consumer (writer thread or event-loop flush) calls get()/get_nowait()
+    and receives every pending frame at once, so it can write them with a
+    single syscall.
+
+    A source (add_source(), e.g. a replay) is an iterator of frames that must
+    not be lost: it is never subject to the policy, and the consumer pulls
+    the next item from it only when nothing else is pending, so it goes out
+    at the pace the client reads.
+    """
+
+    def __init__(self, maxsize=DEFAULT_MAXSIZE, policy=DROP_OLDEST):
+        if policy not in POLICIES:
+            raise ValueError(f"unknown slow-consumer policy: {policy}")
+        self.maxsize = maxsize
+        self.policy = policy
+        self.dropped = 0
+        self.closed = False
+        self._items = deque()  # [key, data] cells
+        self._keyed = {}       # key -> pending cell (COALESCE only)
+        self._source = None    # iterator pulled when the queue is empty
+        self._cond = threading.Condition(threading.Lock())
+
+    def __len__(self):
+        return len(self._items)
+
+    @property
+    def pulling(self):
+        """Whether a source still has items."""
+        return self._source is not None
+
+    def add_source(self, source):
+        """Queue an iterator of frames after any source already queued."""
+        with self._cond:
+            if self.closed:
+                return
+            self._source = source if self._source is None else itertools.chain(self._source, source)
+            self._cond.notify()
+
+    def put(self, data, key=None):
+        """Queue one frame. Returns False if the client should be disconnected."""
+        with self._cond:
+            if self.closed:
+                return False
+            if key is not None and self.policy == COALESCE:
+                cell = self._keyed.get(key)
+                if cell is not None:
+                    cell[1] = data
+                    return True
+            if len(self._items) >= self.maxsize:
+                if self.policy == DISCONNECT:
+                    self._close()
+                    return False
+                old = self._items.popleft()
+                if old[0] is not None and self._keyed.get(old[0]) is old:
+                    del self._keyed[old[0]]
+                self.dropped += 1
+            cell = [key, data]
+            self._items.append(cell)
+            if key is not None and self.policy == COALESCE:
+                self._keyed[key] = cell
+            self._cond.notify()
+        return True
+
+    def _drain(self):
+        batch = [cell[1] for cell in self._items]
+        self._items.clear()
+        self._keyed.clear()
+        return batch
+
+    def _pull(self, source):
+        """Next item of source, outside the lock (it may read from disk)."""
+        item = next(source, None)
+        if item is None:
+            with self._cond:
+                # add_source() may have chained another one on meanwhile
+                if self._source is source:
+                    self._source = None
+            return []
+        return [item]
+
+    def get_nowait(self):
+        """Return all pending frames, else the next item of the source
+        (possibly an empty list)."""
+        with self._cond:
+            batch = self._drain()
+            source = self._source
+        if batch or source is None:
+            return batch
+        return self._pull(source)
+
+    def get(self, timeout=None):
+        """Block until frames are available. Returns [] once closed and empty."""
+        while True:
+            with self._cond:
+                while not self._items and self._source is None and not self.closed:
+                    if not self._cond.wait(timeout):
+                        return []
+                batch = self._drain()
+                source = self._source
+            if batch or source is None:
+                return batch
+            batch = self._pull(source)
+            if batch:
+                return batch
+
+    def _close(self):
+        self.closed = True
+        # a source is only pulled while the connection is open
+        self._source = None
+        self._cond.notify()
+
+    def close(self):
+        """Refuse new frames; pending frames can still be drained."""
+        with self._cond:
+            self._close()
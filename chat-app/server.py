@@ -1,147 +1,685 @@
 #!/usr/bin/env python3
 # server.py
-# Run: python server.py
+# Run: python server.py [--engine thread|asyncio] [--port 5555] [--workers N]
+# Cluster: python server.py --port 5555 --cluster-listen 127.0.0.1:7001 --peers 127.0.0.1:7002,127.0.0.1:7003
 
+import os
 import socket
+import sys
 import threading
 import json
-from datetime import datetime
+import argparse
+import contextlib
+import itertools
+import signal
+import subprocess
+import tempfile
+import time
+
+import frame_compression
+import management
+import message_store
+import metrics
+import presence_aggregator
+import rate_limit
+import send_queue
+import wire_codec
+from line_decoder import LineDecoder, LineTooLong
 
 HOST = '0.0.0.0'
 PORT = 5555
 DELIM = '\n'  # use newline as message delimiter
+MAX_LINE_LENGTH = 64 * 1024  # longest frame accepted from a client
+
+# live counters and histograms (metrics.py), served by the management listener
+# ("stats") and, with --metrics-port, as Prometheus text
+stats = metrics.Registry()
+connections_accepted = stats.counter('chat_connections_accepted_total', "Client connections accepted")
+frames_received = stats.counter('chat_frames_received_total', "Frames received from clients")
+bytes_received = stats.counter('chat_bytes_received_total', "Bytes received from clients")
+frames_sent = stats.counter('chat_frames_sent_total', "Frames written to client sockets")
+bytes_sent = stats.counter('chat_bytes_sent_total', "Bytes written to client sockets")
+fanout_seconds = stats.histogram('chat_fanout_seconds', "Time to queue one frame for every local recipient")
+lock_wait_seconds = stats.histogram('chat_clients_lock_wait_seconds', "Wait for clients_lock, contended acquisitions only")
+lock_acquisitions = stats.counter('chat_clients_lock_acquisitions_total', "clients_lock acquisitions")
+lock_contended = stats.counter('chat_clients_lock_contended_total', "clients_lock acquisitions that had to wait")
+store_append_seconds = stats.histogram('chat_store_append_seconds', "Time to write one message to the message store")
+
+clients_lock = metrics.TimedLock(lock_wait_seconds, lock_acquisitions, lock_contended)
+clients = {}  # username -> (conn, addr); conn is a Connection (or async_server.ChatProtocol)
+# rooms, also guarded by clients_lock
+rooms = {}          # room -> {username: None}, members in join order
+user_rooms = {}     # username -> set of rooms
+room_scoped = set()  # users who joined straight into a room: their presence is announced only there
+MAX_ROOM_NAME = 64
+
+# outbound queue per client; see send_queue.py for the policies
+SEND_QUEUE_SIZE = send_queue.DEFAULT_MAXSIZE
+SLOW_CONSUMER_POLICY = send_queue.DROP_OLDEST
+
+# limits on what clients send (rate_limit.py), per connection and per client
+# address; 0 = unlimited. All off unless asked for (--rate-msgs etc.), so
+# benchmarks and existing deployments see no change. Per-address limits in
+# particular: a gateway or a NAT puts many legitimate users behind one address.
+RATE_MSGS = 0.0
+RATE_BYTES = 0
+RATE_IP_MSGS = 0.0
+RATE_IP_BYTES = 0
+RATE_LIMIT_POLICY = rate_limit.DELAY
+limiter = None  # rate_limit.RateLimiter; None = no limits
+
+# shares the registry and fan-out with other processes (backplane.Backplane):
+# the other workers in multi-process mode (--workers), or the other nodes of a
+# cluster (--peers). None = this process is the whole server.
+backplane = None
+
+# server-side message store (message_store.py): message frames get ids and are
+# kept for replay to clients that were offline. None = messages are not kept;
+# off unless asked for (--store DIR), as it writes to disk for every message.
+store = None
+REPLAY_BATCH = 256  # stored frames per write when replaying
 
-clients_lock = threading.Lock()
-clients = {}  # username -> (conn, addr)
+# frame compression offered to clients that ask for it at join (frame_compression.py)
+COMPRESSION = frame_compression.available()  # codecs the server accepts, preferred first
+COMPRESS_MIN_SIZE = frame_compression.DEFAULT_MIN_SIZE
+compressors = {}  # codec -> FrameCompressor shared by every connection using it
+
+# binary message frames for clients that ask for them at join (wire_codec.py)
+BINARY_FRAMES = True
+names = wire_codec.NameTable()
+binary_encoder = wire_codec.BinaryEncoder(names)
+
+# admin commands run on the management listener's threads; whatever they do to
+# connections goes through dispatch(fn, *args), which the asyncio engine
+# replaces with loop.call_soon_threadsafe (like backplane.dispatch)
+dispatch = lambda fn, *args: fn(*args)
+SHUTDOWN_TIMEOUT = 10.0  # seconds a graceful shutdown waits for send queues to drain
+shutting_down = threading.Event()
+stop_engine = None  # set by the running engine: makes serve() return (callable from any thread)
+
+def _queues():
+    with clients_lock:
+        return [conn.queue for conn, addr in clients.values()]
+
+frames_dropped = stats.counter('chat_frames_dropped_total', "Frames discarded by the slow-consumer policy",
+                               fn=lambda: sum(q.dropped for q in _queues()))
+rate_limited_frames = stats.counter('chat_rate_limited_frames_total', "Frames discarded by the rate limiter")
+rate_limit_pauses = stats.counter('chat_rate_limit_pauses_total', "Times the rate limiter paused reading a connection")
+rate_limit_disconnects = stats.counter('chat_rate_limit_disconnects_total',
+                                       "Connections closed by the rate limiter")
+stats.gauge('chat_rate_limit_addresses', "Client addresses with a rate limit bucket",
+            fn=lambda: limiter.addresses() if limiter else 0)
+stats.gauge('chat_connections', "Joined users connected to this process", fn=lambda: len(clients))
+stats.gauge('chat_send_queue_frames', "Frames waiting in all send queues", fn=lambda: sum(map(len, _queues())))
+stats.gauge('chat_send_queue_max', "Frames waiting in the fullest send queue",
+            fn=lambda: max(map(len, _queues()), default=0))
 
 def now_str():
-    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    # formatted once per second, not once per message
+    return wire_codec.format_time(time.time())
+
+class Connection:
+    """Threaded-engine peer. Frames go into a bounded SendQueue and are written
+    by a dedicated writer thread, so a client that stops reading only stalls
+    its own writer."""
+
+    def __init__(self, sock, addr):
+        self.sock = sock
+        self.addr = addr
+        self.queue = send_queue.SendQueue(SEND_QUEUE_SIZE, SLOW_CONSUMER_POLICY)
+        self.encoder = None     # set at join if the client negotiated binary frames
+        self.compressor = None  # set at join if the client negotiated compression
+        self.writer = threading.Thread(target=self._write_loop, daemon=True)
+        self.writer.start()
+
+    def send_frame(self, data, key=None):
+        if not self.queue.put(wire_frame(self, data), key):
+            # slow-consumer policy says disconnect
+            self.abort()
+
+    def send_source(self, source):
+        """Write the items of source (wire data) as the writer catches up."""
+        self.queue.add_source(source)
+
+    def close(self):
+        """Flush whatever is queued, then close the socket."""
+        self.queue.close()
+
+    def abort(self):
+        """Close now, discarding queued frames."""
+        self.queue.close()
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def _write_loop(self):
+        try:
+            while True:
+                batch = self.queue.get()
+                if not batch:
+                    break  # closed and drained
+                data = b''.join(batch)
+                self.sock.sendall(data)
+                frames_sent.value += len(batch)
+                bytes_sent.value += len(data)
+        except OSError:
+            pass
+        finally:
+            # wakes the reader thread if it is still blocked in recv()
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.sock.close()
+
+def encode_json(obj):
+    """Encode one frame. The result is immutable bytes, so the same object
+    can sit in every recipient's queue."""
+    frame = (json.dumps(obj, ensure_ascii=False) + DELIM).encode('utf-8')
+    # binary connections convert from obj instead of parsing the frame back
+    wire_codec.remember(frame, obj)
+    return frame
+
+def wire_frame(conn, data):
+    """What goes on the wire for an encoded frame: binary and/or compressed if
+    the connection negotiated it at join."""
+    if conn.encoder:
+        data = conn.encoder.frame(data, conn.queue.dropped)
+    if conn.compressor:
+        data = conn.compressor.frame(data)
+    return data
 
-def send_json(conn, obj):
+def send_json(conn, obj, key=None):
     try:
-        data = json.dumps(obj, ensure_ascii=False) + DELIM
-        conn.sendall(data.encode('utf-8'))
+        conn.send_frame(encode_json(obj), key)
     except Exception:
         # caller will handle removal
         pass
 
+def announce_presence(room, joined, left):
+    """Emit one system frame for a batch of joins/leaves (see presence_aggregator.py).
+    room=None means the whole server."""
+    obj = {"type": "system"}
+    if room is not None:
+        obj["room"] = room
+    obj["msg"] = presence_aggregator.summary_text(joined, left, f" {room}" if room is not None else '')
+    obj["time"] = now_str()
+    if len(joined) + len(left) > 1:
+        obj["joined"] = joined[:presence_aggregator.MAX_NAMES]
+        obj["left"] = left[:presence_aggregator.MAX_NAMES]
+        obj["joined_count"] = len(joined)
+        obj["left_count"] = len(left)
+    # a lone join is not announced to the user who joined
+    exclude = joined[0] if len(joined) == 1 and not left else None
+    if room is None:
+        broadcast(obj, exclude_username=exclude)
+    else:
+        room_broadcast(room, obj, exclude_username=exclude)
+
+# join/leave announcements are batched over a short window (--presence-window)
+presence = presence_aggregator.PresenceAggregator(announce_presence)
+
+def sequenced():
+    """With a store, message ids are allocated, stored and delivered under its
+    lock, so live delivery and replay agree on the order."""
+    return store.lock if store else contextlib.nullcontext()
+
+def stored_frame(msg_out, channels):
+    """Encode a message frame; with a store, give it the next id and keep it in
+    the given channels. Call inside sequenced()."""
+    if not store:
+        return encode_json(msg_out)
+    msg_out["id"] = store.allocate_id()
+    frame = encode_json(msg_out)
+    start = time.perf_counter()
+    store.append(channels, msg_out["id"], frame)
+    store_append_seconds.observe(time.perf_counter() - start)
+    return frame
+
+def replay_missed(conn, username, last_id, rooms=(), epoch=None, upto=None):
+    """Send the stored frames the user missed, up to id upto (the newest id
+    when the user was registered; later ones are delivered live). With
+    last_id (the newest id the client has) that is everything since; without
+    it, only the private messages that arrived while the user was offline. A
+    last_id from another store (epoch, when the client sends one) is ignored.
+
+    Always ends with replay_end, even when there was nothing to replay: the
+    client takes its position from there, after the replayed frames."""
+    if epoch is not None and epoch != store.epoch:
+        last_id = None
+    if isinstance(last_id, int) and not isinstance(last_id, bool) and last_id >= 0:
+        after = last_id
+        channels = [message_store.ALL, message_store.user_channel(username)]
+    else:
+        after = store.get_marker(username)
+        channels = [message_store.user_channel(username)]
+    channels += [message_store.room_channel(room) for room in rooms]
+    frames = store.replay(channels, after, upto) if after is not None else ()
+    conn.send_source(replay_stream(conn, frames, after, upto))
+
+def replay_stream(conn, frames, after, upto):
+    """Wire data for replay_missed(): the stored frames between a replay and a
+    replay_end frame. count in replay_end is how many frames the writer took
+    before it (all of them: a source is never dropped)."""
+    count = 0
+    for chunk, n in stored_chunks(conn, frames):
+        if not count:
+            yield wire_frame(conn, encode_json({"type": "replay", "after": after}))
+        count += n
+        yield chunk
+    yield wire_frame(conn, encode_json({"type": "replay_end", "last_id": upto, "count": count}))
+
+def deliver_local(frame, exclude_username=None):
+    """Queue an encoded frame for every user connected to this process."""
+    start = time.perf_counter()
+    # only snapshot under the lock; enqueueing never blocks on a slow socket
+    with clients_lock:
+        targets = [conn for user, (conn, addr) in clients.items() if user != exclude_username]
+    for conn in targets:
+        conn.send_frame(frame)
+    fanout_seconds.observe(time.perf_counter() - start)
+
+def known_recipient(username):
+    """Whether a private message to username can be delivered now or kept
+    for when they join."""
+    if store and store.known_user(username):
+        return True
+    with clients_lock:
+        if username in clients:
+            return True
+    return bool(backplane) and username in backplane.users()
+
+def deliver_to(username, frame):
+    """Queue an encoded frame for one local user; False if not connected here."""
+    with clients_lock:
+        target = clients.get(username)
+    if not target:
+        return False
+    target[0].send_frame(frame)
+    return True
+
 def broadcast(obj, exclude_username=None):
+    # serialize once and share the frame across all recipients
+    broadcast_frame(encode_json(obj), exclude_username)
+
+def broadcast_frame(frame, exclude_username=None):
+    deliver_local(frame, exclude_username)
+    if backplane:
+        backplane.publish(frame, exclude_username)
+
+def deliver_room(room, frame, exclude_username=None):
+    """Queue an encoded frame for the room's members connected to this process."""
+    start = time.perf_counter()
+    with clients_lock:
+        members = rooms.get(room, ())
+        targets = [clients[user][0] for user in members if user != exclude_username and user in clients]
+    for conn in targets:
+        conn.send_frame(frame)
+    fanout_seconds.observe(time.perf_counter() - start)
+
+def room_broadcast(room, obj, exclude_username=None):
+    """Fan out to one room; cost is proportional to the room, not the server."""
+    room_broadcast_frame(room, encode_json(obj), exclude_username)
+
+def room_broadcast_frame(room, frame, exclude_username=None):
+    deliver_room(room, frame, exclude_username)
+    if backplane:
+        backplane.publish_room(room, frame)
+
+def room_members(room):
+    with clients_lock:
+        members = list(rooms.get(room, ()))
+    if backplane:
+        members += backplane.room_users(room)
+    return members
+
+def send_room_list(conn, room):
+    send_json(conn, {"type": "online_list", "room": room, "users": room_members(room)}, key='online_list:' + room)
+
+def join_room(conn, username, room, last_id=None):
+    with sequenced():
+        with clients_lock:
+            members = rooms.setdefault(room, {})
+            already = username in members
+            members[username] = None
+            user_rooms.setdefault(username, set()).add(room)
+        upto = store.last_id if store else None
+    if store and last_id is not None and not already:
+        # catch up on the room from the client's last seen id; newer
+        # messages are delivered live
+        replay_room(conn, room, last_id, upto)
+    if not already:
+        if backplane:
+            backplane.join_room(username, room)
+        presence.add(room, presence_aggregator.JOINED, username)
+    send_room_list(conn, room)
+
+def replay_room(conn, room, last_id, upto):
+    if not isinstance(last_id, int) or isinstance(last_id, bool) or last_id < 0:
+        return
+    frames = store.replay([message_store.room_channel(room)], last_id, upto)
+    conn.send_source(chunk for chunk, n in stored_chunks(conn, frames))
+
+def stored_chunks(conn, frames):
+    """(wire data, frame count) for replayed frames (an iterable), REPLAY_BATCH
+    frames at a time; with compression the chunks form one stream, so
+    repeated names and keys compress across them.
+
+    Replays are handed to the connection as a source (send_source()): the
+    writer pulls the next chunk only once everything queued before it is
+    written, so a long replay is read from the store at the pace the client
+    reads, and the slow-consumer policy never drops part of it (which would
+    lose messages and, with compression, break the rest of the stream)."""
+    stream = conn.compressor.stream() if conn.compressor else None
+    frames = iter(frames)
+    while True:
+        batch = list(itertools.islice(frames, REPLAY_BATCH))
+        if not batch:
+            return
+        data = b''.join(batch)
+        yield (stream.chunk(data) if stream else wire_frame(conn, data)), len(batch)
+
+def leave_room(username, room):
+    with clients_lock:
+        members = rooms.get(room)
+        if members is None or username not in members:
+            return False
+        del members[username]
+        if not members:
+            del rooms[room]
+        user_rooms.get(username, set()).discard(room)
+    if backplane:
+        backplane.leave_room(username, room)
+    presence.add(room, presence_aggregator.LEFT, username)
+    return True
+
+def valid_room(room):
+    return isinstance(room, str) and 0 < len(room) <= MAX_ROOM_NAME
+
+def online_users():
+    with clients_lock:
+        online = list(clients.keys())
+    if backplane:
+        online += backplane.users()
+    return online
+
+def frame_compressor(codec):
+    compressor = compressors.get(codec)
+    if compressor is None:
+        compressor = compressors.setdefault(codec, frame_compression.FrameCompressor(codec, COMPRESS_MIN_SIZE))
+    return compressor
+
+def claim_name(username):
+    """Reserve username in the registry shared through the backplane, unless
+    it is taken here already. Waits for the other workers (up to
+    backplane.CLAIM_TIMEOUT), so the asyncio engine calls it off the loop."""
     with clients_lock:
-        for user, (conn, addr) in list(clients.items()):
-            if user == exclude_username:
-                continue
-            send_json(conn, obj)
+        if username in clients:
+            return False
+    return backplane.claim(username)
+
+def register_user(conn, addr, msg, claimed=None):
+    """Handle a "join" frame. Returns the accepted username, or None if the
+    connection was rejected (and closed). claimed: what claim_name() returned
+    for the requested name, if the caller already called it."""
+    requested = msg.get('from')
+    room = msg.get('room')
+    if not requested:
+        reject = {"type": "error", "msg": "No username provided"}
+    elif room is not None and not valid_room(room):
+        reject = {"type": "error", "msg": "invalid_room"}
+    elif shutting_down.is_set():
+        reject = {"type": "join_ack", "ok": False, "reason": "shutting_down"}
+    else:
+        reject = None
+    if reject:
+        if claimed:
+            backplane.release(requested)
+        send_json(conn, reject)
+        conn.close()
+        return None
+    taken = False
+    if backplane:
+        # the registry is shared: the name must be free in every worker
+        if claimed is None:
+            claimed = claim_name(requested)
+        taken = not claimed
+    # registration and the replay's upper bound happen in one step relative to
+    # new messages: those up to the bound are replayed, later ones delivered
+    # live. The replay itself is read and sent outside the lock.
+    with sequenced():
+        with clients_lock:
+            if taken or requested in clients:
+                if claimed:
+                    backplane.release(requested)
+                send_json(conn, {"type": "join_ack", "ok": False, "reason": "username_taken"})
+                conn.close()
+                return None
+            username = requested
+            clients[username] = (conn, addr)
+            if room is not None:
+                room_scoped.add(username)
+        # ack join
+        ack = {"type": "join_ack", "ok": True, "time": now_str()}
+        if store:
+            upto = ack["last_id"] = store.last_id
+            ack["store"] = store.epoch
+        codec = frame_compression.negotiate(msg.get('compress'), COMPRESSION)
+        if codec:
+            ack["compress"] = codec
+            ack["compress_min"] = COMPRESS_MIN_SIZE
+        encoding = wire_codec.negotiate(msg.get('encoding')) if BINARY_FRAMES else None
+        if encoding:
+            ack["encoding"] = encoding
+        send_json(conn, ack)
+        # everything after the ack may be binary and/or compressed
+        if encoding:
+            conn.encoder = wire_codec.BinarySession(binary_encoder)
+        if codec:
+            conn.compressor = frame_compressor(codec)
+        if room is not None:
+            # join straight into a room: presence (and online_list) is scoped to it
+            join_room(conn, username, room)
+    if store:
+        replay_missed(conn, username, msg.get('last_id'), [room] if room is not None else [],
+                      msg.get('store'), upto)
+        store.set_marker(username)
+    if room is not None:
+        return username
+    # notify others
+    presence.add(None, presence_aggregator.JOINED, username)
+    # send current online list
+    send_json(conn, {"type": "online_list", "users": online_users()}, key='online_list')
+    return username
+
+def binary_decoder(decoder):
+    """Decoder for a client that negotiated binary frames; takes over the
+    unparsed bytes of its LineDecoder."""
+    frames = wire_codec.FrameDecoder(max_line=MAX_LINE_LENGTH, names=names, watch_ack=False)
+    frames.feed(decoder.pending())
+    return frames
+
+def handle_frame(conn, username, msg):
+    """Dispatch one frame from a joined user."""
+    mtype = msg.get('type')
+    if mtype == 'message' and 'room' in msg:
+        room = msg.get('room')
+        with clients_lock:
+            member = room in user_rooms.get(username, ())
+        if not member:
+            send_json(conn, {"type": "error", "msg": "not_in_room", "room": room})
+            return
+        msg_out = {"type": "message", "from": username, "room": room, "to": room,
+                   "msg": msg.get('msg'), "time": now_str()}
+        with sequenced():
+            room_broadcast_frame(room, stored_frame(msg_out, [message_store.room_channel(room)]))
+    elif mtype == 'message':
+        to = msg.get('to', 'all')
+        msg_out = {
+            "type": "message",
+            "from": username,
+            "to": to,
+            "msg": msg.get('msg'),
+            "time": now_str()
+        }
+        if to == 'all':
+            with sequenced():
+                broadcast_frame(stored_frame(msg_out, [message_store.ALL]))
+        else:
+            # private: send to recipient and echo to sender
+            with sequenced():
+                if not known_recipient(to):
+                    send_json(conn, {"type": "error", "msg": "unknown_user"})
+                    return
+                channels = [message_store.user_channel(username)]
+                if store:
+                    # kept for the recipient even if offline; delivered on next join
+                    channels.append(message_store.user_channel(to))
+                frame = stored_frame(msg_out, channels)
+                if not deliver_to(to, frame) and backplane:
+                    backplane.unicast(to, frame)
+                # echo back to sender
+                conn.send_frame(frame)
+    elif mtype == 'list_request':
+        room = msg.get('room')
+        if room is not None:
+            send_room_list(conn, room)
+        else:
+            send_json(conn, {"type": "online_list", "users": online_users()}, key='online_list')
+    elif mtype == 'room_join':
+        room = msg.get('room')
+        if valid_room(room):
+            join_room(conn, username, room, msg.get('last_id'))
+        else:
+            send_json(conn, {"type": "error", "msg": "invalid_room"})
+    elif mtype == 'room_leave':
+        room = msg.get('room')
+        if leave_room(username, room):
+            send_json(conn, {"type": "room_left", "room": room})
+        else:
+            send_json(conn, {"type": "error", "msg": "not_in_room", "room": room})
+    elif mtype == 'room_list':
+        with clients_lock:
+            counts = {room: len(members) for room, members in rooms.items()}
+            mine = sorted(user_rooms.get(username, ()))
+        if backplane:
+            for room, n in backplane.room_counts().items():
+                counts[room] = counts.get(room, 0) + n
+        send_json(conn, {"type": "room_list", "rooms": counts, "joined": mine}, key='room_list')
+    else:
+        # unknown type: ignore or send error
+        send_json(conn, {"type": "error", "msg": "unknown_type"})
+
+def unregister_user(username):
+    """Remove a user from the registry and tell everyone else."""
+    with clients_lock:
+        joined = list(user_rooms.get(username, ()))
+    for room in joined:
+        leave_room(username, room)
+    with clients_lock:
+        try:
+            del clients[username]
+        except KeyError:
+            pass
+        user_rooms.pop(username, None)
+        scoped = username in room_scoped
+        room_scoped.discard(username)
+    if backplane:
+        backplane.release(username)
+    if store:
+        store.set_marker(username)
+    if scoped:
+        return
+    presence.add(None, presence_aggregator.LEFT, username)
+
+def rate_admit(conn, bucket):
+    """limiter.admit() for one frame from conn: None = discard the frame,
+    otherwise seconds to wait (without reading) before handling it. Raises
+    RateLimitExceeded if conn must be disconnected."""
+    dropping = bucket.dropping
+    try:
+        wait = limiter.admit(bucket)
+    except rate_limit.RateLimitExceeded:
+        rate_limit_disconnects.value += 1
+        send_json(conn, {"type": "error", "msg": "rate_limited"})
+        raise
+    if wait is None:
+        rate_limited_frames.value += 1
+        if not dropping:
+            # once per run of dropped frames, not once per frame
+            send_json(conn, {"type": "error", "msg": "rate_limited"})
+    elif wait:
+        rate_limit_pauses.value += 1
+    return wait
 
 def handle_connection(conn, addr):
-    buffer = ''
+    decoder = LineDecoder(max_line=MAX_LINE_LENGTH)
     username = None
+    peer = Connection(conn, addr)
+    bucket = limiter.open(addr[0]) if limiter else None
+    connections_accepted.value += 1
     try:
-        # Expect initial message to be a "join" with username
         while True:
-            chunk = conn.recv(4096).decode('utf-8')
-            if not chunk:
-                raise ConnectionResetError()
-            buffer += chunk
-            while DELIM in buffer:
-                raw, buffer = buffer.split(DELIM, 1)
-                try:
-                    msg = json.loads(raw)
-                except Exception:
-                    continue
-                if msg.get('type') == 'join':
-                    requested = msg.get('from')
-                    if not requested:
-                        send_json(conn, {"type": "error", "msg": "No username provided"})
-                        conn.close()
-                        return
-                    with clients_lock:
-                        if requested in clients:
-                            send_json(conn, {"type": "join_ack", "ok": False, "reason": "username_taken"})
-                            conn.close()
-                            return
-                        username = requested
-                        clients[username] = (conn, addr)
-                    # ack join
-                    send_json(conn, {"type": "join_ack", "ok": True, "time": now_str()})
-                    # notify others
-                    broadcast({"type": "system", "msg": f"{username} joined", "time": now_str()}, exclude_username=username)
-                    # send current online list
-                    with clients_lock:
-                        online = list(clients.keys())
-                    send_json(conn, {"type": "online_list", "users": online})
-                    break
-                else:
-                    # ignore until join
-                    continue
-            if username:
+            n = decoder.recv_from(conn)
+            if not n:
                 break
-
-        # main loop: receive messages
-        while True:
-            chunk = conn.recv(4096).decode('utf-8')
-            if not chunk:
-                raise ConnectionResetError()
-            buffer += chunk
-            while DELIM in buffer:
-                raw, buffer = buffer.split(DELIM, 1)
-                try:
-                    msg = json.loads(raw)
-                except Exception:
-                    continue
-                mtype = msg.get('type')
-                if mtype == 'message':
-                    to = msg.get('to', 'all')
-                    msg_out = {
-                        "type": "message",
-                        "from": username,
-                        "to": to,
-                        "msg": msg.get('msg'),
-                        "time": now_str()
-                    }
-                    if to == 'all':
-                        broadcast(msg_out, exclude_username=None)
-                    else:
-                        # private: send to recipient and echo to sender
-                        with clients_lock:
-                            target = clients.get(to)
-                            sender = clients.get(username)
-                        if target:
-                            send_json(target[0], msg_out)
-                        # echo back to sender
-                        send_json(conn, msg_out)
-                elif mtype == 'list_request':
-                    with clients_lock:
-                        online = list(clients.keys())
-                    send_json(conn, {"type": "online_list", "users": online})
-                else:
-                    # unknown type: ignore or send error
-                    send_json(conn, {"type": "error", "msg": "unknown_type"})
-    except (ConnectionResetError, ConnectionAbortedError):
+            msgs = decoder.frames()
+            bytes_received.value += n
+            frames_received.value += len(msgs)
+            if bucket:
+                limiter.received(bucket, n)
+            for msg in msgs:
+                if bucket:
+                    wait = rate_admit(peer, bucket)
+                    if wait is None:
+                        continue
+                    if wait:
+                        # not reading meanwhile lets the socket buffers fill up,
+                        # and TCP slows the client down
+                        time.sleep(wait)
+                if username:
+                    handle_frame(peer, username, msg)
+                elif msg.get('type') == 'join':
+                    # Expect initial message to be a "join" with username
+                    username = register_user(peer, addr, msg)
+                    if not username:
+                        return
+                    if peer.encoder:
+                        decoder = binary_decoder(decoder)
+                # else: ignore until join
+    except (OSError, LineTooLong, rate_limit.RateLimitExceeded):
         pass
     finally:
         # clean up
+        if bucket:
+            limiter.close(bucket)
         if username:
-            with clients_lock:
-                try:
-                    del clients[username]
-                except KeyError:
-                    pass
-            broadcast({"type": "system", "msg": f"{username} left", "time": now_str()})
-        try:
-            conn.close()
-        except:
-            pass
+            unregister_user(username)
+        peer.close()
+        frames_dropped.value += peer.queue.dropped
         print(f"[DISCONNECTED] {addr} ({username})")
 
-def main():
-    print(f"Starting chat server on {HOST}:{PORT}")
+def serve_threaded(host, port, reuse_port=False):
+    global stop_engine
+    print(f"Starting chat server on {host}:{port}")
     s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    s.bind((HOST, PORT))
+    if reuse_port:
+        # every worker binds the same port; the kernel spreads accepts across them
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    s.bind((host, port))
     s.listen(100)
+    # wakes the accept() below (it fails with EINVAL) once the listener is shut down
+    stop_engine = lambda: s.shutdown(socket.SHUT_RDWR)
     try:
         while True:
-            conn, addr = s.accept()
+            try:
+                conn, addr = s.accept()
+            except OSError:
+                if shutting_down.is_set():
+                    break
+                raise
             print(f"[NEW CONNECTION] {addr}")
             t = threading.Thread(target=handle_connection, args=(conn, addr), daemon=True)
             t.start()
@@ -150,5 +688,243 @@ def main():
     finally:
         s.close()
 
+def serve(engine, host, port, reuse_port=False):
+    if engine == 'asyncio':
+        import async_server
+        async_server.serve(host, port, reuse_port=reuse_port)
+    else:
+        serve_threaded(host, port, reuse_port=reuse_port)
+
+def stats_snapshot(request=None):
+    snapshot = stats.snapshot()
+    snapshot["pid"] = os.getpid()
+    return {"type": "stats", "stats": snapshot}
+
+def admin_get_users(request):
+    # copy under the lock, sort and encode outside it: a big list costs the
+    # listener thread, not message delivery
+    users = sorted(online_users())
+    return {"users": users, "count": len(users)}
+
+def admin_broadcast(request):
+    message = request.get('message')
+    if not isinstance(message, str) or not message:
+        return {"type": "error", "msg": "no_message"}
+    obj = {"type": "system", "msg": message, "time": now_str(), "admin": True}
+    dispatch(broadcast, obj)
+    return {"status": "broadcast_sent"}
+
+def admin_kick(request):
+    """Disconnect a user connected to this process, after flushing what is
+    already queued for them (plus the notice)."""
+    username = request.get('username')
+    with clients_lock:
+        target = clients.get(username)
+    if not target:
+        return {"type": "error", "msg": "user_not_found", "username": username}
+    conn = target[0]
+    notice = {"type": "system", "msg": "You have been disconnected by an administrator",
+              "time": now_str(), "admin": True}
+    if request.get('reason'):
+        notice["reason"] = request['reason']
+    dispatch(send_json, conn, notice)
+    dispatch(conn.close)
+    return {"status": "kicked", "username": username}
+
+def admin_shutdown(request):
+    if shutting_down.is_set():
+        return {"status": "shutting_down"}
+    shutting_down.set()
+    timeout = request.get('timeout', SHUTDOWN_TIMEOUT)
+    if not isinstance(timeout, (int, float)) or timeout < 0:
+        timeout = SHUTDOWN_TIMEOUT
+    # drain in the background so the admin gets the reply right away
+    threading.Thread(target=graceful_shutdown, args=(timeout,), daemon=True).start()
+    return {"status": "shutting_down", "timeout": timeout}
+
+def graceful_shutdown(timeout):
+    """Refuse new joins (shutting_down is set), tell every user, close every
+    connection once its send queue is flushed, then make serve() return.
+    Users still connected after timeout are cut off when the process exits."""
+    print(f"[ADMIN] graceful shutdown, draining for up to {timeout}s")
+    frame = encode_json({"type": "system", "msg": "Server is shutting down", "time": now_str()})
+    with clients_lock:
+        conns = [conn for conn, addr in clients.values()]
+    for conn in conns:
+        dispatch(conn.send_frame, frame)
+        dispatch(conn.close)
+    # a connection leaves clients once its queue is written out and it is closed
+    deadline = time.monotonic() + timeout
+    while clients and time.monotonic() < deadline:
+        time.sleep(0.05)
+    if clients:
+        print(f"[ADMIN] {len(clients)} connections did not drain in time")
+    print("Shutting down server...")
+    stop_engine()
+
+def start_management(host, port, metrics_port):
+    """Management listener (port 0 = off) and Prometheus endpoint (metrics_port 0 = off)."""
+    if port:
+        commands = {"stats": stats_snapshot, "get_users": admin_get_users, "broadcast": admin_broadcast,
+                    "kick": admin_kick, "shutdown": admin_shutdown}
+        management.ManagementServer(host, port, commands).start()
+        print(f"Management listener on {host}:{port}")
+    if metrics_port:
+        management.serve_prometheus(host, metrics_port, stats)
+        print(f"Prometheus metrics on http://{host}:{metrics_port}/metrics")
+
+def interrupt(signum, frame):
+    """SIGTERM handler: stop the way Ctrl-C does, through the cleanup paths."""
+    raise KeyboardInterrupt
+
+def run_workers(args):
+    """Multi-process mode: this process runs the IPC hub and supervises
+    args.workers copies of itself, each serving the same port."""
+    import ipc_bus
+    bus_path = os.path.join(tempfile.gettempdir(), f"chat-bus-{os.getpid()}.sock")
+    hub = ipc_bus.Hub(bus_path)
+    cmd = [sys.executable, os.path.abspath(__file__),
+           '--host', args.host, '--port', str(args.port), '--engine', args.engine,
+           '--send-queue-size', str(args.send_queue_size), '--slow-policy', args.slow_policy,
+           '--presence-window', str(args.presence_window),
+           '--rate-msgs', str(args.rate_msgs), '--rate-bytes', str(args.rate_bytes),
+           '--rate-ip-msgs', str(args.rate_ip_msgs), '--rate-ip-bytes', str(args.rate_ip_bytes),
+           '--rate-policy', args.rate_policy,
+           '--compress', args.compress, '--compress-min', str(args.compress_min),
+           *(['--no-binary'] if args.no_binary else []),
+           '--management-host', args.management_host, '--shutdown-timeout', str(args.shutdown_timeout),
+           '--bus', bus_path]
+    workers = []
+    for i in range(args.workers):
+        # each worker has its own counters, so its own management/metrics port
+        ports = ['--management-port', str(args.management_port + 1 + i if args.management_port else 0),
+                 '--metrics-port', str(args.metrics_port + 1 + i if args.metrics_port else 0)]
+        workers.append(subprocess.Popen(cmd + ports))
+    print(f"Started {args.workers} workers on {args.host}:{args.port} (bus {bus_path})")
+
+    # a service manager stops us with SIGTERM: take the workers down too
+    signal.signal(signal.SIGTERM, interrupt)
+    try:
+        hub.serve_forever()
+    except KeyboardInterrupt:
+        print("Shutting down server...")
+    finally:
+        for w in workers:
+            w.terminate()
+        for w in workers:
+            w.wait()
+        hub.close()
+
+def main():
+    global SEND_QUEUE_SIZE, SLOW_CONSUMER_POLICY, SHUTDOWN_TIMEOUT, COMPRESSION, COMPRESS_MIN_SIZE, BINARY_FRAMES, backplane, store
+    global limiter
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', default=PORT, type=int)
+    parser.add_argument('--engine', choices=('thread', 'asyncio'), default='thread',
+                        help="thread: one OS thread per connection; asyncio: single-threaded event loop")
+    parser.add_argument('--send-queue-size', default=SEND_QUEUE_SIZE, type=int,
+                        help="max frames queued per client before the slow-consumer policy applies")
+    parser.add_argument('--slow-policy', choices=send_queue.POLICIES, default=SLOW_CONSUMER_POLICY)
+    parser.add_argument('--presence-window', default=presence_aggregator.DEFAULT_WINDOW, type=float,
+                        help="seconds over which join/leave announcements are batched (0 = send each at once)")
+    parser.add_argument('--store', default='', metavar='DIR',
+                        help="keep messages in a server-side message store in DIR, for replay to clients "
+                             f"that were offline (e.g. {message_store.STORE_DIR}; default: keep none)")
+    parser.add_argument('--store-memory', default=message_store.DEFAULT_MEMORY_LIMIT, type=int, metavar='BYTES',
+                        help="recent messages cached in memory; older ones are read back from disk")
+    parser.add_argument('--compress', default=','.join(COMPRESSION), metavar='CODEC,...',
+                        help="compression codecs offered to clients, preferred first ('' = none); "
+                             f"available here: {', '.join(COMPRESSION)}")
+    parser.add_argument('--compress-min', default=COMPRESS_MIN_SIZE, type=int, metavar='BYTES',
+                        help="frames shorter than this are never compressed")
+    parser.add_argument('--no-binary', action='store_true',
+                        help="do not offer binary message frames; every client gets JSON")
+    parser.add_argument('--rate-msgs', default=RATE_MSGS, type=float, metavar='N',
+                        help="messages per second a connection may send (0 = unlimited)")
+    parser.add_argument('--rate-bytes', default=RATE_BYTES, type=int, metavar='BYTES',
+                        help="bytes per second a connection may send (0 = unlimited)")
+    parser.add_argument('--rate-ip-msgs', default=RATE_IP_MSGS, type=float, metavar='N',
+                        help="messages per second for all connections from one address, per process (0 = unlimited)")
+    parser.add_argument('--rate-ip-bytes', default=RATE_IP_BYTES, type=int, metavar='BYTES',
+                        help="bytes per second for all connections from one address, per process (0 = unlimited)")
+    parser.add_argument('--rate-policy', choices=rate_limit.POLICIES, default=RATE_LIMIT_POLICY,
+                        help="what to do with a client over its limit: delay reading from it, "
+                             "drop the extra frames, or disconnect it")
+    parser.add_argument('--management-host', default=management.DEFAULT_HOST)
+    parser.add_argument('--management-port', default=management.DEFAULT_PORT, type=int,
+                        help="management listener (stats, admin commands); 0 = off. "
+                             "With --workers N, the workers listen on PORT+1 .. PORT+N")
+    parser.add_argument('--shutdown-timeout', default=SHUTDOWN_TIMEOUT, type=float, metavar='SECONDS',
+                        help="how long an admin shutdown waits for send queues to drain")
+    parser.add_argument('--metrics-port', default=0, type=int,
+                        help="serve Prometheus metrics at http://<management-host>:PORT/metrics (0 = off)")
+    parser.add_argument('--workers', default=1, type=int,
+                        help="worker processes sharing the port via SO_REUSEPORT (Linux/BSD)")
+    parser.add_argument('--bus', help=argparse.SUPPRESS)  # set by run_workers for each worker
+    parser.add_argument('--cluster-listen', metavar='HOST:PORT',
+                        help="address for links from other cluster nodes; also this node's id")
+    parser.add_argument('--peers', default='', metavar='HOST:PORT,...',
+                        help="cluster addresses of the other nodes (same spelling on every node)")
+    args = parser.parse_args()
+    if args.store.lower() == 'none':
+        args.store = ''
+    peers = [p for p in args.peers.split(',') if p]
+    if peers and not args.cluster_listen:
+        parser.error("--peers needs --cluster-listen")
+    if args.cluster_listen and args.workers > 1:
+        parser.error("run cluster nodes with a single worker each")
+
+    SEND_QUEUE_SIZE = args.send_queue_size
+    SLOW_CONSUMER_POLICY = args.slow_policy
+    presence.window = args.presence_window
+    COMPRESSION = [c for c in args.compress.split(',') if c]
+    unknown = [c for c in COMPRESSION if c not in frame_compression.CODECS]
+    if unknown:
+        parser.error(f"--compress: not available here: {', '.join(unknown)}")
+    COMPRESS_MIN_SIZE = args.compress_min
+    BINARY_FRAMES = not args.no_binary
+    SHUTDOWN_TIMEOUT = args.shutdown_timeout
+    per_connection = rate_limit.Limits(args.rate_msgs, args.rate_bytes)
+    per_ip = rate_limit.Limits(args.rate_ip_msgs, args.rate_ip_bytes)
+    if per_connection or per_ip:
+        limiter = rate_limit.RateLimiter(per_connection, per_ip, args.rate_policy)
+
+    if args.store and (args.workers > 1 or args.bus or args.cluster_listen):
+        # ids are allocated per process, so one store cannot be shared yet
+        print("Message store is disabled in multi-process and cluster mode")
+    elif args.store:
+        store = message_store.MessageStore(args.store, memory_limit=args.store_memory)
+
+    if args.workers > 1:
+        if not hasattr(socket, 'SO_REUSEPORT'):
+            parser.error("--workers needs SO_REUSEPORT, which this platform does not have")
+        run_workers(args)
+        return
+    # the supervisor above has no clients, so only serving processes get a listener
+    start_management(args.management_host, args.management_port, args.metrics_port)
+    signal.signal(signal.SIGTERM, interrupt)
+    try:
+        if args.bus:
+            import ipc_bus
+            backplane = ipc_bus.BusClient(args.bus, on_publish=deliver_local, on_unicast=deliver_to,
+                                          on_room_publish=deliver_room)
+            serve(args.engine, args.host, args.port, reuse_port=True)
+        elif args.cluster_listen:
+            import backplane as backplane_mod
+            backplane = backplane_mod.TcpPeerBackplane(args.cluster_listen, peers,
+                                                       on_publish=deliver_local, on_unicast=deliver_to,
+                                                       on_room_publish=deliver_room)
+            serve(args.engine, args.host, args.port)
+        else:
+            serve(args.engine, args.host, args.port)
+    finally:
+        # serve() returns after Ctrl-C, SIGTERM or an admin shutdown; appends
+        # still buffered in the store are written out here
+        if store:
+            store.close()
+
 if __name__ == "__main__":
+    # engine modules do `import server`; make them share this module's state
+    sys.modules.setdefault('server', sys.modules[__name__])
     main()
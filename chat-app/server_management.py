@@ -1,18 +1,31 @@
 #!/usr/bin/env python3
 # server_management.py
-# Run: python server_management.py
+# Run: python server_management.py [--host 127.0.0.1] [--port 5556]
 
-import socket
+import argparse
 import json
-import threading
+import socket
 import time
 
+from line_decoder import LineDecoder
+
+# các chỉ số hiển thị trong "stats" / "live"
+RATES = (("chat_frames_received_total", "frame nhận/s"),
+         ("chat_frames_sent_total", "frame gửi/s"),
+         ("chat_bytes_sent_total", "byte gửi/s"),
+         ("chat_frames_dropped_total", "frame bị bỏ/s"))
+LATENCIES = (("chat_fanout_seconds", "fan-out"),
+             ("chat_clients_lock_wait_seconds", "chờ clients_lock"),
+             ("chat_store_append_seconds", "ghi lịch sử"))
+
 class ServerManager:
     def __init__(self, host='127.0.0.1', port=5556):
         self.host = host
         self.port = port
         self.socket = None
         self.connected = False
+        self.decoder = LineDecoder()
+        self.next_id = 0
         
     def connect(self):
         """Kết nối đến server management"""
@@ -33,14 +46,31 @@ class ServerManager:
             return None
         
         try:
-            self.socket.send(json.dumps(command_data).encode('utf-8'))
-            
-            # Nhận phản hồi
-            response = self.socket.recv(4096).decode('utf-8')
-            return json.loads(response)
+            # mỗi lệnh một dòng JSON; phản hồi mang lại đúng "id" đã gửi
+            self.next_id += 1
+            command_data = dict(command_data, id=self.next_id)
+            self.socket.sendall((json.dumps(command_data, ensure_ascii=False) + '\n').encode('utf-8'))
+
+            # Nhận phản hồi (có thể đến trong nhiều lần recv)
+            while True:
+                for response in self.decoder.frames():
+                    if response.get('id') == self.next_id:
+                        return response
+                if not self.decoder.recv_from(self.socket):
+                    raise ConnectionError("server đã đóng kết nối")
         except Exception as e:
             print(f" Lỗi gửi lệnh: {e}")
+            self.connected = False
             return None
+
+    def get_stats(self):
+        """Lấy snapshot các chỉ số của server"""
+        response = self.send_command({"type": "stats"})
+        if response and response.get('type') == 'stats':
+            return response['stats']
+        if response:
+            print(f" Server trả lỗi: {response.get('msg')}")
+        return None
     
     def get_online_users(self):
         """Lấy danh sách user online"""
@@ -64,6 +94,18 @@ class ServerManager:
             print(" Đã gửi thông báo toàn hệ thống")
         return response
     
+    def kick_user(self, username, reason=None):
+        """Ngắt kết nối một user (sau khi gửi hết tin đang chờ cho họ)"""
+        command = {"type": "kick", "username": username}
+        if reason:
+            command["reason"] = reason
+        response = self.send_command(command)
+        if response and response.get('status') == 'kicked':
+            print(f" Đã ngắt kết nối {username}")
+        elif response:
+            print(f" Không tìm thấy user {username} trên server này")
+        return response
+
     def shutdown_server(self):
         """Yêu cầu dừng server"""
         confirm = input("  Bạn có chắc muốn dừng server? (y/n): ")
@@ -77,14 +119,47 @@ class ServerManager:
             return None
     
     def show_server_stats(self):
-        """Hiển thị thống kê server (giả lập)"""
-        users_response = self.get_online_users()
-        if users_response:
-            count = users_response.get('count', 0)
-            print(f" THỐNG KÊ SERVER:")
-            print(f"  • User online: {count}")
-            print(f"  • Port: 5555 (chat), 5556 (management)")
-            print(f"  • Status:  Đang hoạt động")
+        """Hiển thị thống kê server (tổng từ lúc khởi động)"""
+        stats = self.get_stats()
+        if not stats:
+            return None
+        uptime = stats['uptime']
+        print(f"\n THỐNG KÊ SERVER (pid {stats.get('pid')}, chạy {uptime:.0f}s):")
+        print(f"  • User online: {stats['chat_connections']}")
+        print(f"  • Kết nối đã nhận: {stats['chat_connections_accepted_total']}")
+        print(f"  • Frame nhận/gửi: {stats['chat_frames_received_total']} / {stats['chat_frames_sent_total']}")
+        print(f"  • Byte nhận/gửi: {stats['chat_bytes_received_total']} / {stats['chat_bytes_sent_total']}")
+        print(f"  • Frame bị bỏ (client chậm): {stats['chat_frames_dropped_total']}")
+        print(f"  • Hàng đợi gửi: {stats['chat_send_queue_frames']} frame, "
+              f"lớn nhất {stats['chat_send_queue_max']}")
+        print(f"  • clients_lock: {stats['chat_clients_lock_acquisitions_total']} lần lấy, "
+              f"{stats['chat_clients_lock_contended_total']} lần phải chờ")
+        for name, label in LATENCIES:
+            print(f"  • {label}: {format_latency(stats[name])}")
+        print()
+        return stats
+
+    def live_stats(self, interval=1.0):
+        """Cập nhật tốc độ mỗi interval giây (Ctrl+C để dừng)"""
+        previous = self.get_stats()
+        if not previous:
+            return
+        print(" Ctrl+C để dừng")
+        try:
+            while True:
+                time.sleep(interval)
+                current = self.get_stats()
+                if not current:
+                    return
+                # tốc độ = hiệu hai snapshot / thời gian giữa chúng
+                elapsed = current['time'] - previous['time'] or interval
+                rates = ', '.join(f"{label} {(current[name] - previous[name]) / elapsed:.0f}"
+                                  for name, label in RATES)
+                fanout = interval_quantile(previous['chat_fanout_seconds'], current['chat_fanout_seconds'], 0.99)
+                print(f"  online {current['chat_connections']}, {rates}, "
+                      f"queue max {current['chat_send_queue_max']}, fan-out p99 {format_seconds(fanout)}")
+                previous = current
+        except KeyboardInterrupt:
             print()
     
     def display_help(self):
@@ -92,7 +167,83 @@ class ServerManager:
         print("\n CÁC LỆNH QUẢN LÝ SERVER:")
         print("  users       - Hiển thị user online")
         print("  broadcast   - Gửi thông báo toàn hệ thống")
+        print("  kick        - Ngắt kết nối một user")
         print("  stats       - Hiển thị thống kê server")
+        print("  live        - Theo dõi tốc độ theo thời gian thực")
         print("  shutdown    - Dừng server")
         print("  help        - Hiển thị trợ giúp này")
-        print("  quit        - Thoát chương")
\ No newline at end of file
+        print("  quit        - Thoát chương trình")
+
+
+def format_seconds(value):
+    if value is None:
+        return "-"
+    if value == float('inf'):
+        return "> 1s"
+    return f"{value * 1000:.3g}ms"
+
+
+def format_latency(histogram):
+    """p50/p99 là cận trên của bucket chứa quan sát đó"""
+    if not histogram['count']:
+        return "chưa có số liệu"
+    mean = histogram['sum'] / histogram['count']
+    return (f"{histogram['count']} lần, trung bình {format_seconds(mean)}, "
+            f"p50 ≤ {format_seconds(histogram['p50'])}, p99 ≤ {format_seconds(histogram['p99'])}")
+
+
+def interval_quantile(before, after, q):
+    """Quantile chỉ tính trên các quan sát giữa hai snapshot"""
+    counts = [b - a for a, b in zip(before['counts'], after['counts'])]
+    total = sum(counts)
+    if not total:
+        return None
+    seen = 0
+    for bound, n in zip(after['buckets'] + [float('inf')], counts):
+        seen += n
+        if seen >= q * total:
+            return bound
+    return float('inf')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', default=5556, type=int)
+    args = parser.parse_args()
+
+    manager = ServerManager(args.host, args.port)
+    if not manager.connect():
+        return
+    manager.display_help()
+    while manager.connected:
+        try:
+            command = input("admin> ").strip().lower()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if command == 'users':
+            manager.get_online_users()
+        elif command == 'broadcast':
+            manager.broadcast_message(input("Nội dung: "))
+        elif command == 'kick':
+            username = input("Username: ").strip()
+            if username:
+                manager.kick_user(username, input("Lý do (có thể bỏ trống): ").strip())
+        elif command == 'stats':
+            manager.show_server_stats()
+        elif command == 'live':
+            manager.live_stats()
+        elif command == 'shutdown':
+            if manager.shutdown_server():
+                break
+        elif command == 'help':
+            manager.display_help()
+        elif command == 'quit':
+            break
+        elif command:
+            print(" Lệnh không hợp lệ, gõ 'help' để xem danh sách lệnh")
+    manager.socket.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,430 @@
+# wire_codec.py
+# Compact binary encoding for chat-app "message" frames, negotiated at join,
+# and the decoder for everything a negotiated connection can receive.
+#
+# A client that sends "encoding": ["binary"] in its join and gets
+# "encoding": "binary" back in join_ack may receive message frames as
+#
+#   b'\x01' length(4) tag(1) body          (length counts the body)
+#
+# and may send its own messages that way. Every other frame type stays a JSON
+# line, so JSON and binary frames share one stream; neither a JSON line nor a
+# compressed envelope (b'\x00', frame_compression.py) starts with 0x01.
+#
+# MESSAGE body: fixed fields, then room + from + to + msg as one UTF-8 string:
+#   flags(1) id(8) time(8, epoch ms) from(4) to(4) len(room)(2) len(from)(2) len(to)(2)
+# Lengths count characters, so the string is decoded once and sliced; msg is
+# the rest. from/to are user ids from the server's name table (to == 1 means
+# "all"), or the name itself when its length is non-zero (clients send names
+# inline).
+# NAME body: id(4) + name; defines an id before its first use on a connection.
+#
+# Ids are never reused, so a client's copy of the table never goes stale. The
+# server remembers per connection which ids it has defined; the definition
+# travels in the same queue item as the frame that needs it, and the set is
+# cleared whenever the send queue drops a frame so dropped definitions are
+# sent again.
+
+import re
+import struct
+import threading
+import time
+
+import frame_compression
+from line_decoder import LineDecoder, LineTooLong
+
+BINARY = 'binary'
+ENCODINGS = (BINARY,)
+
+MAGIC = 1
+HEAD = struct.Struct('!BIB')  # magic, body length, tag
+MESSAGE = 1
+NAME = 2
+
+_MESSAGE = struct.Struct('!BQQIIHHH')
+_NAME = struct.Struct('!I')
+F_ID = 1
+F_TIME = 2
+F_FROM = 4
+F_TO = 8
+F_ROOM = 16
+ALL_ID = 1
+MAX_NAME = 0xFFFF
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'  # the "time" field of JSON frames
+_times = {}    # epoch second -> formatted, for the last few seconds
+_seconds = {}  # formatted -> epoch second
+
+
+def format_time(seconds):
+    """Local time as TIME_FORMAT. Cached per second: every frame sent in the
+    same second shares one string."""
+    second = int(seconds)
+    text = _times.get(second)
+    if text is None:
+        if len(_times) > 64:
+            _times.clear()
+            _seconds.clear()
+        text = _times[second] = time.strftime(TIME_FORMAT, time.localtime(second))
+        _seconds[text] = second
+    return text
+
+
+def time_ms(text):
+    """Epoch milliseconds of a TIME_FORMAT string, or None."""
+    second = _seconds.get(text)
+    if second is None:
+        try:
+            second = int(time.mktime(time.strptime(text, TIME_FORMAT)))
+        except (TypeError, ValueError, OverflowError):
+            return None
+        if len(_seconds) > 256:
+            _seconds.clear()
+        _seconds[text] = second
+    return second * 1000
+
+
+class NameTable:
+    """Server-wide username <-> id."""
+
+    def __init__(self):
+        self._ids = {}
+        self._names = [None, 'all']
+        self._lock = threading.Lock()
+
+    def id(self, name):
+        i = self._ids.get(name)
+        if i is None:
+            with self._lock:
+                i = self._ids.get(name)
+                if i is None:
+                    i = self._ids[name] = len(self._names)
+                    self._names.append(name)
+        return i
+
+    def get(self, i, default=None):
+        return self._names[i] if 0 < i < len(self._names) else default
+
+
+def _frame(tag, body):
+    return HEAD.pack(MAGIC, len(body), tag) + body
+
+
+def name_frame(i, name):
+    return _frame(NAME, _NAME.pack(i) + name.encode('utf-8'))
+
+
+def _user(value, names, ids):
+    """(id, inline name) for a from/to field, or None if it has no binary form."""
+    if value == 'all':
+        return ALL_ID, ''
+    if type(value) is not str:
+        return None
+    if names is None:
+        return (0, value) if 0 < len(value) <= MAX_NAME else None
+    i = names.id(value)
+    ids.append(i)
+    return i, ''
+
+
+def encode_message(obj, names=None):
+    """(frame, user ids it references) for a "message" dict, or None if the
+    dict has no exact binary form (other types, extra keys, odd values).
+    names: the server's NameTable; None = send names inline (clients)."""
+    if obj.get('type') != 'message':
+        return None
+    msg = obj.get('msg')
+    if type(msg) is not str:
+        return None
+    flags = 0
+    used = 2
+    ids = []
+    msg_id = obj.get('id')
+    if msg_id is not None:
+        if type(msg_id) is not int or not 0 <= msg_id < 1 << 64:
+            return None
+        flags |= F_ID
+        used += 1
+    else:
+        msg_id = 0
+    ms = 0
+    if 'time' in obj:
+        ms = time_ms(obj['time'])
+        if ms is None or ms < 0:
+            return None
+        flags |= F_TIME
+        used += 1
+    from_id, from_name = 0, ''
+    if 'from' in obj:
+        user = _user(obj['from'], names, ids)
+        if user is None:
+            return None
+        from_id, from_name = user
+        flags |= F_FROM
+        used += 1
+    to_id, to_name = 0, ''
+    if 'to' in obj:
+        user = _user(obj['to'], names, ids)
+        if user is None:
+            return None
+        to_id, to_name = user
+        flags |= F_TO
+        used += 1
+    room = ''
+    if 'room' in obj:
+        room = obj['room']
+        if type(room) is not str or len(room) > MAX_NAME:
+            return None
+        flags |= F_ROOM
+        used += 1
+    if used != len(obj):
+        return None  # keys the binary form cannot carry
+    try:
+        text = (room + from_name + to_name + msg).encode('utf-8')
+    except UnicodeEncodeError:
+        return None
+    head = _MESSAGE.pack(flags, msg_id, ms, from_id, to_id, len(room), len(from_name), len(to_name))
+    return HEAD.pack(MAGIC, len(head) + len(text), MESSAGE) + head + text, ids
+
+
+_unpack_message = _MESSAGE.unpack_from
+_PLAIN = F_ID | F_TIME | F_FROM | F_TO  # what the server sends outside rooms
+
+
+def decode_message(buf, pos, end, names):
+    """The message dict of a MESSAGE body, same keys as its JSON form. Ids
+    missing from names (a definition lost with a dropped frame) become "#<id>"."""
+    flags, msg_id, ms, from_id, to_id, a, from_len, to_len = _unpack_message(buf, pos)
+    text = str(buf[pos + _MESSAGE.size:end], 'utf-8')
+    b = a + from_len
+    c = b + to_len
+    if c > len(text):
+        raise ValueError("bad message frame")
+    second = ms // 1000
+    if flags == _PLAIN:
+        # the common shape, built in one go
+        return {"type": "message",
+                "from": text[a:b] if from_len else names.get(from_id) or f"#{from_id}",
+                "to": text[b:c] if to_len else names.get(to_id) or f"#{to_id}",
+                "msg": text[c:], "time": _times.get(second) or format_time(second), "id": msg_id}
+    obj = {"type": "message"}
+    if flags & F_FROM:
+        obj["from"] = text[a:b] if from_len else names.get(from_id) or f"#{from_id}"
+    if flags & F_ROOM:
+        obj["room"] = text[:a]
+    if flags & F_TO:
+        obj["to"] = text[b:c] if to_len else names.get(to_id) or f"#{to_id}"
+    obj["msg"] = text[c:]
+    if flags & F_TIME:
+        obj["time"] = _times.get(second) or format_time(second)
+    if flags & F_ID:
+        obj["id"] = msg_id
+    return obj
+
+
+# ---- server side: serialize once per encoding ----
+
+_recent = threading.local()
+
+
+def remember(frame, obj):
+    """Called by the server for each JSON frame it encodes, so binary encoders
+    can use the object instead of parsing the frame back."""
+    _recent.last = (frame, obj)
+
+
+class BinaryEncoder:
+    """Shared by every binary connection. Like FrameCompressor it keeps the
+    last conversion per thread, so a fan-out encodes a frame once."""
+
+    def __init__(self, names):
+        self.names = names
+        self._local = threading.local()
+        self._defs = {}  # id -> NAME frame
+
+    def convert(self, data):
+        """(binary frame, ids) for a JSON frame, or (None, ()) to send it as is."""
+        last = getattr(self._local, 'last', None)
+        if last is not None and last[0] is data:
+            return last[1], last[2]
+        recent = getattr(_recent, 'last', None)
+        packed, ids = None, ()
+        if recent is not None and recent[0] is data:
+            encoded = encode_message(recent[1], self.names)
+            if encoded is not None:
+                packed, ids = encoded
+        # frames that arrive already encoded (backplane, replay) stay JSON
+        self._local.last = (data, packed, ids)
+        return packed, ids
+
+    def definition(self, i):
+        frame = self._defs.get(i)
+        if frame is None:
+            frame = self._defs[i] = name_frame(i, self.names.get(i))
+        return frame
+
+
+class BinarySession:
+    """Per connection: which name ids the client has been sent."""
+
+    def __init__(self, encoder):
+        self.encoder = encoder
+        self.known = set()
+        self._drops = 0
+
+    def frame(self, data, drops=0):
+        """What to queue for an encoded frame. drops: the send queue's drop count."""
+        if data[0] <= MAGIC:
+            return data  # compressed or binary already
+        packed, ids = self.encoder.convert(data)
+        if packed is None:
+            return data
+        if drops != self._drops:
+            # a dropped frame may have carried definitions: send them again
+            self._drops = drops
+            self.known.clear()
+        missing = [i for i in ids if i not in self.known]
+        if not missing:
+            return packed
+        self.known.update(missing)
+        return b''.join([self.encoder.definition(i) for i in missing] + [packed])
+
+
+def negotiate(offered):
+    if isinstance(offered, list) and BINARY in offered:
+        return BINARY
+    return None
+
+
+# ---- receiving ----
+
+_SPECIAL = re.compile(b'[\x00\x01]')
+
+
+class FrameDecoder:
+    """Decoder for a connection that may carry JSON lines, binary frames and
+    compressed envelopes. Same recv_from()/frames()/feed() interface as
+    LineDecoder; JSON lines go to an inner LineDecoder.
+
+    names: id -> name lookup; None (clients) = learn it from NAME frames.
+    The server passes its NameTable and watch_ack=False (it sends join_ack,
+    it does not receive one).
+    """
+
+    def __init__(self, max_line=None, names=None, watch_ack=True):
+        self.lines = LineDecoder(max_line=max_line) if max_line else LineDecoder()
+        self.max_line = self.lines.max_line
+        self.names = names if names is not None else {ALL_ID: 'all'}
+        self.codec = None     # compression codec, from join_ack
+        self._acked = not watch_ack  # join_ack seen
+        self._received = b''
+        self._pending = bytearray()  # incomplete frame
+        self._need = 0               # bytes it needs before it can be parsed
+        self._stream = None   # decompressor of the current compression stream
+        self._seq = 0         # next expected chunk of it
+
+    def recv_from(self, sock, size=frame_compression.RECV_SIZE):
+        self._received = sock.recv(size)
+        return len(self._received)
+
+    def frames(self):
+        data, self._received = self._received, b''
+        return self.feed(data)
+
+    def _plain(self, data, out):
+        msgs = self.lines.feed(data)
+        if not self._acked:
+            # the codec applies from the frame after join_ack, which may be
+            # in this same chunk
+            for msg in msgs:
+                if msg.get('type') == 'join_ack':
+                    self._acked = True
+                    self.codec = frame_compression.CODECS.get(msg.get('compress'))
+        out += msgs
+
+    def feed(self, data):
+        if self._pending:
+            self._pending += data
+            if len(self._pending) < self._need:
+                return []
+            data = bytes(self._pending)
+            self._pending = bytearray()
+        out = []
+        rest = self._scan(data, out)
+        if rest is not None:
+            self._pending = bytearray(data[rest:])
+        return out
+
+    def _scan(self, data, out):
+        """Parse data into out. Returns the offset of an incomplete trailing
+        frame (and sets _need), or None."""
+        pos = 0
+        end = len(data)
+        while pos < end:
+            start = pos
+            if data[pos] > MAGIC:
+                # JSON lines up to the next binary frame or envelope
+                match = _SPECIAL.search(data, pos)
+                if match is None:
+                    self._plain(data[pos:] if pos else data, out)
+                    return None
+                start = match.start()
+                self._plain(data[pos:start], out)
+            head = HEAD if data[start] == MAGIC else frame_compression.HEADER
+            if end - start < head.size:
+                self._need = head.size
+                return start
+            if head is HEAD:
+                _, length, tag = HEAD.unpack_from(data, start)
+            else:
+                _, tag, seq, length = head.unpack_from(data, start)
+            if length > self.max_line:
+                raise LineTooLong(f"frame longer than {self.max_line} bytes")
+            body = start + head.size
+            pos = body + length
+            if pos > end:
+                self._need = head.size + length
+                return start
+            if head is not HEAD:
+                self._envelope(tag, seq, data[body:pos], out)
+            elif tag == MESSAGE:
+                try:
+                    out.append(decode_message(data, body, pos, self.names))
+                except (ValueError, struct.error):
+                    pass  # bad frame: skip it, like a bad JSON line
+            else:
+                self._binary(tag, data, body, pos)
+        return None
+
+    def _binary(self, tag, data, start, end):
+        try:
+            if tag == NAME:
+                (i,) = _NAME.unpack_from(data, start)
+                name = str(data[start + _NAME.size:end], 'utf-8')
+                if isinstance(self.names, dict):
+                    self.names[i] = name  # the server's own table is never taught by clients
+        except (ValueError, struct.error):
+            pass  # bad frame: skip it, like a bad JSON line
+
+    def _envelope(self, kind, seq, payload, out):
+        codec = self.codec
+        if codec is None:
+            return  # not negotiated: ignore
+        try:
+            if kind == frame_compression.FRAME:
+                raw = codec.decompress(payload)
+            elif kind == frame_compression.STREAM_START:
+                self._stream = codec.decompressor()
+                self._seq = 1
+                raw = self._stream(payload)
+            elif kind == frame_compression.STREAM and self._stream is not None and seq == self._seq:
+                self._seq = (self._seq + 1) & 0xFFFF
+                raw = self._stream(payload)
+            else:
+                self._stream = None  # a chunk went missing: skip to the next stream
+                return
+        except Exception:
+            self._stream = None
+            return
+        # a decompressed payload holds whole frames, JSON or binary
+        self._scan(raw, out)